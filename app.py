@@ -1,9 +1,9 @@
+import os
 import traceback
 import logging.config
 
 from flask import Flask
-from flask import render_template, request, redirect, url_for
-from sqlalchemy import desc
+from flask import render_template, request, redirect, url_for, jsonify, Response
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder='app/templates', static_folder='app/static')
@@ -16,11 +16,17 @@ logging.config.fileConfig(app.config['LOGGING_CONFIG'])
 logger = logging.getLogger(app.config['APP_NAME'])
 logger.debug('Web app log')
 
-from src.results_db import Results, ResultsManager
+from src.json_api import gzip_body, parse_columns, players_json, strong_etag
+from src.page_cache import PageCache
+from src.results_db import Results, ResultsManager, page_query, read_leaderboard
 
-# Initialize the database session
+# Initialize the database session. Flask-SQLAlchemy gives each request its own session and removes it when the
+# request ends, returning the connection to this process's pool
 results_manager = ResultsManager(app)
 
+# Pages only change when populate_db writes a new dataset, which bumps the dataset version stamp
+page_cache = PageCache(results_manager.dataset_version, app.config['PAGE_CACHE_SIZE'], app.config['VERSION_CHECK_SECONDS'])
+
 
 # Create first view of app
 @app.route('/', methods=['GET','POST'])
@@ -50,12 +56,79 @@ def get_input():
         return redirect(url_for_post)
 
 
+def page_stats(player_filter, sort_col, after=None):
+    """Query one page of the players of one type sorted by a statistics column
+    Args:
+        player_filter: (string), Required: The player type chosen by the user
+        sort_col: (String), Required: The column to sort by as chosen by the user
+        after: (tuple), Optional: Sort column value and player_id of the last player of the previous page
+    Returns:
+        stats: (list of dict): Column values of each player on the page
+        next_after: (tuple): Cursor of the next page, or None if this is the last page
+    """
+    limit = app.config["MAX_ROWS_SHOW"]
+    # Read the first page from the leaderboard populate_db precomputed for the player type and sort column with one primary key lookup
+    stats = read_leaderboard(results_manager.session, player_filter, sort_col) if after is None else None
+    if stats is None:
+        # Query the database using the player type input as a filter, ordering by the sort column input and seeking past the previous page
+        # The query is served from the composite index on player type, the sort column and player id
+        players = page_query(results_manager.session, player_filter, sort_col, limit+1, after).all()
+        # Keep plain values so cached results never depend on the database session
+        columns = [column.name for column in Results.__table__.columns]
+        stats = [{column: getattr(player, column) for column in columns} for player in players]
+
+    # One player more than a page tells whether there is a next page, which starts after the last player shown
+    if len(stats) > limit:
+        stats = stats[:limit]
+        return stats, (stats[-1][sort_col], stats[-1]['player_id'])
+    return stats, None
+
+
+def render_index(player_filter, sort_col, after=None):
+    """Query one page of the players of one type sorted by a statistics column and render the index page
+    Args:
+        player_filter: (string), Required: The player type chosen by the user
+        sort_col: (String), Required: The column to sort by as chosen by the user
+        after: (tuple), Optional: Sort column value and player_id of the last player of the previous page
+    Returns:
+        stats: (list of dict): Column values of each player shown
+        page: (String): Rendered index html template
+    """
+    stats, next_after = page_stats(player_filter, sort_col, after)
+    next_url = None
+    if next_after is not None:
+        next_url = url_for('index', player_filter=player_filter, sort_col=sort_col, after=next_after[0], after_id=next_after[1])
+    return stats, render_template('index.html', stats=stats, player_filter=player_filter, sort_col=sort_col, next_url=next_url)
+
+
+def page_cursor(sort_col):
+    """
+    Get the cursor of the requested page from the `after` and `after_id` query parameters
+    Args:
+        sort_col: (String), Required: Column the pages are sorted by, whose type the `after` value must have
+    Returns:
+        after: (tuple): Sort column value and player_id of the last player of the previous page, None for the first page
+    """
+    after = request.args.get('after')
+    after_id = request.args.get('after_id')
+    if after is None or after_id is None:
+        return None
+    column = Results.__table__.columns.get(sort_col)
+    if column is not None:
+        try:
+            after = column.type.python_type(after)
+        except ValueError:
+            raise ValueError('Invalid page cursor for %s: %s' % (sort_col, after))
+    return after, after_id
+
+
 # Create second view (index) of app
 @app.route('/index/<player_filter>/<sort_col>', methods=['GET','POST'])
 def index(player_filter, sort_col):
     """Main view that displays players filtered by player type and sorted by a statistics column.
     Create view into index page that uses data queried from Results database and
-    inserts it into the app/templates/index.html template.
+    inserts it into the app/templates/index.html template. Pages after the first are requested with the `after` and
+    `after_id` query parameters of the next page link.
     Args:
         player_filter: (string), Required: The player type chosen by the user
         sort_col: (String), Required: The column to sort by as chosen by the user
@@ -69,10 +142,17 @@ def index(player_filter, sort_col):
             logger.info('Button pressed to return to selection page.')
             return redirect(url_for('get_input'))
         else:
-            # Query the database using the player type input as a filter, ordering by the sort column input, and limiting to 100 records
-            stats = results_manager.session.query(Results).filter(Results.player_type == player_filter).order_by(desc(sort_col)).limit(app.config["MAX_ROWS_SHOW"]).all()
+            # Pages after the first carry the sort column value and player id of the last player of the previous page
+            try:
+                after = page_cursor(sort_col)
+            except ValueError as e:
+                logger.warning(str(e))
+                return render_template('error.html'), 400
+
+            # Repeat views of the same page are served from the cache until the dataset version changes
+            stats, page = page_cache.get((player_filter, sort_col, after), lambda: render_index(player_filter, sort_col, after))
             logger.info('Players statistics display filtered by %s and sorted by %s', player_filter, sort_col)
-            return render_template('index.html', stats=stats, player_filter=player_filter, sort_col=sort_col)
+            return page
     except:
         # If an error occurs, display the traceback of the error and the error view
         traceback.print_exc()
@@ -80,5 +160,79 @@ def index(player_filter, sort_col):
         return render_template('error.html')
 
 
+@app.route('/api/players/<player_filter>/<sort_col>', methods=['GET'])
+def api_players(player_filter, sort_col):
+    """JSON view of the players shown by the index view, with only the requested columns. Responses carry a strong
+    ETag derived from the dataset version, so a client repeating a request with If-None-Match gets an empty 304
+    until populate_db writes new data, and are gzip compressed for clients that accept it
+    Args:
+        player_filter: (string), Required: Player type to show
+        sort_col: (String), Required: Column to sort by
+    Returns:
+        JSON with the players and a link to the next page (or a 304, or a 400 for bad parameters)
+    """
+    columns = [column.name for column in Results.__table__.columns]
+    try:
+        if sort_col not in columns:
+            raise ValueError('Unknown sort column: %s' % sort_col)
+        fields = parse_columns(request.args.get('columns'), columns)
+        after = page_cursor(sort_col)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Answer a client that already has this representation before doing any work
+    compress = 'gzip' in request.accept_encodings
+    etag = strong_etag(page_cache.version(), request.full_path, compress)
+    headers = {'ETag': '"%s"' % etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    def build():
+        stats, next_after = page_stats(player_filter, sort_col, after)
+        next_url = None
+        if next_after is not None:
+            next_url = url_for('api_players', player_filter=player_filter, sort_col=sort_col, after=next_after[0],
+                               after_id=next_after[1], columns=request.args.get('columns'))
+        body = players_json(stats, fields, player_type=player_filter, sort_col=sort_col, next=next_url)
+        # Small bodies are not worth compressing
+        return body, gzip_body(body) if len(body) >= app.config['GZIP_MIN_BYTES'] else None
+
+    try:
+        body, compressed = page_cache.get(('json', player_filter, sort_col, after, tuple(fields)), build)
+    except:
+        traceback.print_exc()
+        logger.warning('Not able to return players as JSON, error returned')
+        return jsonify({'error': 'Players could not be retrieved'}), 500
+
+    if compress and compressed is not None:
+        body = compressed
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """View that checks the database answers and reports the connection pool and page cache of this worker process
+    Args:
+        None
+    Returns:
+        JSON with the database status, pool counters and cache counters (status 503 if the database did not answer)
+    """
+    report = dict(results_manager.health(), cache=page_cache.stats(), pid=os.getpid())
+    report['status'] = 'ok' if report['database'] else 'error'
+    return jsonify(report), 200 if report['database'] else 503
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """View that reports the page cache hit and miss counters
+    Args:
+        None
+    Returns:
+        JSON with the cache hits, misses, cached pages and dataset version
+    """
+    return jsonify(page_cache.stats())
+
+
 if __name__ == '__main__':
     app.run(debug=app.config['DEBUG'], port=app.config['PORT'], host=app.config['HOST'])
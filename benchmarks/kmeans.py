@@ -0,0 +1,56 @@
+"""Compare the runtime and cluster quality of the full-batch and mini-batch K-means engines on the bundled raw data
+scaled up synthetically.
+
+Run from the repository root:
+    python -m benchmarks.kmeans --scales 1 10 50
+"""
+import argparse
+import logging
+import time
+
+import pandas as pd
+import yaml
+from sklearn.metrics import adjusted_rand_score
+
+from benchmarks.silhouette import load_features, scale_up
+from src.model_pipeline import cluster_silhouette, fit_kmeans
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the full-batch and mini-batch K-means engines')
+    parser.add_argument('--loadpath', default='data/external/sports_ref.csv', help='Local path of the raw data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 50], help='Multiples of the real number of players.')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1024, 4096], help='Mini-batch sizes to try.')
+    parser.add_argument('--n_clusters', type=int, default=5, help='Number of clusters fitted.')
+    args = parser.parse_args()
+
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    kmeans_all = config['model_pipeline']['kmeans_all']
+    settings = [kmeans_all[name] for name in ['init_type', 'n_init', 'max_iter', 'random_state']]
+    base = load_features(config, args.loadpath)
+
+    rows = []
+    for scale in args.scales:
+        features = scale_up(base, scale, kmeans_all['random_state'])
+        full = None
+        for engine, batch_size in [('full', None)] + [('minibatch', size) for size in args.batch_sizes]:
+            start = time.perf_counter()
+            fit = fit_kmeans(features, args.n_clusters, *settings, engine=engine, batch_size=batch_size or 1024)
+            seconds = time.perf_counter()-start
+            full = fit if engine == 'full' else full
+            # Silhouette scores are estimated from a sample so they stay cheap at every scale
+            score, _ = cluster_silhouette(features, fit.labels, mode='sampled', sample_size=2000, random_state=kmeans_all['random_state'])
+            rows.append({'scale': scale, 'players': len(features), 'engine': engine if batch_size is None else '%s %i' % (engine, batch_size),
+                         'seconds': round(seconds, 3), 'sse_vs_full': round(fit.inertia/full.inertia, 4),
+                         'ari_vs_full': round(adjusted_rand_score(full.labels, fit.labels), 4), 'silhouette': round(score, 4)})
+            logger.info('%ix scale, %s engine: %.3fs', scale, engine, seconds)
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)-12s %(levelname)-8s %(message)s')
+    main()
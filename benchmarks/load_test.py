@@ -0,0 +1,258 @@
+"""Measure the throughput and tail latency of the web app's routes against a local SQLite fixture.
+
+The fixture database is built from the bundled raw data through the pipeline's cleaning, featurizing, clustering and
+loading functions, optionally scaled up with synthetic players. The app is then served by Gunicorn with
+config/gunicorn.conf.py (or an already running server is used with --url) and every route and sort column is driven
+at each concurrency level. Results are printed and saved as JSON so runs can be compared over time.
+
+Run from the repository root:
+    python -m benchmarks.load_test --scale 10 --concurrency 1 8 32
+"""
+import argparse
+import datetime
+import html
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from src.clean_featurize import clean_data, featurize
+from src.data_io import read_table
+from src.model_pipeline import final_cluster_fit
+from src.results_db import RESULTS_COLUMNS, SORT_COLUMNS, ResultsManager, create_db
+
+logger = logging.getLogger(__name__)
+
+NEXT_PAGE = re.compile(r'href = "([^"]+)">Next page')
+
+
+def synthesize_players(df, scale, random_state):
+    """
+    Make a player set `scale` times larger by adding resampled copies of real players with jittered statistics
+    Args:
+        df: (Pandas DataFrame), Required: Cleaned players with player types
+        scale: (int), Required: Multiple of the real number of players to generate
+        random_state: (int), Required: Random seed
+    Returns:
+        df: (Pandas DataFrame): Real and synthetic players
+    """
+    if scale <= 1:
+        return df
+    rng = np.random.RandomState(random_state)
+    synthetic = df.iloc[rng.randint(0, len(df), len(df)*(scale-1))].reset_index(drop=True)
+    synthetic['player_id'] = synthetic['player_id'] + '-synthetic-' + synthetic.index.astype(str)
+
+    # Spread statistics by up to 10% either way so sorted pages are not runs of identical copies
+    for _, df_col, cast in RESULTS_COLUMNS:
+        if cast is not None and df_col not in ('height', 'weight'):
+            values = synthetic[df_col]*rng.uniform(.9, 1.1, len(synthetic))
+            synthetic[df_col] = values.round().astype('int64') if cast is int else values
+    return pd.concat([df, synthetic], ignore_index=True)
+
+
+def build_fixture(config, loadpath, db_path, scale=1):
+    """
+    Build a SQLite results database the way get_clusters and populate_db do
+    Args:
+        config: (dict), Required: Configuration loaded from config/config.yaml
+        loadpath: (String), Required: Local path of the raw data
+        db_path: (String), Required: Path of the SQLite database file, replaced if it exists
+        scale: (int), Optional: Multiple of the real number of players loaded
+    Returns:
+        engine_string: (String): Engine string of the fixture database
+        num_players: (int): Number of players loaded
+        player_types: (list of Strings): Player types of the loaded players
+    """
+    config_data = config['api_getdata']['acquire_data']
+    config_clean = config['clean_featurize']
+    config_model = config['model_pipeline']
+    df = clean_data(read_table(loadpath), config_data['season'], config_data['season_col'], **config_clean['clean_data'])
+    features = featurize(df, **config_clean['featurize'])
+    clusters = final_cluster_fit(features, **config_model['kmeans_all'], **dict(config_model['final_cluster_fit'], model_path=None))
+    players = synthesize_players(clusters, scale, config_model['kmeans_all']['random_state'])
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    engine_string = 'sqlite:///%s' % os.path.abspath(db_path)
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+    num_players = rm.bulk_load(players, **config['results_db']['bulk_load'])
+    player_types = sorted(players[config_model['final_cluster_fit']['player_type_col']].unique())
+    rm.close()
+    return engine_string, num_players, player_types
+
+
+def start_server(engine_string, port, workers, threads):
+    """
+    Serve the app with Gunicorn and wait until its health check answers
+    Args:
+        engine_string: (String), Required: Engine string of the database served
+        port: (int), Required: Local port to listen on
+        workers: (int), Required: Number of Gunicorn worker processes
+        threads: (int), Required: Number of threads in each worker
+    Returns:
+        server: (Popen): Server process
+        url: (String): Base URL of the server
+    """
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI=engine_string, PORT=str(port), WEB_CONCURRENCY=str(workers),
+               GUNICORN_THREADS=str(threads))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'config/gunicorn.conf.py', 'app:app'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:%i' % port
+    deadline = time.monotonic()+60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('The app server exited with code %i' % server.returncode)
+        try:
+            urllib.request.urlopen(url+'/health', timeout=2).read()
+            return server, url
+        except (urllib.error.URLError, OSError):
+            time.sleep(.5)
+    server.terminate()
+    raise RuntimeError('The app server did not answer its health check within 60 seconds')
+
+
+def fetch(url):
+    """Request one page, returning the HTTP status, latency in seconds and body"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body, status = b'', e.code
+    except (urllib.error.URLError, OSError):
+        body, status = b'', 0
+    return status, time.perf_counter()-start, body
+
+
+def page_urls(url, player_types, sort_col, pages):
+    """
+    Get the URLs of the first pages of every player type sorted by one column, following the next page links
+    Args:
+        url: (String), Required: Base URL of the server
+        player_types: (list of Strings), Required: Player types to page through
+        sort_col: (String), Required: Column the pages are sorted by
+        pages: (int), Required: Number of pages of each player type
+    Returns:
+        urls: (list of Strings): Page URLs
+    """
+    urls = []
+    for player_type in player_types:
+        page = '/index/%s/%s' % (urllib.parse.quote(player_type), sort_col)
+        for _ in range(pages):
+            urls.append(url+page)
+            status, _, body = fetch(url+page)
+            match = NEXT_PAGE.search(body.decode('utf-8', 'replace'))
+            if status != 200 or not match:
+                break
+            page = html.unescape(match.group(1))
+    return urls
+
+
+def drive(urls, requests, concurrency):
+    """
+    Request pages at a fixed concurrency and summarize the latencies
+    Args:
+        urls: (list of Strings), Required: Pages requested in turn
+        requests: (int), Required: Number of requests sent
+        concurrency: (int), Required: Number of requests in flight at once
+    Returns:
+        summary: (dict): Requests, errors, throughput and latency percentiles in milliseconds
+    """
+    targets = list(itertools.islice(itertools.cycle(urls), requests))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, targets))
+    seconds = time.perf_counter()-start
+
+    latencies = np.array([latency for _, latency, _ in results])*1e3
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'requests': requests, 'errors': sum(status != 200 for status, _, _ in results), 'seconds': round(seconds, 3),
+            'requests_per_second': round(requests/seconds, 1), 'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2),
+            'p99_ms': round(p99, 2), 'max_ms': round(latencies.max(), 2)}
+
+
+def git_commit():
+    """Get the commit the app was tested at, or None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the web app routes against a local SQLite fixture')
+    parser.add_argument('--loadpath', default='data/external/sports_ref.csv', help='Local path of the raw data.')
+    parser.add_argument('--db_path', default='data/load_test/results.db', help='Path of the SQLite fixture database.')
+    parser.add_argument('--scale', type=int, default=1, help='Multiple of the real number of players in the fixture.')
+    parser.add_argument('--reuse_db', action='store_true', help='Use the fixture database from an earlier run as is.')
+    parser.add_argument('--url', default=None, help='Base URL of an already running app. Gunicorn is started if not given.')
+    parser.add_argument('--port', type=int, default=5055, help='Port of the Gunicorn server started for the test.')
+    parser.add_argument('--workers', type=int, default=2, help='Gunicorn worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='Threads in each Gunicorn worker.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help='Requests in flight at once.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests sent to each route and sort column at each concurrency.')
+    parser.add_argument('--pages', type=int, default=1, help='Pages of each player type requested, following next page links.')
+    parser.add_argument('--output', default=None, help='Path of the JSON results. Defaults to a timestamped file next to the fixture.')
+    args = parser.parse_args()
+
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    engine_string = 'sqlite:///%s' % os.path.abspath(args.db_path)
+    if args.reuse_db and os.path.exists(args.db_path):
+        rm = ResultsManager(engine_string=engine_string)
+        num_players = rm.session.execute('SELECT COUNT(*) FROM results').scalar()
+        player_types = [row[0] for row in rm.session.execute('SELECT DISTINCT player_type FROM results ORDER BY player_type')]
+        rm.close()
+    else:
+        engine_string, num_players, player_types = build_fixture(config, args.loadpath, args.db_path, args.scale)
+    logger.info('Fixture database holds %i players of %i player types.', num_players, len(player_types))
+
+    server, url = (None, args.url.rstrip('/')) if args.url else start_server(engine_string, args.port, args.workers, args.threads)
+    try:
+        targets = [('get_input', None, [url+'/'])]
+        targets += [('index', sort_col, page_urls(url, player_types, sort_col, args.pages)) for sort_col in SORT_COLUMNS]
+        rows = []
+        for concurrency in args.concurrency:
+            for route, sort_col, urls in targets:
+                summary = drive(urls, args.requests, concurrency)
+                rows.append(dict({'concurrency': concurrency, 'route': route, 'sort_col': sort_col}, **summary))
+                logger.info('%s %s at concurrency %i: %.1f requests per second, p99 %.1fms', route, sort_col or '',
+                            concurrency, summary['requests_per_second'], summary['p99_ms'])
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    output = args.output or os.path.join(os.path.dirname(args.db_path), 'load_test_%s.json' % stamp)
+    report = {'timestamp': stamp, 'git_commit': git_commit(), 'players': num_players, 'scale': args.scale,
+              'url': args.url, 'workers': None if args.url else args.workers, 'threads': None if args.url else args.threads,
+              'pages': args.pages, 'requests': args.requests, 'results': rows}
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info('Load test results saved to %s', output)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)-12s %(levelname)-8s %(message)s')
+    main()
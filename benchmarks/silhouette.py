@@ -0,0 +1,103 @@
+"""Compare the time and accuracy of the Silhouette score modes on the bundled raw data scaled up synthetically.
+
+Run from the repository root:
+    python -m benchmarks.silhouette --scales 1 10 50
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+import yaml
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+from src.clean_featurize import clean_data, featurize
+from src.data_io import read_table
+from src.model_pipeline import cluster_silhouette
+
+logger = logging.getLogger(__name__)
+
+
+def load_features(config, loadpath):
+    """
+    Clean and featurize the raw data the same way `run.py get_clusters` does
+    Args:
+        config: (dict), Required: Configuration loaded from config/config.yaml
+        loadpath: (String), Required: Local path of the raw data
+    Returns:
+        features: (numpy array): Scaled features used in clustering
+    """
+    config_data = config['api_getdata']['acquire_data']
+    config_clean = config['clean_featurize']
+    df = clean_data(read_table(loadpath), config_data['season'], config_data['season_col'], **config_clean['clean_data'])
+    df = featurize(df, **config_clean['featurize'])
+    return StandardScaler().fit_transform(df[config['model_pipeline']['kmeans_all']['cluster_cols']])
+
+
+def scale_up(features, scale, random_state):
+    """
+    Make a synthetic player set `scale` times larger by resampling players and jittering their features
+    Args:
+        features: (numpy array), Required: Scaled features of the real players
+        scale: (int), Required: Multiple of the real number of players to generate
+        random_state: (int), Required: Random seed
+    Returns:
+        features: (numpy array): Synthetic scaled features
+    """
+    if scale == 1:
+        return features
+    rng = np.random.RandomState(random_state)
+    rows = rng.randint(0, len(features), len(features)*scale)
+    return features[rows] + rng.normal(0, .05, size=(len(rows), features.shape[1]))
+
+
+def time_mode(features, labels, **kwargs):
+    """Time one Silhouette score calculation"""
+    start = time.perf_counter()
+    score, margin = cluster_silhouette(features, labels, **kwargs)
+    return score, margin, time.perf_counter()-start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the exact, chunked and sampled Silhouette score modes')
+    parser.add_argument('--loadpath', default='data/external/sports_ref.csv', help='Local path of the raw data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 50], help='Multiples of the real number of players.')
+    parser.add_argument('--sample_sizes', type=int, nargs='+', default=[1000, 5000], help='Players sampled in sampled mode.')
+    parser.add_argument('--max_exact_rows', type=int, default=110000,
+                        help='Largest player set the exact mode runs on. The chunked mode runs on every set and gives the same score.')
+    parser.add_argument('--n_clusters', type=int, default=5, help='Number of clusters fitted.')
+    args = parser.parse_args()
+
+    with open('config/config.yaml', 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    random_state = config['model_pipeline']['kmeans_all']['random_state']
+    working_memory = config['model_pipeline']['optimal_clusternum']['silhouette']['working_memory']
+    base = load_features(config, args.loadpath)
+
+    rows = []
+    for scale in args.scales:
+        features = scale_up(base, scale, random_state)
+        labels = KMeans(n_clusters=args.n_clusters, n_init=1, random_state=random_state).fit(features).labels_
+        runs = [('exact', {})] if len(features) <= args.max_exact_rows else []
+        # The chunked mode always runs, so the sampled scores of every scale are compared with the exact score
+        runs += [('chunked', {'working_memory': working_memory})]
+        runs += [('sampled n=%i' % n, {'sample_size': n, 'random_state': random_state, 'working_memory': working_memory})
+                 for n in args.sample_sizes]
+
+        exact = None
+        for name, kwargs in runs:
+            score, margin, seconds = time_mode(features, labels, mode=name.split()[0], **kwargs)
+            exact = score if exact is None and name in ('exact', 'chunked') else exact
+            rows.append({'scale': scale, 'players': len(features), 'mode': name, 'seconds': round(seconds, 3),
+                         'score': round(score, 4), 'ci95': round(margin, 4),
+                         'error': round(abs(score-exact), 4) if exact is not None else np.nan})
+            logger.info('%ix scale, %s: %.3fs', scale, name, seconds)
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)-12s %(levelname)-8s %(message)s')
+    main()
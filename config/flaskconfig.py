@@ -8,6 +8,9 @@ SQLALCHEMY_TRACK_MODIFICATIONS = True
 HOST = '0.0.0.0'
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 100
+PAGE_CACHE_SIZE = 128  # Rendered pages kept in memory, one per player type and sort column
+VERSION_CHECK_SECONDS = 5  # Time between reads of the dataset version stamp. A new dataset can take this long to show
+GZIP_MIN_BYTES = 1000  # Smallest JSON API response that is gzip compressed for clients accepting it
 
 # Connection string
 DB_HOST = os.environ.get('MYSQL_HOST')
@@ -25,3 +28,14 @@ else:
     SQLALCHEMY_DATABASE_URI = '{dialect}://{user}:{pw}@{host}:{port}/{db}'.format(dialect=DB_DIALECT, user=DB_USER,
                                                                                   pw=DB_PW, host=DB_HOST, port=DB_PORT,
                                                                                   db=DATABASE)
+
+# Connection pool of each server process. Pre-ping replaces connections the database closed while they sat in the
+# pool, and recycling retires them before MySQL's idle timeout. SQLite pools connections per thread without a size
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+    SQLALCHEMY_ENGINE_OPTIONS.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                                     pool_recycle=DB_POOL_RECYCLE)
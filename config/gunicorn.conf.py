@@ -0,0 +1,19 @@
+# Gunicorn settings for serving the app with several worker processes: gunicorn --config config/gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = '0.0.0.0:%s' % os.environ.get('PORT', 5000)
+# Each worker has its own connection pool and page cache, so workers times DB_POOL_SIZE plus DB_MAX_OVERFLOW
+# connections must fit within the database's connection limit
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()*2+1))
+# Threads let one worker serve several scouts while others wait on the database
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 30
+# Load the app once before forking so workers share its memory and start quickly
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Connections opened while the app loaded belong to the master process and must not be shared with workers
+    from app import results_manager
+    results_manager.dispose()
@@ -1,24 +1,25 @@
 import argparse
 import logging
 import logging.config
+import sys
 
 logging.config.fileConfig('config/logging/local.conf')
 logger = logging.getLogger(__name__)
 
 import yaml
-import pandas as pd
 
-from src.api_getdata import acquire_data, upload_data
-from src.results_db import create_db, ResultsManager
-from src.clean_featurize import download_from_s3, clean_data, featurize
-from src.model_pipeline import optimal_clusternum, test_cluster_stability, final_cluster_fit
 from config.flaskconfig import SQLALCHEMY_DATABASE_URI
 
+# Each subcommand imports the modules it uses when it runs, so short jobs such as create_db do not load
+# sportsipy, scikit-learn or matplotlib. Run with --profile-startup to see where import time goes
+
 
 if __name__ == '__main__':
 
     # Add parsers for both creating a database and downloading raw data
     parser = argparse.ArgumentParser(description='Create database or get data')
+    parser.add_argument('--profile-startup', '--profile_startup', dest='profile_startup', action='store_true',
+                        help='Run the command and report the time spent importing each top level module.')
     subparsers = parser.add_subparsers(dest='subparser_name')
 
     # Sub-parser for creating a database
@@ -26,19 +27,74 @@ if __name__ == '__main__':
     sb_create.add_argument('--engine_string', default=SQLALCHEMY_DATABASE_URI,
                            help='SQLAlchemy connection URI for database.')
 
+    # Sub-parser for adding missing indexes to an existing database
+    sb_migrate = subparsers.add_parser('migrate_db', description='Add missing indexes to an existing database and check the app queries use them')
+    sb_migrate.add_argument('--engine_string', default=SQLALCHEMY_DATABASE_URI,
+                           help='SQLAlchemy connection URI for database.')
+
     # Sub-parser for downloading data to local or uploading to S3
     sb_download = subparsers.add_parser('get_data', description='Download data to local path or S3 bucket')
     sb_download.add_argument('--savepath', default='data/external/sports_ref.csv',
-                           help='S3 or local filepath location to save data.')
+                           help='S3 or local filepath location to save data. Use a .parquet or .feather suffix for columnar storage.')
     sb_download.add_argument('--source', default='local',
                            help='Location to obtain data for upload: Type "api" or "local"')
+    sb_cache = sb_download.add_mutually_exclusive_group()
+    sb_cache.add_argument('--resume', action='store_true',
+                           help='Reuse cached payloads of the teams an earlier API run completed, even if they expired.')
+    sb_cache.add_argument('--refresh', action='store_true',
+                           help='Ignore and clear the API cache and fetch everything again.')
+    sb_download.add_argument('--incremental', action='store_true',
+                           help='With the api source, only merge new players and current-season rows into the data already at savepath.')
+    sb_download.add_argument('--changelog', default='data/external/sports_ref_changes.csv',
+                           help='S3 or local filepath to save the rows touched by an incremental refresh.')
 
     # Sub-parser for cleaning data and running K-means clustering
     sb_model = subparsers.add_parser('get_clusters', description='Run K-means clustering to get player types')
     sb_model.add_argument('--loadpath', default='data/external/sports_ref.csv',
                            help='S3 or local path used to obtain raw data.')
     sb_model.add_argument('--savepath', default='data/sports_ref_clean.csv',
-                           help='Local path to save cleaned data with cluster labels.')
+                           help='Local path to save cleaned data with cluster labels. Use a .parquet or .feather suffix for columnar storage.')
+    sb_model.add_argument('--streaming', action='store_true',
+                           help='Clean the raw data in chunks, keeping only the rows of the season being clustered in memory.')
+    sb_model.add_argument('--no_cache', action='store_true',
+                           help='Fit every model from scratch without reading or writing the model artifact cache.')
+    sb_model.add_argument('--no_plots', '--no-plots', action='store_true',
+                           help='Skip rendering the plots. They can be rendered later from the saved metrics with the plot command.')
+
+    # Sub-parser for rendering the plots from saved metrics and labels
+    sb_plot = subparsers.add_parser('plot', description='Render the clustering plots from the metrics and labels saved by get_clusters')
+    sb_plot.add_argument('--loadpath', default='data/sports_ref_clean.csv',
+                           help='Local path of the cleaned data with cluster labels saved by get_clusters.')
+    sb_plot.add_argument('--metrics_path', default=None,
+                           help='Path of the clustering metrics saved by get_clusters. Defaults to the path in config/config.yaml.')
+
+    # Sub-parser for running the pipeline over many seasons
+    sb_backfill = subparsers.add_parser('backfill', description='Get data and player types for a range of seasons, one partition per season')
+    sb_backfill.add_argument('--start_year', type=int, default=2010,
+                           help='Year the first season ends in, such as 2010 for the 2009-10 season.')
+    sb_backfill.add_argument('--end_year', type=int, default=2021,
+                           help='Year the last season ends in.')
+    sb_backfill.add_argument('--years', type=int, nargs='+',
+                           help='Run only these seasons (by the year they end in) instead of the start to end range.')
+    sb_backfill.add_argument('--retry_failed', action='store_true',
+                           help='Run only the seasons that failed in an earlier backfill.')
+    sb_backfill.add_argument('--workers', type=int, default=4,
+                           help='Number of seasons processed at the same time.')
+    sb_backfill.add_argument('--refetch', action='store_true',
+                           help='Download raw data again even if the season already has a raw partition.')
+    sb_backfill.add_argument('--no_plots', '--no-plots', action='store_true',
+                           help='Skip rendering the plots of every season.')
+
+    # Sub-parser for labelling new players with the saved cluster model
+    sb_assign = subparsers.add_parser('assign_players', description='Label new players with the saved cluster model and write only their rows to the database')
+    sb_assign.add_argument('--loadpath', required=True,
+                           help='S3 or local path of raw data for the new players, in the format saved by get_data.')
+    sb_assign.add_argument('--model_path', default=None,
+                           help='Path of the cluster model saved by get_clusters. Defaults to the path in config/config.yaml.')
+    sb_assign.add_argument('--engine_string', default=SQLALCHEMY_DATABASE_URI,
+                           help='SQLAlchemy connection URI for database.')
+    sb_assign.add_argument('--savepath', default=None,
+                           help='Local path to also save the labelled players to.')
 
     # Sub-parser for populating the database
     sb_populate = subparsers.add_parser('populate_db', description='Populate database with player data and types')
@@ -46,10 +102,17 @@ if __name__ == '__main__':
                            help='SQLAlchemy connection URI for database.')
     sb_populate.add_argument('--loadpath', default='data/sports_ref_clean.csv',
                            help='Local path to load cleaned data with cluster labels.')
+    sb_populate.add_argument('--sync', default=False, action='store_true',
+                           help='Update an already populated table, writing only the players that changed.')
     # Get all args
     args = parser.parse_args()
     sp_used = args.subparser_name
 
+    # Rerun the command in a child process that reports its imports
+    if args.profile_startup:
+        from src.startup import profile_startup
+        sys.exit(profile_startup([arg for arg in sys.argv if arg not in ('--profile-startup', '--profile_startup')]))
+
     # Open yaml file and get all variables
     with open('config/config.yaml', 'r') as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
@@ -63,20 +126,51 @@ if __name__ == '__main__':
 
     # Create database when create_db arg is input
     if sp_used == 'create_db':
+        from src.results_db import create_db
+
         logger.debug('Attempting to create database.')
         create_db(args.engine_string)
 
+    # Add missing indexes to a database created before they existed, then check the app's queries use them
+    elif sp_used == 'migrate_db':
+        from src.results_db import migrate_db, check_indexes
+
+        logger.debug('Attempting to migrate database.')
+        migrate_db(args.engine_string)
+        if check_indexes(args.engine_string):
+            sys.exit(1)
+
     # Download data from API to local path or S3 bucket
     elif sp_used == 'get_data':
+        from src.api_getdata import iter_team_batches, refresh_data, upload_batches, upload_data
+        from src.acquire_cache import AcquireCache
+        from src.data_io import read_table
+
         # If source arg is api, download from API before saving data to path
         if args.source == 'api':
             logger.info('Getting data from API. Please wait. This may take 20 minutes.')
-            upload_data(acquire_data(**config_data['acquire_data']),args.savepath)
+            # Cache fetched pages on disk so an interrupted or repeated run skips what was already fetched
+            cache = AcquireCache(year=config_data['acquire_data']['year'],resume=args.resume,refresh=args.refresh,**config_data['cache'])
+            if args.incremental:
+                # Merge only new players and current-season rows into the existing data and record what changed
+                try:
+                    existing_df = read_table(args.savepath)
+                except FileNotFoundError:
+                    logger.error('No existing data found at %s to refresh incrementally.',args.savepath)
+                else:
+                    refreshed = refresh_data(existing_df,**config_data['acquire_data'],cache=cache)
+                    if refreshed is not None:
+                        df, changes = refreshed
+                        upload_data(df,args.savepath)
+                        upload_data(changes,args.changelog)
+            else:
+                # Write each team's players out as soon as they arrive instead of holding all of Division I in memory
+                upload_batches(iter_team_batches(**config_data['acquire_data'],cache=cache),args.savepath)
 
         # If source arg is local, download from local before saving data to path
         elif args.source == 'local':
             try:
-                df = pd.read_csv(config_run['raw_local'])
+                df = read_table(config_run['raw_local'])
             except FileNotFoundError:
                 logger.error('Data not found at local path %s',config_run['raw_local'])
             else:
@@ -86,7 +180,7 @@ if __name__ == '__main__':
         # If source arg is not one of the two expected options, download from local and give warning
         else:
             try:
-                df = pd.read_csv(config_run['raw_local'])
+                df = read_table(config_run['raw_local'])
             except FileNotFoundError:
                 logger.error('A proper data acquisition location was not specified and data was not found at local path %s',config_run['raw_local'])
             else:
@@ -95,57 +189,147 @@ if __name__ == '__main__':
 
     # Run full model pipeline starting from getting data from S3 bucket and ending with saving cleaned dataframe with cluster labels
     elif sp_used == 'get_clusters':
-        # Download raw data from S3 bucket
-        raw_df = download_from_s3(args.loadpath)
+        from src.clean_featurize import download_from_s3, clean_data_columns, clean_data, clean_data_streaming, featurize
+        from src.data_io import write_table
+        from src.model_cache import ModelCache
+        from src.model_pipeline import optimal_clusternum, test_cluster_stability, final_cluster_fit
+        from src.plots import PlotRenderer
+
+        if args.streaming:
+            # Clean data while reading it from the S3 bucket so only surviving rows are materialized
+            df = clean_data_streaming(args.loadpath,config_data['acquire_data']['season'],config_data['acquire_data']['season_col'],
+                                      **config_clean['clean_data'],**config_clean['clean_data_streaming'])
+        else:
+            # Download raw data from S3 bucket, skipping the columns the cleaning step drops anyway
+            raw_df = download_from_s3(args.loadpath,columns=clean_data_columns(config_data['acquire_data']['season_col'],config_clean['clean_data']['drop_columns']))
 
-        # Clean data
-        df = clean_data(raw_df,config_data['acquire_data']['season'],config_data['acquire_data']['season_col'],**config_clean['clean_data'])
+            # Clean data
+            df = clean_data(raw_df,config_data['acquire_data']['season'],config_data['acquire_data']['season_col'],**config_clean['clean_data'])
 
         # Create features
         features = featurize(df,**config_clean['featurize'])
 
-        # Generate plots and metrics showing optimal cluster parameters and stability of clusters
-        optimal_clusternum(features,**config_model['kmeans_all'],**config_model['optimal_clusternum'])
-        test_cluster_stability(features,**config_model['kmeans_all'],**config_model['test_cluster_stability'])
+        # Share scalers and K-means fits between the stages below and with earlier runs on the same features
+        model_cache = None if args.no_cache else ModelCache(**config_model['cache'])
+
+        # Render plots in a background process while the clustering continues
+        plots = None if args.no_plots else PlotRenderer(**config_model['plots'])
+
+        # Generate metrics showing optimal cluster parameters and stability of clusters
+        metrics = optimal_clusternum(features,**config_model['kmeans_all'],**config_model['optimal_clusternum'],cache=model_cache)
+        if plots:
+            plots.plot_metrics(metrics)
+        test_cluster_stability(features,**config_model['kmeans_all'],**config_model['test_cluster_stability'],cache=model_cache)
 
         # Get optimal cluster labels
-        clusters = final_cluster_fit(features,**config_model['kmeans_all'],**config_model['final_cluster_fit'])
+        clusters = final_cluster_fit(features,**config_model['kmeans_all'],**config_model['final_cluster_fit'],cache=model_cache)
+        if plots:
+            plots.plot_clusters(clusters,config_model['final_cluster_fit']['player_type_col'])
 
         # Save player data with cluster labels to local path
         try:
-            clusters.to_csv(args.savepath,index=False)
+            write_table(clusters,args.savepath)
         except OSError:
             logger.error('The filepath %s could not be found or accessed.',args.savepath)
         else:
             logger.info('Cleaned data with cluster labels saved to %s',args.savepath)
 
+        # Wait for the plots to finish rendering
+        if plots:
+            plots.close()
+
+    # Render plots from the metrics and labels saved by an earlier get_clusters run
+    elif sp_used == 'plot':
+        from src.data_io import read_table
+        from src.plots import PlotRenderer
+
+        metrics_path = args.metrics_path or config_model['optimal_clusternum']['metrics_path']
+        try:
+            metrics = read_table(metrics_path)
+            clusters = read_table(args.loadpath)
+        except OSError:
+            logger.error('Metrics at %s or labelled data at %s not found. Run get_clusters first.',metrics_path,args.loadpath)
+        else:
+            plots = PlotRenderer(**config_model['plots'],background=False)
+            plots.plot_metrics(metrics)
+            plots.plot_clusters(clusters,config_model['final_cluster_fit']['player_type_col'])
+            plots.close()
+
+    # Run acquire, clean, featurize and cluster stages for many seasons at once
+    elif sp_used == 'backfill':
+        from src.backfill import backfill, read_status
+
+        if args.retry_failed:
+            years = sorted(int(year) for year, state in read_status(config_run['clean_partitions']).items() if state == 'failed')
+        elif args.years:
+            years = args.years
+        else:
+            years = list(range(args.start_year, args.end_year+1))
+
+        if not years:
+            logger.info('No seasons to backfill.')
+        else:
+            failed = backfill(years,config,config_run['raw_partitions'],config_run['clean_partitions'],workers=args.workers,refetch=args.refetch,plots=not args.no_plots)
+            if failed:
+                logger.warning('Seasons ending in %s failed. Rerun them with `python3 run.py backfill --retry_failed`.', ', '.join(str(year) for year in failed))
+
+    # Label new players against the saved centroids and update only their rows
+    elif sp_used == 'assign_players':
+        from src.clean_featurize import download_from_s3, clean_data_columns, clean_data, featurize
+        from src.data_io import write_table
+        from src.model_pipeline import load_cluster_model, assign_players
+        from src.results_db import ResultsManager
+
+        model_path = args.model_path or config_model['final_cluster_fit']['model_path']
+        try:
+            model = load_cluster_model(model_path)
+        except OSError:
+            logger.error('No cluster model found at %s. Run get_clusters first to save one.',model_path)
+        else:
+            raw_df = download_from_s3(args.loadpath,columns=clean_data_columns(config_data['acquire_data']['season_col'],config_clean['clean_data']['drop_columns']))
+            df = clean_data(raw_df,config_data['acquire_data']['season'],config_data['acquire_data']['season_col'],**config_clean['clean_data'])
+            if df is None or df.empty:
+                logger.warning('No players in %s played enough minutes in the %s season to be labelled.',args.loadpath,config_data['acquire_data']['season'])
+            else:
+                players = assign_players(featurize(df,**config_clean['featurize']),model)
+                if args.savepath:
+                    write_table(players,args.savepath)
+                rm = ResultsManager(engine_string=args.engine_string)
+                num_rows = rm.update_players(players)
+                rm.close()
+                logger.info('%i players labelled and written to the database.',num_rows)
+
     # Populate database with player data and cluster labels
     elif sp_used == 'populate_db':
+        from src.data_io import read_table
+        from src.results_db import ResultsManager
+        from src.schema import apply_schema
+
         # Read cleaned data from local path to save to database
         try:
-            df = pd.read_csv(args.loadpath)
+            df = read_table(args.loadpath)
         except:
             logger.error('Data not found at load path %s',args.loadpath)
         else:
             logger.info('Cleaned data with cluster labels loaded from %s',args.loadpath)
+            df = apply_schema(df,'clean')
 
             # initialize results manager to connect to database
             rm = ResultsManager(engine_string=args.engine_string)
 
-            # loop through the rows in the dataframe, calling the add_player function to add that row to the dataframe each time
-            logger.debug('Attempting to populate database.')
-            for row in range(len(df)):
-                rm.add_player(df.loc[row,'player_id'],df.loc[row,'name'],df.loc[row,'year'],df.loc[row,'position'],int(df.loc[row,'height']),int(df.loc[row,'weight']),
-                    df.loc[row,'player_type'],df.loc[row,'team'],df.loc[row,'conference'],int(df.loc[row,'games_played']),int(df.loc[row,'games_started']),
-                    round(df.loc[row,'field_goal_percentage'],2),round(df.loc[row,'three_point_percentage'],2),round(df.loc[row,'free_throw_percentage'],2),int(df.loc[row,'points']),
-                    round(df.loc[row,'ppm'],2),int(df.loc[row,'assists']),round(df.loc[row,'apm'],2),round(df.loc[row,'assist_percentage'],2),int(df.loc[row,'total_rebounds']),round(df.loc[row,'rpm'],2),
-                    round(df.loc[row,'total_rebound_percentage'],2),int(df.loc[row,'blocks']),round(df.loc[row,'bpm'],2),round(df.loc[row,'block_percentage'],2),int(df.loc[row,'steals']),
-                    round(df.loc[row,'spm'],2),round(df.loc[row,'steal_percentage'],2),int(df.loc[row,'turnovers']),round(df.loc[row,'tpm'],2),round(df.loc[row,'turnover_percentage'],2),
-                    df.loc[row,'usage_percentage'],df.loc[row,'player_efficiency_rating'])
-
-            # close the results manager when completed populating the database
-            rm.close()
-            logger.info('%i rows of player data populated in database.', row+1)
+            if args.sync:
+                # Diff against the current table and write only new, changed and removed players in one transaction
+                logger.debug('Attempting to sync database.')
+                rm.sync(df,**config['results_db']['sync'])
+                rm.close()
+            else:
+                # Insert every player in one transaction, a batch of rows at a time
+                logger.debug('Attempting to populate database.')
+                num_rows = rm.bulk_load(df,**config['results_db']['bulk_load'])
+
+                # close the results manager when completed populating the database
+                rm.close()
+                logger.info('%i rows of player data populated in database.', num_rows)
 
     else:
         parser.print_help()
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Stand-in for a sportsipy Player rebuilt from the cache. Only the attributes used during acquisition are kept
+CachedPlayer = namedtuple('CachedPlayer', ['name', 'dataframe'])
+
+
+class AcquireCache:
+    """On-disk cache of the team list, rosters and player pages fetched from sports-reference.com
+    plus a checkpoint manifest of the teams that were fully acquired"""
+
+    def __init__(self, cache_dir, year, ttl_hours=None, resume=False, refresh=False):
+        """
+        Initialize the AcquireCache class for one acquisition year
+        Args:
+            cache_dir: (String), Required: Local directory holding the cache. Each year gets its own subdirectory
+            year: (int), Required: Year the cached payloads belong to
+            ttl_hours: (float), Optional: Age after which a cached payload is fetched again. Never expires if None
+            resume: (bool), Optional: Reuse teams in the checkpoint manifest and their payloads regardless of their age
+            refresh: (bool), Optional: Ignore and clear everything cached for the year before fetching
+        Returns:
+            None
+        """
+        if resume and refresh:
+            raise ValueError('Only one of `resume` and `refresh` can be set')
+
+        self.root = os.path.join(cache_dir, str(year))
+        self.ttl_seconds = ttl_hours*3600 if ttl_hours else None
+        self.resume = resume
+
+        if refresh and os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+            logger.info('Cleared acquisition cache at %s', self.root)
+        os.makedirs(os.path.join(self.root, 'rosters'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'players'), exist_ok=True)
+
+        self._manifest_path = os.path.join(self.root, 'manifest.json')
+        self.completed = set(self._read_json(self._manifest_path, ignore_ttl=True) or [])
+        if self.completed:
+            logger.info('Checkpoint manifest lists %i completed teams.', len(self.completed))
+
+    def _is_fresh(self, path, ignore_ttl=False):
+        """Check if a cached file exists and is younger than the TTL"""
+        if not os.path.exists(path):
+            return False
+        if ignore_ttl or self.ttl_seconds is None:
+            return True
+        return time.time() - os.path.getmtime(path) < self.ttl_seconds
+
+    def _read_json(self, path, ignore_ttl=False):
+        """Read a cached JSON payload, returning None if it is missing or expired"""
+        if not self._is_fresh(path, ignore_ttl):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_atomic(path, data, mode='w'):
+        """Write a file through a temporary file so an interrupted run never leaves a partial payload"""
+        tmp_path = '%s.%i.%i.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, mode) as f:
+            if mode == 'wb':
+                pickle.dump(data, f)
+            else:
+                json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def get_teams(self):
+        """
+        Get the cached team abbreviations for the year
+        Returns:
+            teams: (list of Strings): Team abbreviations, or None if not cached
+        """
+        return self._read_json(os.path.join(self.root, 'teams.json'), ignore_ttl=self.resume and bool(self.completed))
+
+    def put_teams(self, teams):
+        """
+        Cache the team abbreviations for the year
+        Args:
+            teams: (list of Strings), Required: Team abbreviations
+        Returns:
+            None
+        """
+        self._write_atomic(os.path.join(self.root, 'teams.json'), list(teams))
+
+    def get_roster(self, team):
+        """
+        Get a team's cached roster
+        Args:
+            team: (String), Required: Team abbreviation
+        Returns:
+            player_ids: (list of Strings): Player IDs in roster order, or None if not cached
+        """
+        return self._read_json(os.path.join(self.root, 'rosters', '%s.json' % team),
+                               ignore_ttl=self.resume and team in self.completed)
+
+    def put_roster(self, team, player_ids):
+        """
+        Cache a team's roster
+        Args:
+            team: (String), Required: Team abbreviation
+            player_ids: (list of Strings), Required: Player IDs in roster order
+        Returns:
+            None
+        """
+        self._write_atomic(os.path.join(self.root, 'rosters', '%s.json' % team), list(player_ids))
+
+    def get_player(self, player_id, team=None):
+        """
+        Get a player's cached statistics page
+        Args:
+            player_id: (String), Required: sports-reference.com player ID
+            team: (String), Optional: Team the player was fetched for, used to honor the checkpoint manifest on resume
+        Returns:
+            player: (CachedPlayer): Player name and full career DataFrame, or None if not cached
+        """
+        path = os.path.join(self.root, 'players', '%s.pkl' % player_id)
+        if not self._is_fresh(path, ignore_ttl=self.resume and team in self.completed):
+            return None
+        with open(path, 'rb') as f:
+            return CachedPlayer(*pickle.load(f))
+
+    def put_player(self, player_id, player):
+        """
+        Cache a player's statistics page
+        Args:
+            player_id: (String), Required: sports-reference.com player ID
+            player: (CachedPlayer), Required: Fetched player name and full career DataFrame
+        Returns:
+            None
+        """
+        self._write_atomic(os.path.join(self.root, 'players', '%s.pkl' % player_id), tuple(player), mode='wb')
+
+    def mark_completed(self, team):
+        """
+        Record a team in the checkpoint manifest once all of its payloads are cached
+        Args:
+            team: (String), Required: Team abbreviation
+        Returns:
+            None
+        """
+        self.completed.add(team)
+        self._write_atomic(self._manifest_path, sorted(self.completed))
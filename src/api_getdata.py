@@ -1,10 +1,19 @@
 import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 import pandas as pd
-import botocore
+import botocore.exceptions
+from sportsipy.ncaab.roster import Player, Roster
 from sportsipy.ncaab.teams import Teams
 
+from src.acquire_cache import CachedPlayer
+from src.data_io import TableWriter, write_table
+
 logger = logging.getLogger(__name__)
 
 logging.getLogger('botocore').setLevel(logging.ERROR)
@@ -16,7 +25,243 @@ logging.getLogger('aiobotocore').setLevel(logging.ERROR)
 logging.getLogger('s3fs').setLevel(logging.ERROR)
 
 
-def acquire_data(year, season, season_col, name_col):
+class RateLimiter:
+    """Thread-safe limiter that spaces out requests sent to sports-reference.com"""
+
+    def __init__(self, requests_per_second=None):
+        """
+        Initialize the RateLimiter class
+        Args:
+            requests_per_second: (float), Optional: Maximum request rate against the host. No limit if None or 0
+        Returns:
+            None
+        """
+        self.interval = 1/requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def wait(self):
+        """
+        Block the calling thread until it is allowed to send its next request
+        Returns:
+            None
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _fetch_teams(year, cache=None):
+    """
+    Get the abbreviations of all the NCAA men's basketball teams competing in the year
+    Args:
+        year: (int), Required: Year used to get players from API that played that year
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+    Returns:
+        teams: (list of Strings): Team abbreviations
+    """
+    teams = cache.get_teams() if cache else None
+    if teams is None:
+        teams = [team.abbreviation for team in Teams(year)]
+        if cache:
+            cache.put_teams(teams)
+    return teams
+
+
+def _fetch_roster(team_abbreviation, year, limiter, cache=None):
+    """
+    Get the player IDs on a team's roster for the given year
+    Args:
+        team_abbreviation: (String), Required: sports-reference.com team abbreviation
+        year: (int), Required: Year of the roster
+        limiter: (RateLimiter), Required: Rate limiter shared by all workers
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+    Returns:
+        player_ids: (list of Strings): Player IDs in roster order
+    """
+    player_ids = cache.get_roster(team_abbreviation) if cache else None
+    if player_ids is None:
+        limiter.wait()
+        player_ids = list(Roster(team_abbreviation, year, slim=True).players)
+        if cache:
+            cache.put_roster(team_abbreviation, player_ids)
+    return player_ids
+
+
+def _fetch_player(player_id, limiter, cache=None, team_abbreviation=None):
+    """
+    Get a player's full statistics page
+    Args:
+        player_id: (String), Required: sports-reference.com player ID
+        limiter: (RateLimiter), Required: Rate limiter shared by all workers
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+        team_abbreviation: (String), Optional: Team the player is fetched for
+    Returns:
+        player: (CachedPlayer): Player name and DataFrame with all career statistics
+    """
+    player = cache.get_player(player_id, team_abbreviation) if cache else None
+    if player is None:
+        limiter.wait()
+        fetched = Player(player_id)
+        player = CachedPlayer(fetched.name, fetched.dataframe)
+        if cache:
+            cache.put_player(player_id, player)
+    return player
+
+
+def _iter_rosters_serial(year, limiter, cache=None):
+    """
+    Yield the players of every team one team at a time, fetching each page in turn
+    Args:
+        year: (int), Required: Year used to get players from API that played that year
+        limiter: (RateLimiter), Required: Rate limiter applied to every request
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+    Returns:
+        Generator of lists of players, one list per team
+    """
+    for team in _fetch_teams(year, cache):
+        players = [_fetch_player(player_id, limiter, cache, team) for player_id in _fetch_roster(team, year, limiter, cache)]
+        if cache:
+            cache.mark_completed(team)
+        yield players
+
+
+def _iter_rosters_concurrent(year, max_workers, limiter, cache=None):
+    """
+    Yield the players of every team one team at a time while a bounded pool of threads fetches
+    rosters and player pages ahead of the consumer. Teams and players come out in the same order
+    as the serial path.
+    Args:
+        year: (int), Required: Year used to get players from API that played that year
+        max_workers: (int), Required: Number of pages fetched at the same time
+        limiter: (RateLimiter), Required: Rate limiter shared by all workers
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+    Returns:
+        Generator of lists of players, one list per team
+    """
+    teams = _fetch_teams(year, cache)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rosters = [executor.submit(_fetch_roster, team, year, limiter, cache) for team in teams]
+        # Only queue player pages for a few teams ahead so finished teams do not pile up in memory
+        pending = deque()
+        for team, roster in zip(teams, rosters):
+            pending.append((team, [executor.submit(_fetch_player, player_id, limiter, cache, team) for player_id in roster.result()]))
+            if len(pending) > max_workers:
+                yield _collect_team(*pending.popleft(), cache)
+        while pending:
+            yield _collect_team(*pending.popleft(), cache)
+
+
+def _collect_team(team, player_futures, cache=None):
+    """
+    Wait for a team's player pages and record the team in the checkpoint manifest
+    Args:
+        team: (String), Required: Team abbreviation
+        player_futures: (list of Futures), Required: Pending player fetches in roster order
+        cache: (AcquireCache), Optional: On-disk cache holding the checkpoint manifest
+    Returns:
+        players: (list of CachedPlayer): Players on the team's roster
+    """
+    players = [player.result() for player in player_futures]
+    if cache:
+        cache.mark_completed(team)
+    return players
+
+
+def _iter_rosters(year, max_workers=1, requests_per_second=None, cache=None):
+    """
+    Pick the serial or the concurrent walk over all the NCAA men's basketball teams competing in the year
+    Args:
+        year: (int), Required: Year used to get players from API that played that year
+        max_workers (int), Optional: Number of rosters and player pages fetched concurrently. 1 fetches serially
+        requests_per_second (float), Optional: Maximum request rate against sports-reference.com
+        cache: (AcquireCache), Optional: On-disk cache checked before calling the API
+    Returns:
+        Generator of lists of players, one list per team
+    """
+    limiter = RateLimiter(requests_per_second)
+    if max_workers > 1:
+        logger.info('Fetching rosters with %i workers at up to %s requests per second.', max_workers, requests_per_second)
+        return _iter_rosters_concurrent(year, max_workers, limiter, cache)
+    return _iter_rosters_serial(year, limiter, cache)
+
+
+def _team_batch(players, season, season_col, name_col):
+    """
+    Combine the statistics of the players on one roster that played in the requested season
+    Args:
+        players: (list of CachedPlayer), Required: Players on one team's roster
+        season (String), Required: String of last season year range to filter player data on
+        season_col (String), Required: Name of the newly created season column
+        name_col (String), Required: Name of newly created name column
+    Returns:
+        batch: (Pandas DataFrame): Full career rows of the team's players, or None if none of them played in the season
+    """
+    player_dfs = []
+    # Loop through all the players on the currently selected team's roster
+    for player in players:
+
+        # Obtain the full player statistics dataframe
+        player_df = player.dataframe
+
+        # If the player played in the recent season, get that player's data
+        if season in player_df.index:
+
+            # Reset the index which is currently the season
+            player_df = player_df.rename_axis(season_col).reset_index()
+
+            # Add a column for player name
+            player_df[name_col] = player.name
+            player_dfs.append(player_df)
+
+    if not player_dfs:
+        return None
+    return pd.concat(player_dfs, ignore_index=True)
+
+
+def convert_height(df):
+    """
+    Convert heights from feet-inches strings such as '6-5' to inches to avoid formatting issues when saving to Excel
+    Args:
+        df: (Pandas DataFrame), Required: Raw data containing a `height` column
+    Returns:
+        df: (Pandas DataFrame): Raw data with the `height` column in inches
+    """
+    # Rosters where no height is known give a numeric column, so split the text form and treat what is not a number as 0
+    height = df['height'].astype(str).str.split('-')
+    feet = pd.to_numeric(height.str[0], errors='coerce').fillna(0).astype(int)
+    inches = pd.to_numeric(height.str[1], errors='coerce').fillna(0).astype(int)
+    df['height'] = feet*12 + inches
+    return df
+
+
+def iter_team_batches(year, season, season_col, name_col, max_workers=1, requests_per_second=None, cache=None):
+    """
+    Obtain NCAA basketball player statistics from sports-reference.com one team at a time so a
+    caller can write each batch out as soon as it arrives
+    Args:
+        year: (int), Required: Year used to get players from API that played that year
+        season (String), Required: String of last season year range to filter player data on
+        season_col (String), Required: Name of the newly created season column
+        name_col (String), Required: Name of newly created name column
+        max_workers (int), Optional: Number of rosters and player pages fetched concurrently. 1 fetches serially
+        requests_per_second (float), Optional: Maximum request rate against sports-reference.com
+        cache (AcquireCache), Optional: On-disk cache of fetched payloads and completed teams used to resume or skip requests
+    Returns:
+        Generator of Pandas DataFrames: Raw rows for one team each with heights converted to inches
+    """
+    for players in _iter_rosters(year, max_workers, requests_per_second, cache):
+        batch = _team_batch(players, season, season_col, name_col)
+        if batch is not None:
+            yield convert_height(batch)
+
+
+def acquire_data(year, season, season_col, name_col, max_workers=1, requests_per_second=None, cache=None):
     """
     Obtain NCAA basketball player statistics using the sportsipy API to pull
     the data from sports-reference.com
@@ -25,45 +270,100 @@ def acquire_data(year, season, season_col, name_col):
         season (String), Required: String of last season year range to filter player data on
         season_col (String), Required: Name of the newly created season column
         name_col (String), Required: Name of newly created name column
+        max_workers (int), Optional: Number of rosters and player pages fetched concurrently. 1 fetches serially
+        requests_per_second (float), Optional: Maximum request rate against sports-reference.com
+        cache (AcquireCache), Optional: On-disk cache of fetched payloads and completed teams used to resume or skip requests
     Returns:
         df: (Pandas DataFrame): Raw, uncleaned data from API converted to DataFrame
     """
     try:
-        # Initialize variables
-        df = pd.DataFrame()
+        # Collect one frame per team and combine them once at the end instead of growing a frame player by player
+        chunks = []
+        for players in _iter_rosters(year, max_workers, requests_per_second, cache):
+            batch = _team_batch(players, season, season_col, name_col)
+            if batch is not None:
+                chunks.append(batch)
 
-        # Loop through all the NCAA men's basketball teams competing in 2021
-        for team in Teams(year):
-            # Loop through all the players on the currently selected team's roster
-            for player in team.roster.players:
+        # Raise a warning if data was not pulled during API call process
+        if not chunks:
+            logger.warning('Obtained dataframe contains zero rows.')
+            return pd.DataFrame()
+
+        df = convert_height(pd.concat(chunks, ignore_index=True))
+        logger.info('Height column converted to inches.')
+        logger.info('Data obtained with number of rows: %s', df.shape[0])
+
+        return df
 
-                # Obtain the full player statistics dataframe
-                player_df = player.dataframe
+    except requests.exceptions.ConnectionError:
+        logger.error('A connection error occurred. Please check that you are connected to the internet and that sports-reference.com is not down.')
 
-                # If the player played in the recent season, get that player's data
-                if season in player_df.index:
 
-                    # Reset the index which is currently the season
-                    player_df = player_df.rename_axis(season_col).reset_index()
+def merge_delta(df, delta, season, season_col, key_col='player_id', career_label='Career'):
+    """
+    Merge newly fetched rows into the existing raw data by player and season. Players already in
+    the existing data only contribute their current-season and career totals rows, new players contribute every row.
+    Args:
+        df: (Pandas DataFrame), Required: Existing raw data
+        delta: (Pandas DataFrame), Required: Newly fetched raw data
+        season (String), Required: String of the current season that can still change
+        season_col (String), Required: Name of the season column
+        key_col (String), Optional: Name of the player identifier column
+        career_label (String), Optional: Season of the career totals row, which changes along with the current season
+    Returns:
+        merged: (Pandas DataFrame): Existing raw data with changed rows replaced and new rows appended
+        changes: (Pandas DataFrame): Player, season and type of change (`added` or `updated`) of every touched row
+    """
+    key = [key_col, season_col]
 
-                    # Add a column for player name
-                    player_df[name_col] = player.name
+    # Past seasons of known players are final, so only keep their current season and career totals
+    known = delta[key_col].isin(df[key_col])
+    delta = delta[~known | delta[season_col].isin([season, career_label])].drop_duplicates(key, keep='last')
 
-                    # Append the player's stats to the existing players dataframe
-                    df = df.append(player_df, ignore_index=True)
+    old = df.set_index(key)
+    new = delta.set_index(key).reindex(columns=old.columns)
 
-        # Convert heights to inches to avoid formatting issues when saving to Excel
-        df['height'] = df['height'].fillna(0)
-        df['height'] = df['height'].str.split('-').str[0].fillna(0).apply(int)*12 + df['height'].str.split('-').str[1].fillna(0).apply(int)
-        logger.info('Height column converted to inches.')
+    # Compare the rows present in both frames, treating two missing values as equal
+    common = new.index.intersection(old.index)
+    old_common = old.loc[common]
+    new_common = new.loc[common]
+    same = ((old_common == new_common) | (old_common.isna() & new_common.isna())).all(axis=1)
+    updated = common[~same.values]
+    added = new.index.difference(old.index, sort=False)
 
-        # Raise a warning if data was not pulled during API call process
-        if df.shape[0] == 0:
-            logger.warning('Obtained dataframe contains zero rows.')
-        else:
-            logger.info('Data obtained with number of rows: %s', df.shape[0])
+    old.loc[updated] = new.loc[updated]
+    merged = pd.concat([old, new.loc[added]]).reset_index()[df.columns]
 
-        return df
+    changes = pd.concat([updated.to_frame(index=False).assign(change='updated'),
+                         added.to_frame(index=False).assign(change='added')], ignore_index=True)
+    logger.info('Delta merged: %i rows updated and %i rows added.', len(updated), len(added))
+    return merged, changes
+
+
+def refresh_data(df, year, season, season_col, name_col, max_workers=1, requests_per_second=None, cache=None):
+    """
+    Refresh existing raw data from sports-reference.com by fetching the current rosters and merging
+    in only new players and current-season rows
+    Args:
+        df: (Pandas DataFrame), Required: Existing raw data, for example data/external/sports_ref.csv
+        year: (int), Required: Year used to get players from API that played that year
+        season (String), Required: String of last season year range to filter player data on
+        season_col (String), Required: Name of the newly created season column
+        name_col (String), Required: Name of newly created name column
+        max_workers (int), Optional: Number of rosters and player pages fetched concurrently. 1 fetches serially
+        requests_per_second (float), Optional: Maximum request rate against sports-reference.com
+        cache (AcquireCache), Optional: On-disk cache of fetched payloads and completed teams used to resume or skip requests
+    Returns:
+        merged: (Pandas DataFrame): Refreshed raw data
+        changes: (Pandas DataFrame): Player, season and type of change of every touched row
+    """
+    try:
+        # Team batches only hold the players who played in the season, which is everyone whose data can change
+        batches = list(iter_team_batches(year, season, season_col, name_col, max_workers, requests_per_second, cache))
+        if not batches:
+            logger.warning('Obtained dataframe contains zero rows. Existing data kept as is.')
+            return df, pd.DataFrame(columns=['player_id', season_col, 'change'])
+        return merge_delta(df, pd.concat(batches, ignore_index=True), season, season_col)
 
     except requests.exceptions.ConnectionError:
         logger.error('A connection error occurred. Please check that you are connected to the internet and that sports-reference.com is not down.')
@@ -74,14 +374,14 @@ def upload_data(df, filepath):
     Upload the acquired data to an S3 Bucket or download it to a local path
     Args:
         df: (Pandas DataFrame), Required: Raw, uncleaned data from API
-        filepath: (String), Required: Location to save data
+        filepath: (String), Required: Location to save data. A .parquet or .feather suffix selects that format, otherwise CSV
     Returns:
         None
     """
 
     # Try to upload to path, catch any exceptions that occur
     try:
-        df.to_csv(filepath,index=False)
+        write_table(df,filepath)
     except botocore.exceptions.NoCredentialsError:
         logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
     except botocore.exceptions.PartialCredentialsError:
@@ -98,3 +398,43 @@ def upload_data(df, filepath):
         logger.error('The DataFrame does not exist. Please check your data source location argument.')
     else:
         logger.info('Data uploaded to %s', filepath)
+
+
+def upload_batches(batches, filepath):
+    """
+    Stream batches of acquired data to an S3 Bucket or a local path as they arrive so only one
+    batch is held in memory at a time. Data already at the path is only replaced once every batch was written
+    Args:
+        batches: (iterable of Pandas DataFrames), Required: Raw, uncleaned data from API, for example from `iter_team_batches`
+        filepath: (String), Required: Location to save data. A .parquet or .feather suffix selects that format, otherwise CSV
+    Returns:
+        num_rows: (int): Number of rows written
+    """
+    num_rows = 0
+    # Try to upload to path, catch any exceptions that occur
+    try:
+        # A failed run keeps the file already at the path, written only once every batch arrived
+        with TableWriter(filepath) as writer:
+            for batch in batches:
+                writer.write(batch)
+            num_rows = writer.num_rows
+            if num_rows == 0:
+                writer.abort()
+    except requests.exceptions.ConnectionError:
+        logger.error('A connection error occurred. Please check that you are connected to the internet and that sports-reference.com is not down.')
+    except botocore.exceptions.NoCredentialsError:
+        logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
+    except botocore.exceptions.PartialCredentialsError:
+        logger.error('One environment variable is missing. Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
+    except botocore.exceptions.ConnectionError:
+        logger.error('A connection was unable to be established. Please check your internet/connection.')
+    except botocore.exceptions.ClientError:
+        logger.error('An unexpected error occurred. Please try again.')
+    except OSError:
+        logger.error('The filepath %s to save to could not be found or accessed.',filepath)
+    else:
+        if num_rows == 0:
+            logger.warning('Obtained dataframe contains zero rows. Nothing was written to %s.', filepath)
+        else:
+            logger.info('%i rows of data uploaded to %s', num_rows, filepath)
+    return num_rows
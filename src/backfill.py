@@ -0,0 +1,202 @@
+import copy
+import json
+import logging
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.acquire_cache import AcquireCache
+from src.api_getdata import iter_team_batches, upload_batches
+from src.clean_featurize import clean_data_streaming, featurize
+from src.data_io import write_table
+from src.model_cache import ModelCache
+from src.model_pipeline import optimal_clusternum, test_cluster_stability, final_cluster_fit
+from src.plots import PlotRenderer
+
+logger = logging.getLogger(__name__)
+
+
+def season_label(year):
+    """
+    Get the season string sports-reference.com uses for the season ending in the given year
+    Args:
+        year: (int), Required: Year the season ends in, such as 2021
+    Returns:
+        season: (String): Season year range, such as '2020-21'
+    """
+    return '%d-%02d' % (year-1, year % 100)
+
+
+def partition_dir(root, season):
+    """
+    Get the directory holding one season's outputs, such as data/clean/season=2019-20
+    Args:
+        root: (String), Required: Directory holding all season partitions
+        season: (String), Required: Season year range
+    Returns:
+        path: (String): Partition directory
+    """
+    return os.path.join(root, 'season=%s' % season)
+
+
+def season_config(config, year, out_dir, workers=1):
+    """
+    Point a copy of the pipeline configuration at one season and its output partition
+    Args:
+        config: (dict), Required: Configuration loaded from config/config.yaml
+        year: (int), Required: Year the season ends in
+        out_dir: (String), Required: Partition directory receiving the season's plots, metrics and cluster model
+        workers: (int), Optional: Number of seasons running at the same time, used to share the API rate limit and the cores
+    Returns:
+        config: (dict): Configuration for the season
+    """
+    config = copy.deepcopy(config)
+    acquire = config['api_getdata']['acquire_data']
+    acquire['year'] = year
+    acquire['season'] = season_label(year)
+    # Every process gets its share of the polite request rate so the backfill as a whole stays within it
+    if acquire.get('requests_per_second'):
+        acquire['requests_per_second'] = acquire['requests_per_second']/workers
+
+    model = config['model_pipeline']
+    # Seasons running side by side share the cores, rather than each starting a process per core
+    cores = max(1, (os.cpu_count() or 1)//workers)
+    for stage in ('optimal_clusternum', 'test_cluster_stability'):
+        n_jobs = model[stage].get('n_jobs', 1)
+        model[stage]['n_jobs'] = cores if n_jobs == -1 else min(n_jobs, cores)
+    model['optimal_clusternum']['metrics_path'] = os.path.join(out_dir, 'clustering_metrics.csv')
+    model['test_cluster_stability']['savepath'] = os.path.join(out_dir, 'cluster_fits_percent_difference.csv')
+    model['test_cluster_stability']['report_path'] = os.path.join(out_dir, 'cluster_stability_report.csv')
+    model['plots']['SSEpath'] = os.path.join(out_dir, 'clustering_SSE.png')
+    model['plots']['silpath'] = os.path.join(out_dir, 'clustering_silhouette.png')
+    model['plots']['clust_plot'] = os.path.join(out_dir, 'clusters_visualized.png')
+    model['final_cluster_fit']['model_path'] = os.path.join(out_dir, 'cluster_model.json')
+    return config
+
+
+def run_season(year, config, raw_root, clean_root, refetch=False, workers=1, plots=True):
+    """
+    Run the acquire, clean, featurize and cluster stages for one season, writing the raw data and the cleaned data
+    with cluster labels to the season's partitions
+    Args:
+        year: (int), Required: Year the season ends in
+        config: (dict), Required: Configuration loaded from config/config.yaml
+        raw_root: (String), Required: Directory holding the raw data partitions
+        clean_root: (String), Required: Directory holding the cleaned data partitions
+        refetch: (bool), Optional: Download the raw data again even if its partition already exists
+        workers: (int), Optional: Number of seasons running at the same time
+        plots: (bool), Optional: Render the season's plots in a background process
+    Returns:
+        savepath: (String): Path of the cleaned data with cluster labels
+    """
+    season = season_label(year)
+    raw_dir = partition_dir(raw_root, season)
+    clean_dir = partition_dir(clean_root, season)
+    os.makedirs(raw_dir, exist_ok=True)
+    os.makedirs(clean_dir, exist_ok=True)
+    config = season_config(config, year, clean_dir, workers)
+    config_data = config['api_getdata']
+    config_clean = config['clean_featurize']
+    config_model = config['model_pipeline']
+
+    # Acquire the season's raw data unless an earlier run already saved it. The data is written to a temporary file and
+    # only renamed onto the partition once complete, so a leftover temporary file means the season is not done
+    raw_path = os.path.join(raw_dir, 'sports_ref.parquet')
+    tmp_path = '%s.tmp%s' % os.path.splitext(raw_path)
+    if refetch or not os.path.exists(raw_path) or os.path.exists(tmp_path):
+        logger.info('Getting %s data from API.', season)
+        cache = AcquireCache(year=year, **config_data['cache'])
+        try:
+            num_rows = upload_batches(iter_team_batches(**config_data['acquire_data'], cache=cache), tmp_path)
+            if not num_rows or not os.path.exists(tmp_path):
+                raise RuntimeError('No raw data was saved for the %s season' % season)
+            os.replace(tmp_path, raw_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    # Clean data and create features
+    df = clean_data_streaming(raw_path, season, config_data['acquire_data']['season_col'],
+                              **config_clean['clean_data'], **config_clean['clean_data_streaming'])
+    if df is None or df.empty:
+        raise RuntimeError('No players left after cleaning the %s season' % season)
+    features = featurize(df, **config_clean['featurize'])
+
+    # Generate plots and metrics for the season, then get its cluster labels. Seasons share the content-addressed model cache
+    cache = ModelCache(**config_model['cache'])
+    renderer = PlotRenderer(**config_model['plots']) if plots else None
+    metrics = optimal_clusternum(features, **config_model['kmeans_all'], **config_model['optimal_clusternum'], cache=cache)
+    if renderer:
+        renderer.plot_metrics(metrics)
+    test_cluster_stability(features, **config_model['kmeans_all'], **config_model['test_cluster_stability'], cache=cache)
+    clusters = final_cluster_fit(features, **config_model['kmeans_all'], **config_model['final_cluster_fit'], cache=cache)
+    if renderer:
+        renderer.plot_clusters(clusters, config_model['final_cluster_fit']['player_type_col'])
+
+    savepath = os.path.join(clean_dir, 'sports_ref_clean.parquet')
+    write_table(clusters, savepath)
+    if renderer:
+        renderer.close()
+    logger.info('Cleaned %s data with cluster labels saved to %s', season, savepath)
+    return savepath
+
+
+def _run_season_safe(year, config, raw_root, clean_root, refetch, workers, plots):
+    """Run one season in a worker process and report failures as text instead of raising"""
+    try:
+        return year, True, run_season(year, config, raw_root, clean_root, refetch, workers, plots)
+    except Exception:
+        return year, False, traceback.format_exc()
+
+
+def read_status(clean_root):
+    """
+    Read the status of every season an earlier backfill ran
+    Args:
+        clean_root: (String), Required: Directory holding the cleaned data partitions
+    Returns:
+        status: (dict): Season end year (as a String) to `ok` or `failed`
+    """
+    path = os.path.join(clean_root, '_backfill_status.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def backfill(years, config, raw_root, clean_root, workers=1, refetch=False, plots=True):
+    """
+    Run the pipeline for many seasons across a pool of processes. Each season writes to its own partition and the
+    status of every season is recorded so failed seasons can be retried on their own
+    Args:
+        years: (list of int), Required: Years the seasons end in
+        config: (dict), Required: Configuration loaded from config/config.yaml
+        raw_root: (String), Required: Directory holding the raw data partitions
+        clean_root: (String), Required: Directory holding the cleaned data partitions
+        workers: (int), Optional: Number of seasons processed at the same time
+        refetch: (bool), Optional: Download raw data again even if its partition already exists
+        plots: (bool), Optional: Render the plots of every season
+    Returns:
+        failed: (list of int): Years whose season failed
+    """
+    os.makedirs(clean_root, exist_ok=True)
+    status = read_status(clean_root)
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_season_safe, year, config, raw_root, clean_root, refetch, workers, plots) for year in years]
+        for future in as_completed(futures):
+            year, ok, detail = future.result()
+            status[str(year)] = 'ok' if ok else 'failed'
+            if ok:
+                logger.info('Season %s finished.', season_label(year))
+            else:
+                failed.append(year)
+                logger.error('Season %s failed:\n%s', season_label(year), detail)
+
+            # Record progress after every season so an interrupted backfill keeps what it finished
+            with open(os.path.join(clean_root, '_backfill_status.json'), 'w') as f:
+                json.dump(status, f, indent=2, sort_keys=True)
+
+    logger.info('Backfill finished: %i seasons succeeded and %i failed.', len(years)-len(failed), len(failed))
+    return sorted(failed)
@@ -2,7 +2,10 @@ import logging
 import requests
 
 import pandas as pd
-import botocore
+import botocore.exceptions
+
+from src.data_io import iter_table_chunks, read_table
+from src.schema import apply_schema
 
 logger = logging.getLogger(__name__)
 
@@ -15,17 +18,21 @@ logging.getLogger('aiobotocore').setLevel(logging.ERROR)
 logging.getLogger('s3fs').setLevel(logging.ERROR)
 
 
-def download_from_s3(path):
+def download_from_s3(path, columns=None, filters=None):
     """
     Download the data from an S3 Bucket or a local path
     Args:
-        path: (String), Required: S3 Bucket path or local path containing raw data
+        path: (String), Required: S3 Bucket path or local path containing raw data. A .parquet or .feather suffix selects that format, otherwise CSV
+        columns: (list of Strings or callable), Optional: Columns to load, or a function returning True for each column name to load. All columns if None
+        filters: (list of tuples), Optional: Row filters such as `[('season', '==', '2020-21')]`. Parquet skips row groups that cannot match
     Returns:
         df: (Pandas DataFrame): Uncleaned data from source put in DataFrame form
     """
     # Try to download data from S3 while catching all errors
     try:
-        df = pd.read_csv(path)
+        df = read_table(path, columns=columns, filters=filters)
+        # Load the data with the declared compact column types
+        df = apply_schema(df, 'raw')
     except botocore.exceptions.NoCredentialsError:
         logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
     except botocore.exceptions.PartialCredentialsError:
@@ -43,6 +50,38 @@ def download_from_s3(path):
         return df
 
 
+def clean_data_columns(season_col,drop_columns,keep_columns=('player_id','team_abbreviation','minutes_played')):
+    """
+    Build the column selection used to load raw data for `clean_data` so the dropped columns are never parsed
+    Args:
+        season_col (String), Required: Name of the season column created  during the API data download
+        drop_columns (list of Strings), Required: Columns dropped during the cleaning process
+        keep_columns (tuple of Strings), Optional: Columns `clean_data` reads before dropping them
+    Returns:
+        usecols: (callable): Function returning True for the name of each column to load
+    """
+    skip = set(drop_columns) - {season_col} - set(keep_columns)
+    return lambda column: column not in skip
+
+
+def count_seasons(df,season,season_col,year_col,career_label='Career'):
+    """
+    Count the rows of each player up to and including a season, so seasons played after it do not change the count
+    Args:
+        df: (Pandas DataFrame), Required: Player IDs and seasons
+        season: (String), Required: Last season counted, such as '2020-21'
+        season_col (String), Required: Name of the season column created during the API data download
+        year_col (String), Required: Name given to the count
+        career_label (String), Optional: Season of the career totals row, which is counted along with the seasons
+    Returns:
+        num_years: (Pandas Series): Number of rows of each player indexed by player ID
+    """
+    # Season labels such as '2020-21' sort in time order as strings, including when loaded as categories
+    seasons = df[season_col].astype(str)
+    to_date = (seasons<=season) | (seasons==career_label)
+    return df[to_date].groupby('player_id')[season_col].count().rename(year_col)
+
+
 def clean_data(df,season,season_col,year_col,max_years,year_mapping,min_minutes,team_col,na_fill_val,drop_columns):
     """
     Clean the data contained in the dataframe to be used for feature engineering and modeling
@@ -77,8 +116,7 @@ def clean_data(df,season,season_col,year_col,max_years,year_mapping,min_minutes,
         raise ValueError('Provided argument `df` does not contain the specified column.')
 
     # Get the number of seasons a player has played for
-    num_years = df.groupby('player_id').agg('count').iloc[:,0]
-    num_years.rename(year_col, axis='columns', inplace=True)
+    num_years = count_seasons(df,season,season_col,year_col)
 
     # Add the number of years played as a column
     df = df.merge(num_years,on='player_id',how='left')
@@ -100,16 +138,92 @@ def clean_data(df,season,season_col,year_col,max_years,year_mapping,min_minutes,
     df = df[df['minutes_played']>min_minutes]
     logger.info('Filtered on players with more than 100 minutes played. %i players remain.', len(df))
 
-    # Drop unneeded columns
-    df.drop(drop_columns,axis=1,inplace=True)
+    df = _drop_and_fill(df,na_fill_val,drop_columns)
+    logger.info('Completed dataframe cleaning.')
+    return df
+
+
+def _drop_and_fill(df,na_fill_val,drop_columns):
+    """
+    Final cleaning steps shared by `clean_data` and `clean_data_streaming`
+    Args:
+        df: (Pandas DataFrame), Required: Filtered data
+        na_fill_val (int), Required: Value used to fill in NAs in percentage columns
+        drop_columns (list of Strings), Required: Columns dropped during the cleaning process
+    Returns:
+        df: (Pandas DataFrame): Cleaned data
+    """
+    # Drop unneeded columns. Columns that were never loaded are skipped
+    df.drop(drop_columns,axis=1,inplace=True,errors='ignore')
+    # Categorical columns cannot hold the fill value, so turn the ones with NAs back into plain columns
+    for col in df.columns[(df.dtypes == 'category') & df.isna().any()]:
+        df[col] = df[col].astype(object)
     # Fill some percentage column values with 0 that have NAs due to no attempts
     df.fillna(na_fill_val,inplace=True)
+    # Give object columns that only hold numbers after filtering and filling a numeric type
+    df = df.infer_objects()
     # Reset index now at end of cleaning
     df.reset_index(drop=True,inplace=True)
-    logger.info('Completed dataframe cleaning.')
     return df
 
 
+def clean_data_streaming(path,season,season_col,year_col,max_years,year_mapping,min_minutes,team_col,na_fill_val,drop_columns,chunksize=100000):
+    """
+    Clean raw data straight from an S3 Bucket or a local path without loading the full history. The seasons per player
+    are counted from the player and season columns alone, then the season and minutes filters are applied while the
+    remaining columns are read in chunks so only surviving rows are kept. Gives the same result as `clean_data`.
+    Args:
+        path: (String), Required: S3 Bucket path or local path containing raw data in CSV, Parquet or Feather format
+        season (String), Required: String of last season year range to filter player data on
+        season_col (String), Required: Name of the season column created  during the API data download
+        year_col (String), Required: Name of the newly created year column
+        max_years (int), Required: Number of years player to filter on to remove Seniors who are graduating
+        year_mapping (dict), Required: Map of number of years played to college class
+        min_minutes (int), Required: Minimum minutes needed for a player to play to be used in clustering
+        team_col (String), Required: Name of newly created team name column
+        na_fill_val (int), Required: Value used to fill in NAs in percentage columns
+        drop_columns (list of Strings), Required: Columns dropped during the cleaning process
+        chunksize (int), Optional: Number of raw CSV rows parsed at a time
+    Returns:
+        df: (Pandas DataFrame): Cleaned data
+    """
+    try:
+        # Get the number of seasons a player has played for from a cheap pass over two columns
+        seasons = read_table(path, columns=['player_id', season_col])
+        num_years = count_seasons(seasons,season,season_col,year_col)
+        del seasons
+        logger.info('Seasons counted for %i players.', len(num_years))
+
+        # Read the remaining columns in chunks, keeping only rows from the season with enough minutes played
+        filters = [(season_col, '==', season), ('minutes_played', '>', min_minutes)]
+        chunks = []
+        for chunk in iter_table_chunks(path, columns=clean_data_columns(season_col,drop_columns), filters=filters, chunksize=chunksize):
+            # Filter by players that have less than 4 seasons since having 4 seasons means a players' eligibility has been used up
+            chunks.append(chunk[chunk['player_id'].map(num_years)<max_years])
+    except botocore.exceptions.NoCredentialsError:
+        logger.error('Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
+    except botocore.exceptions.PartialCredentialsError:
+        logger.error('One environment variable is missing. Please provide AWS credentials via AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY env variables.')
+    except botocore.exceptions.ConnectionError:
+        logger.error('A connection was unable to be established. Please check your internet/connection.')
+    except botocore.exceptions.ClientError:
+        logger.error('An unexpected error occurred. Please try again.')
+    except ConnectionError:
+        logger.error('A connection error occurred. Please check that you are connected to the internet.')
+    else:
+        df = apply_schema(pd.concat(chunks, ignore_index=True), 'clean')
+        logger.info('Filtered on 2020-21 players with less than 4 years of experience and more than 100 minutes played. %i players remain.', len(df))
+
+        # Add the number of years played as a column
+        df[year_col] = df['player_id'].map(num_years).map(year_mapping)
+        # Remove the dashes from team names for a better display
+        df[team_col] = df['team_abbreviation'].str.replace('-',' ')
+
+        df = _drop_and_fill(df,na_fill_val,drop_columns)
+        logger.info('Completed dataframe cleaning.')
+        return df
+
+
 def featurize(df,ppm_col,apm_col,rpm_col,bpm_col,spm_col,tpm_col):
     """
     Engineer features to be used in modeling by calculating major statistics per minute
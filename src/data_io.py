@@ -0,0 +1,279 @@
+import logging
+import os
+
+import fsspec
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# File suffixes mapped to the storage format used to read and write them. Anything else is CSV
+FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.ftr': 'feather'}
+
+
+def table_format(path):
+    """
+    Get the storage format of a local or S3 path from its suffix
+    Args:
+        path: (String), Required: Local or S3 path
+    Returns:
+        fmt: (String): One of `parquet`, `feather` or `csv`
+    """
+    return FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def _resolve_columns(columns, names):
+    """Turn a column selection into a list of names in file order. `columns` is a list, a callable or None for all"""
+    if columns is None:
+        return None
+    if callable(columns):
+        return [name for name in names if columns(name)]
+    return [name for name in names if name in set(columns)]
+
+
+def read_table(path, columns=None, filters=None):
+    """
+    Read a CSV, Parquet or Feather file from S3 or a local path, loading only the requested columns and rows
+    Args:
+        path: (String), Required: S3 or local path. The format is chosen from the suffix
+        columns: (list of Strings or callable), Optional: Columns to load, or a function that returns True for each
+            column name to load. All columns are loaded if None
+        filters: (list of tuples), Optional: Row filters such as `[('season', '==', '2020-21')]`. Parquet files skip
+            whole row groups that cannot match, other formats apply the filters after reading
+    Returns:
+        df: (Pandas DataFrame): Data read from the path
+    """
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        with fsspec.open(path, 'rb') as f:
+            parquet_file = pq.ParquetFile(f)
+            columns = _resolve_columns(columns, parquet_file.schema_arrow.names)
+            if filters:
+                f.seek(0)
+                table = pq.read_table(f, columns=columns, filters=filters)
+            else:
+                table = parquet_file.read(columns=columns)
+        return table.to_pandas()
+
+    if fmt == 'feather':
+        import pyarrow.feather as feather
+        import pyarrow.ipc as ipc
+        with fsspec.open(path, 'rb') as f:
+            columns = _resolve_columns(columns, ipc.open_file(f).schema.names)
+            f.seek(0)
+            df = feather.read_feather(f, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns)
+    return apply_filters(df, filters)
+
+
+def _row_group_may_match(row_group, names, filters):
+    """Use a Parquet row group's min/max statistics to tell whether any of its rows can match the filters"""
+    for column, op, value in filters:
+        if column not in names or op not in ('==', '=', '<', '<=', '>', '>='):
+            continue
+        stats = row_group.column(names.index(column)).statistics
+        if stats is None or not stats.has_min_max:
+            continue
+        if op in ('==', '=') and not stats.min <= value <= stats.max:
+            return False
+        if (op == '<' and stats.min >= value) or (op == '<=' and stats.min > value):
+            return False
+        if (op == '>' and stats.max <= value) or (op == '>=' and stats.max < value):
+            return False
+    return True
+
+
+def iter_table_chunks(path, columns=None, filters=None, chunksize=100000):
+    """
+    Read a CSV, Parquet or Feather file from S3 or a local path in chunks, keeping only the rows that match the
+    filters so no more than one chunk of unfiltered rows is in memory at a time
+    Args:
+        path: (String), Required: S3 or local path. The format is chosen from the suffix
+        columns: (list of Strings or callable), Optional: Columns to load, or a function that returns True for each
+            column name to load. All columns are loaded if None
+        filters: (list of tuples), Optional: Row filters such as `[('season', '==', '2020-21')]`. Parquet row groups
+            whose statistics rule out a match are never read
+        chunksize: (int), Optional: Number of CSV rows parsed per chunk. Parquet is read one row group at a time
+    Returns:
+        Generator of Pandas DataFrames: Matching rows of each chunk
+    """
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        with fsspec.open(path, 'rb') as f:
+            parquet_file = pq.ParquetFile(f)
+            names = parquet_file.schema_arrow.names
+            columns = _resolve_columns(columns, names)
+            for i in range(parquet_file.num_row_groups):
+                if filters and not _row_group_may_match(parquet_file.metadata.row_group(i), names, filters):
+                    continue
+                yield apply_filters(parquet_file.read_row_group(i, columns=columns).to_pandas(), filters)
+    elif fmt == 'feather':
+        # Feather files are memory mapped locally, so they are read in one go
+        yield read_table(path, columns=columns, filters=filters)
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+            yield apply_filters(chunk, filters)
+
+
+def apply_filters(df, filters):
+    """
+    Keep the rows of a DataFrame that match every filter
+    Args:
+        df: (Pandas DataFrame), Required: Data to filter
+        filters: (list of tuples), Required: Filters as `(column, operator, value)` with operators
+            `==`, `!=`, `<`, `<=`, `>`, `>=` and `in`
+    Returns:
+        df: (Pandas DataFrame): Rows matching all the filters with a fresh index
+    """
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        if op == 'in':
+            mask &= df[column].isin(value)
+        elif op in ('==', '='):
+            mask &= df[column] == value
+        elif op == '!=':
+            mask &= df[column] != value
+        elif op == '<':
+            mask &= df[column] < value
+        elif op == '<=':
+            mask &= df[column] <= value
+        elif op == '>':
+            mask &= df[column] > value
+        elif op == '>=':
+            mask &= df[column] >= value
+        else:
+            raise ValueError('Unsupported filter operator %s' % op)
+    return df[mask].reset_index(drop=True)
+
+
+def write_table(df, path):
+    """
+    Write a DataFrame as CSV, Parquet or Feather to S3 or a local path
+    Args:
+        df: (Pandas DataFrame), Required: Data to save
+        path: (String), Required: S3 or local path. The format is chosen from the suffix
+    Returns:
+        None
+    """
+    fmt = table_format(path)
+    if fmt == 'parquet':
+        with fsspec.open(path, 'wb') as f:
+            df.to_parquet(f, index=False)
+    elif fmt == 'feather':
+        with fsspec.open(path, 'wb') as f:
+            df.reset_index(drop=True).to_feather(f)
+    else:
+        df.to_csv(path, index=False)
+
+
+class TableWriter:
+    """Write DataFrame batches to one CSV or Parquet file as they arrive. Each Parquet batch becomes its own row group.
+    Feather cannot be appended to, so Feather batches are combined and written when the writer closes. Local files are
+    written next to the target and only replace it once every batch was written, so a failed run keeps the old file"""
+
+    def __init__(self, path):
+        """
+        Initialize the TableWriter class
+        Args:
+            path: (String), Required: S3 or local path. The format is chosen from the suffix
+        Returns:
+            None
+        """
+        self.path = path
+        self.fmt = table_format(path)
+        self.num_rows = 0
+        self._columns = None
+        self._schema = None
+        self._parquet_writer = None
+        self._feather_batches = []
+        self._done = False
+        # S3 objects only appear once fully uploaded, local files are renamed into place when the writer closes
+        self._tmp_path = '%s.%i.tmp' % (path, os.getpid()) if '://' not in path else None
+        self._file = fsspec.open(self._tmp_path or path, 'wb' if self.fmt != 'csv' else 'w').open()
+
+    def write(self, batch):
+        """
+        Append a batch to the file
+        Args:
+            batch: (Pandas DataFrame), Required: Rows to append. Columns are aligned to the first batch
+        Returns:
+            None
+        """
+        if self._columns is None:
+            self._columns = batch.columns
+        batch = batch.reindex(columns=self._columns)
+
+        if self.fmt == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            if self._parquet_writer is None:
+                self._schema = _nullable_schema(pa.Schema.from_pandas(batch, preserve_index=False))
+                self._parquet_writer = pq.ParquetWriter(self._file, self._schema)
+            self._parquet_writer.write_table(pa.Table.from_pandas(batch, schema=self._schema, preserve_index=False))
+        elif self.fmt == 'feather':
+            self._feather_batches.append(batch)
+        else:
+            batch.to_csv(self._file, header=self.num_rows == 0, index=False)
+        self.num_rows += len(batch)
+
+    def close(self):
+        """
+        Finish the file and move it onto the target path
+        Returns:
+            None
+        """
+        if self._done:
+            return
+        self._done = True
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        if self._feather_batches:
+            pd.concat(self._feather_batches, ignore_index=True).to_feather(self._file)
+        self._file.close()
+        if self._tmp_path:
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """
+        Discard everything written so far, leaving any existing file at the target path as it was
+        Returns:
+            None
+        """
+        if self._done:
+            return
+        self._done = True
+        if self._tmp_path:
+            self._file.close()
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+        elif hasattr(self._file, 'discard'):
+            # Cancel the S3 upload instead of completing it with partial data
+            self._file.discard()
+        else:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _nullable_schema(schema):
+    """Widen a schema inferred from the first batch so later batches with missing values still fit it"""
+    import pyarrow as pa
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type) or pa.types.is_boolean(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def parse_columns(columns, allowed):
+    """
+    Read the columns a client asked for
+    Args:
+        columns: (String), Required: Comma separated column names, or None for every column
+        allowed: (list of Strings), Required: Columns that can be returned, in their default order
+    Returns:
+        columns: (list of Strings): Requested columns
+    """
+    if not columns:
+        return list(allowed)
+    columns = [column.strip() for column in columns.split(',') if column.strip()]
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError('Unknown columns: %s' % ', '.join(unknown))
+    return columns
+
+
+def players_json(stats, columns, **fields):
+    """
+    Serialize the requested columns of a page of players
+    Args:
+        stats: (list of dict), Required: Column values of each player
+        columns: (list of Strings), Required: Columns to keep
+        fields: (dict), Optional: Other top level fields of the response, such as the next page link
+    Returns:
+        body: (bytes): UTF-8 JSON document
+    """
+    payload = dict(fields, players=[{column: player[column] for column in columns} for player in stats])
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def gzip_body(body, level=6):
+    """
+    Compress a response body. The header carries no timestamp, so the same body always compresses to the same bytes
+    and keeps its strong ETag
+    Args:
+        body: (bytes), Required: Response body
+        level: (int), Optional: Compression level from 1 (fastest) to 9 (smallest)
+    Returns:
+        body: (bytes): Gzip compressed body
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(body)
+    return buffer.getvalue()
+
+
+def strong_etag(version, *parts):
+    """
+    Build a strong ETag for one representation of a response
+    Args:
+        version: (int), Required: Dataset version stamp the response is built from
+        parts: (tuple), Required: Everything else the response bytes depend on, such as the request path and encoding
+    Returns:
+        etag: (String): Unquoted entity tag
+    """
+    return hashlib.sha1(repr((version,) + parts).encode()).hexdigest()
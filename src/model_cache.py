@@ -0,0 +1,142 @@
+import functools
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def sklearn_version():
+    """Get the installed scikit-learn version from its package metadata, without the cost of importing it"""
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        # Python versions before 3.8
+        from pkg_resources import get_distribution
+        return get_distribution('scikit-learn').version
+    return version('scikit-learn')
+
+
+def data_key(features):
+    """
+    Hash the feature matrix used in clustering so identical inputs map to the same cached artifacts
+    Args:
+        features: (Pandas DataFrame), Required: Unscaled features used in clustering
+    Returns:
+        key: (String): Hex digest of the column names, shape and values
+    """
+    values = np.ascontiguousarray(features.to_numpy(dtype=np.float64))
+    digest = hashlib.sha256()
+    digest.update(repr((list(features.columns), values.shape)).encode())
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def artifact_key(*parts):
+    """
+    Build the key of one cached artifact from the data hash and the settings that produced it. The scikit-learn
+    version is part of every key since fits are only reproducible within one version
+    Args:
+        parts: (tuple), Required: Data hash, artifact name and settings such as the number of clusters and seed
+    Returns:
+        key: (String): Hex digest identifying the artifact
+    """
+    return hashlib.sha256(repr((sklearn_version(),) + parts).encode()).hexdigest()
+
+
+class ModelCache:
+    """On-disk cache of fitted scalers, K-means fits and Silhouette scores addressed by a hash of their inputs,
+    evicting the least recently used artifacts once the cache grows past its size limit"""
+
+    def __init__(self, cache_dir, max_size_mb=256):
+        """
+        Initialize the ModelCache class
+        Args:
+            cache_dir: (String), Required: Local directory holding the cached artifacts
+            max_size_mb: (float), Optional: Size in megabytes above which the least recently used artifacts are removed
+        Returns:
+            None
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size_mb*1e6
+        self._memory = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __getstate__(self):
+        # Worker processes get their own empty in-memory layer
+        return {'cache_dir': self.cache_dir, 'max_size': self.max_size, '_memory': {}}
+
+    def _path(self, key):
+        """Get the file holding an artifact"""
+        return os.path.join(self.cache_dir, '%s.npz' % key)
+
+    def get(self, key):
+        """
+        Get a cached artifact
+        Args:
+            key: (String), Required: Artifact key from `artifact_key`
+        Returns:
+            arrays: (dict): Artifact arrays by name, or None if not cached
+        """
+        if key in self._memory:
+            return self._memory[key]
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                arrays = {name: f[name] for name in f.files}
+            # Mark the artifact as recently used for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self._memory[key] = arrays
+        return arrays
+
+    def put(self, key, **arrays):
+        """
+        Cache an artifact and evict old artifacts if the cache is over its size limit
+        Args:
+            key: (String), Required: Artifact key from `artifact_key`
+            arrays: (numpy arrays), Required: Arrays making up the artifact by name
+        Returns:
+            None
+        """
+        self._memory[key] = arrays
+        path = self._path(key)
+        # Write through a temporary file so processes sharing the cache never read a partial artifact
+        tmp_path = '%s.%i.%i.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used artifacts until the cache fits within its size limit
+        Returns:
+            None
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        size = sum(entry[1] for entry in entries)
+        for _, file_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            self._memory.pop(name[:-len('.npz')], None)
+            size -= file_size
+            logger.debug('Evicted %s from the model cache.', name)
@@ -1,16 +1,279 @@
+import datetime
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+from collections import namedtuple
 
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import silhouette_score
+
+from src.model_cache import artifact_key, data_key, sklearn_version
+
+# scikit-learn and SciPy are imported inside the functions that fit models, so labelling players with a saved model
+# does not pay for importing them
 
 logger = logging.getLogger(__name__)
 
+# Result of one K-means fit, whether fitted now or loaded from the model cache
+ClusterFit = namedtuple('ClusterFit', ['centroids', 'labels', 'inertia'])
+
+# Layout version of saved cluster models. Bump when the fields of the saved model change
+MODEL_FORMAT_VERSION = 1
+
+# Scaled feature matrix shared by the worker processes fitting K-means. Each worker receives it once when it starts instead of with every task
+_sweep_features = {}
+
+
+def scale_features(df, cluster_cols, cache=None):
+    """
+    Scale the clustering features so all of them are weighted equally, reusing the scaler fitted on identical data
+    Args:
+        df: (Pandas DataFrame), Required: Data features based on player statistics to be used in clustering
+        cluster_cols (list of Strings), Required: Columns used as features in K-means
+        cache: (ModelCache), Optional: Cache of fitted artifacts. Nothing is cached if None
+    Returns:
+        scaled_features: (numpy array): Scaled features used in clustering
+        key: (String): Hash of the features identifying their cached artifacts, None if there is no cache
+        scaler: (StandardScaler): Scaler fitted on the features
+    """
+    from sklearn.preprocessing import StandardScaler
+
+    features = df[cluster_cols]
+    scaler = StandardScaler()
+    if cache is None:
+        return scaler.fit_transform(features), None, scaler
+
+    key = data_key(features)
+    scaler_key = artifact_key(key, 'scaler')
+    cached = cache.get(scaler_key)
+    if cached is None:
+        scaler.fit(features)
+        cache.put(scaler_key, mean=scaler.mean_, scale=scaler.scale_, var=scaler.var_, n_samples_seen=scaler.n_samples_seen_)
+    else:
+        scaler.mean_, scaler.scale_, scaler.var_ = cached['mean'], cached['scale'], cached['var']
+        scaler.n_samples_seen_ = cached['n_samples_seen']
+        # Restore the column names a fit would record so transforming the DataFrame passes sklearn's name check
+        scaler.n_features_in_ = len(cluster_cols)
+        scaler.feature_names_in_ = np.asarray(cluster_cols, dtype=object)
+    return scaler.transform(features), key, scaler
+
+
+def fit_kmeans(scaled_features,n_clusters,init_type,n_init,max_iter,random_state,cache=None,key=None,engine='full',batch_size=1024):
+    """
+    Fit K-means, or load the fit from the model cache if these features were already clustered with the same settings
+    Args:
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+        n_clusters (int), Required: Number of clusters to be used in K-means
+        init_type (String), Required: Initialization method for K-means
+        n_init (int), Required: Number of times K-means is run with different starting seeds
+        max_iter (int), Required: Maximum number of iterationsfor K-means in one run
+        random_state (int), Required: Random seed for K-means
+        cache: (ModelCache), Optional: Cache of fitted artifacts. Nothing is cached if None
+        key: (String), Optional: Hash of the features from `scale_features`, required to use the cache
+        engine: (String), Optional: `full` for full-batch K-means or `minibatch` to update the centroids from
+            mini-batches of players, which scales to many seasons of players at a small cost in SSE
+        batch_size: (int), Optional: Number of players in each mini-batch and in each chunk labelled at once
+    Returns:
+        fit: (ClusterFit): Cluster centroids, cluster label of each player and within cluster SSE
+    """
+    from sklearn.cluster import KMeans, MiniBatchKMeans
+
+    if engine not in ('full', 'minibatch'):
+        logger.error('K-means engine %s is not one of full or minibatch', engine)
+        raise ValueError('K-means engine %s is not one of full or minibatch' % engine)
+
+    fit_key = artifact_key(key, 'kmeans', n_clusters, init_type, n_init, max_iter, random_state, engine,
+                           batch_size if engine == 'minibatch' else None)
+    cached = cache.get(fit_key) if cache is not None and key is not None else None
+    if cached is not None:
+        return ClusterFit(cached['centroids'], cached['labels'], float(cached['inertia']))
+
+    if engine == 'minibatch':
+        kmeans = MiniBatchKMeans(init=init_type,n_clusters=n_clusters,n_init=n_init,max_iter=max_iter,random_state=random_state,
+                                 batch_size=batch_size,compute_labels=False)
+        kmeans.fit(scaled_features)
+        labels, inertia = _label_chunks(scaled_features, kmeans.cluster_centers_, batch_size)
+        fit = ClusterFit(kmeans.cluster_centers_, labels, inertia)
+    else:
+        kmeans = KMeans(init=init_type,n_clusters=n_clusters,n_init=n_init,max_iter=max_iter,random_state=random_state)
+        kmeans.fit(scaled_features)
+        fit = ClusterFit(kmeans.cluster_centers_, kmeans.labels_, kmeans.inertia_)
+    if cache is not None and key is not None:
+        cache.put(fit_key, centroids=fit.centroids, labels=fit.labels, inertia=np.float64(fit.inertia))
+    return fit
+
+
+def _label_chunks(scaled_features, centroids, chunk_size):
+    """
+    Assign every player to the nearest centroid one chunk of players at a time
+    Args:
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+        centroids: (numpy array), Required: Cluster centroids
+        chunk_size: (int), Required: Number of players labelled at once
+    Returns:
+        labels: (numpy array): Cluster label of each player
+        inertia: (float): Within cluster SSE
+    """
+    labels = np.empty(len(scaled_features), dtype=np.int32)
+    inertia = 0.
+    for start in range(0, len(scaled_features), chunk_size):
+        chunk = scaled_features[start:start+chunk_size]
+        distances = ((chunk[:, np.newaxis, :]-centroids[np.newaxis, :, :])**2).sum(axis=2)
+        labels[start:start+chunk_size] = distances.argmin(axis=1)
+        inertia += distances.min(axis=1).sum()
+    return labels, inertia
+
+
+def _init_sweep_worker(scaled_features):
+    """
+    Store the scaled feature matrix for the k-sweep in the current process
+    Args:
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+    Returns:
+        None
+    """
+    _sweep_features['X'] = scaled_features
+
+
+def _map_shared(func, tasks, scaled_features, n_jobs):
+    """
+    Run a function over tasks that all read the same scaled feature matrix, spreading them over a pool of processes
+    Args:
+        func: (function), Required: Top level function taking one task and reading the matrix from `_sweep_features`
+        tasks: (list), Required: Tasks to run
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+        n_jobs: (int), Required: Number of processes. -1 uses every core and 1 runs the tasks in this process
+    Returns:
+        results: (list): Result of each task in the order of the tasks
+        n_jobs: (int): Number of processes used
+    """
+    n_jobs = max(min(os.cpu_count() if n_jobs == -1 else n_jobs, len(tasks)), 1)
+    if n_jobs > 1:
+        with multiprocessing.Pool(n_jobs, initializer=_init_sweep_worker, initargs=(scaled_features,)) as pool:
+            # Pool.map hands back the results in the order of the tasks
+            results = pool.map(func, tasks, chunksize=1)
+    else:
+        _init_sweep_worker(scaled_features)
+        results = [func(task) for task in tasks]
+    _sweep_features.clear()
+    return results, n_jobs
+
+
+def _sampled_silhouette(scaled_features, labels, sample_size, random_state, working_memory=None):
+    """
+    Estimate the Silhouette score from the exact Silhouette values of a random sample of players. Each sampled player
+    is compared against every player, so the estimate is unbiased and only a sample-by-chunk block of distances is
+    held in memory at a time
+    Args:
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+        labels: (numpy array), Required: Cluster label of each player
+        sample_size: (int), Required: Number of players sampled
+        random_state: (int), Required: Random seed for the sample
+        working_memory: (int), Optional: Megabytes of distances computed at once. Uses the scikit-learn default if None
+    Returns:
+        score: (float): Estimated Silhouette score
+        margin: (float): Half-width of the 95% confidence interval of the estimate
+    """
+    n = scaled_features.shape[0]
+    rng = np.random.RandomState(random_state)
+    sample = np.sort(rng.choice(n, sample_size, replace=False)) if sample_size < n else np.arange(n)
+    _, labels = np.unique(labels, return_inverse=True)
+    counts = np.bincount(labels)
+    onehot = np.eye(len(counts))[labels]
+
+    values = []
+    for start, distances in _iter_distance_chunks(scaled_features[sample], scaled_features, working_memory):
+        # Mean distance from each sampled player to the players in every cluster, leaving the player itself out of its own
+        own = labels[sample[start:start+len(distances)]]
+        sums = distances.dot(onehot)
+        rows = np.arange(len(own))
+        own_size = counts[own]-1
+        a = sums[rows, own]/np.maximum(own_size, 1)
+        means = sums/counts
+        means[rows, own] = np.inf
+        b = means.min(axis=1)
+        s = np.where(own_size > 0, (b-a)/np.maximum(a, b), 0)
+        values.append(np.nan_to_num(s))
+    values = np.concatenate(values)
+
+    score = values.mean()
+    if len(values) < 2 or len(values) == n:
+        return score, 0.
+    # Finite population correction since players are sampled without replacement
+    margin = 1.96*values.std(ddof=1)/np.sqrt(len(values))*np.sqrt(1-len(values)/n)
+    return score, margin
+
+
+def _iter_distance_chunks(X, Y, working_memory=None):
+    """Yield the start row and block of Euclidean distances from rows of X to all of Y, a bounded block at a time"""
+    from sklearn.metrics import pairwise_distances_chunked
+    start = 0
+    for distances in pairwise_distances_chunked(X, Y, working_memory=working_memory):
+        yield start, distances
+        start += len(distances)
+
+
+def cluster_silhouette(scaled_features, labels, mode='exact', sample_size=5000, random_state=None, working_memory=64):
+    """
+    Calculate the Silhouette score of a cluster fit exactly, exactly in bounded memory, or from a random sample
+    Args:
+        scaled_features: (numpy array), Required: Scaled features used in clustering
+        labels: (numpy array), Required: Cluster label of each player
+        mode: (String), Optional: `exact` for the full calculation, `chunked` for the same result computing at most
+            `working_memory` megabytes of distances at a time, or `sampled` to estimate it from `sample_size` players
+        sample_size: (int), Optional: Number of players sampled in `sampled` mode
+        random_state: (int), Optional: Random seed for the sample in `sampled` mode
+        working_memory: (int), Optional: Megabytes of distances computed at once in `chunked` and `sampled` modes
+    Returns:
+        score: (float): Silhouette score
+        margin: (float): Half-width of the 95% confidence interval of the score, 0 unless sampled
+    """
+    import sklearn
+    from sklearn.metrics import silhouette_score
+
+    if mode == 'exact':
+        return silhouette_score(scaled_features, labels), 0.
+    if mode == 'chunked':
+        with sklearn.config_context(working_memory=working_memory):
+            return silhouette_score(scaled_features, labels), 0.
+    if mode == 'sampled':
+        return _sampled_silhouette(scaled_features, labels, sample_size, random_state, working_memory)
+    logger.error('Silhouette mode %s is not one of exact, chunked or sampled', mode)
+    raise ValueError('Silhouette mode %s is not one of exact, chunked or sampled' % mode)
 
-def optimal_clusternum(df,min_clust,max_clust,cluster_cols,init_type,n_init,max_iter,random_state,SSEpath,silpath):
+
+def _fit_k(task):
+    """
+    Fit K-means for one number of clusters on the shared feature matrix
+    Args:
+        task: (tuple), Required: Number of clusters, initialization method, number of initializations, maximum iterations,
+            random seed, K-means engine, mini-batch size, Silhouette score settings, model cache and feature hash
+    Returns:
+        k: (int): Number of clusters
+        sse: (float): Within cluster SSE of the fit
+        score: (float): Silhouette score of the fit
+        margin: (float): Half-width of the 95% confidence interval of the Silhouette score
+    """
+    k, init_type, n_init, max_iter, random_state, engine, batch_size, silhouette, cache, key = task
+    scaled_features = _sweep_features['X']
+    fit = fit_kmeans(scaled_features, k, init_type, n_init, max_iter, random_state, cache, key, engine, batch_size)
+
+    # The working memory only bounds how the score is calculated, so it is left out of the cache key
+    score_key = artifact_key(key, 'silhouette', k, init_type, n_init, max_iter, random_state, engine,
+                             batch_size if engine == 'minibatch' else None, silhouette.get('mode', 'exact'), silhouette.get('sample_size'))
+    cached = cache.get(score_key) if cache is not None and key is not None else None
+    if cached is not None:
+        return k, fit.inertia, float(cached['score']), float(cached['margin'])
+
+    score, margin = cluster_silhouette(scaled_features, fit.labels, random_state=random_state, **silhouette)
+    if cache is not None and key is not None:
+        cache.put(score_key, score=np.float64(score), margin=np.float64(margin))
+    return k, fit.inertia, score, margin
+
+
+def optimal_clusternum(df,min_clust,max_clust,cluster_cols,init_type,n_init,max_iter,random_state,metrics_path=None,n_jobs=1,silhouette=None,engine='full',batch_size=1024,cache=None):
     """
     Run K-means clustering for different numbers of total clusters and calculate SSE and Silhouette scores for each fit
     Args:
@@ -22,98 +285,119 @@ def optimal_clusternum(df,min_clust,max_clust,cluster_cols,init_type,n_init,max_
         n_init (int), Required: Number of times K-means is run with different starting seeds
         max_iter (int), Required: Maximum number of iterationsfor K-means in one run
         random_state (int), Required: Random seed for K-means
-        SSEpath (String), Required: Filepath to save SSE plot
-        silpath (String), Required: Filepath to save Silhouette score plot
+        metrics_path (String), Optional: Path to save the SSE and Silhouette score of each number of clusters. Not saved if None
+        n_jobs (int), Optional: Number of processes fitting different numbers of clusters at once. -1 uses every core
+        silhouette (dict), Optional: Keyword arguments for `cluster_silhouette` choosing how Silhouette scores are calculated. Exact if None
+        engine (String), Optional: `full` for full-batch K-means or `minibatch` for mini-batch K-means
+        batch_size (int), Optional: Number of players in each mini-batch
+        cache (ModelCache), Optional: Cache of fitted artifacts reused across stages and runs. Nothing is cached if None
     Returns:
-        None
+        metrics: (Pandas DataFrame): Number of clusters, within cluster SSE, Silhouette score and half-width of its 95%
+            confidence interval for each fit, used to plot the SSE and Silhouette scores
     """
     # Ensure df is a DataFrame
     if not isinstance(df, pd.DataFrame):
         logger.error('Provided argument `df` is not a Pandas DataFrame object')
         raise TypeError('Provided argument `df` is not a Pandas DataFrame object')
 
-    # Isolate columns to be used as features in clustering
-    features = df[cluster_cols]
     # Scale columns prior to clustering to weight all features equally
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(features)
+    scaled_features, key, _ = scale_features(df, cluster_cols, cache)
 
-    # Find the optimal number of clusters by looping through different cluster numbers and fitting K-means on each
+    # Find the optimal number of clusters by fitting K-means on each cluster number, spreading the fits over a pool of processes
+    tasks = [(k, init_type, n_init, max_iter, random_state, engine, batch_size, silhouette or {}, cache, key)
+             for k in range(min_clust, max_clust)]
     logger.debug('Attempting to run K-Means on several cluster numbers.')
-    sse = []
-    silhouette_scores = []
-    for k in range(min_clust, max_clust):
-        kmeans = KMeans(init=init_type,n_clusters=k,n_init=n_init,max_iter=max_iter,random_state=random_state)
-        kmeans.fit(scaled_features)
-        # Record within cluster SSE for each number of clusters
-        sse.append(kmeans.inertia_)
-        # Record Silhouette Score for each number of clusters
-        score = silhouette_score(scaled_features, kmeans.labels_)
-        silhouette_scores.append(score)
+    results, n_jobs = _map_shared(_fit_k, tasks, scaled_features, n_jobs)
+
+    # Record within cluster SSE and Silhouette Score for each number of clusters
+    metrics = pd.DataFrame(results, columns=['n_clusters', 'sse', 'silhouette', 'silhouette_margin'])
+    for k, _, score, margin in results:
+        if margin:
+            logger.debug('Sampled Silhouette score for %i clusters: %.4f +/- %.4f', k, score, margin)
 
-    logger.info('Trained K-means on %i to %i number of clusters and calculated within-cluster SSE and Silhouette score for each.', 2, 11)
+    logger.info('Trained K-means on %i to %i number of clusters with %i processes and calculated within-cluster SSE and Silhouette score for each.', min_clust, max_clust-1, n_jobs)
 
-    # Call functions to generate SSE and Silhouette score plots
-    generate_SSEplot(sse,SSEpath,min_clust,max_clust)
-    generate_silplot(silhouette_scores,silpath,min_clust,max_clust)
+    # Save the metrics so plots can be rendered from them later
+    if metrics_path:
+        try:
+            metrics.to_csv(metrics_path,index=False)
+        except OSError:
+            logger.warning('The filepath %s could not be found or accessed to save the clustering metrics.',metrics_path)
+        else:
+            logger.info('Within-cluster SSE and Silhouette scores saved to %s',metrics_path)
+    return metrics
 
 
-def generate_SSEplot(sse,SSEpath,min_clust,max_clust):
+def align_labels(reference, labels, n_clusters):
     """
-    Plot number of clusters vs. within-cluster SSE for K-means fits
+    Renumber the clusters of one fit to best match the clusters of a reference fit, pairing clusters with an optimal
+    assignment on the contingency matrix of the two labellings
     Args:
-        sse: (list), Required: Within cluster SSE values for K-means clustering fits for different numbers of clusters
-        SSEpath (String), Required: Filepath to save SSE plot
-        min_clust (int), Required: Minimum number of clusters to try in K-means
-        max_clust (int), Required: Maximum number of clusters to try in K-means
+        reference: (numpy array), Required: Cluster label of each player in the reference fit
+        labels: (numpy array), Required: Cluster label of each player in the fit to renumber
+        n_clusters: (int), Required: Number of clusters in both fits
     Returns:
-        None
+        aligned: (numpy array): Labels renumbered so each cluster takes the number of the reference cluster it overlaps most
     """
-    # Generate and save SSE plot to model folder
-    plt.plot(range(min_clust, max_clust), sse)
-    plt.xticks(range(min_clust, max_clust))
-    plt.xlabel('Number of Clusters')
-    plt.ylabel('SSE')
+    from scipy.optimize import linear_sum_assignment
 
-    try:
-        plt.savefig(SSEpath)
-    except OSError:
-        logger.warning('The filepath %s could not be found or accessed to save the SSE plot.',SSEpath)
-    else:
-        logger.info('Number of clusters vs. within cluster SSE plot saved to %s',SSEpath)
-    plt.close()
+    contingency = np.bincount(reference*n_clusters+labels, minlength=n_clusters*n_clusters).reshape(n_clusters, n_clusters)
+    reference_clusters, clusters = linear_sum_assignment(-contingency)
+    mapping = np.empty(n_clusters, dtype=np.int64)
+    mapping[clusters] = reference_clusters
+    return mapping[labels]
 
 
-def generate_silplot(silhouette_scores,silpath,min_clust,max_clust):
+def _fit_seed(task):
     """
-    Plot number of clusters vs. Silhouette score for K-means fits
+    Fit K-means with one seed, optionally on a bootstrap resample of the players, and label every player
     Args:
-        silhouette_scores: (list), Required: Silhouette scores for K-means clustering fits for different numbers of clusters
-        silpath (String), Required: Filepath to save Silhouette score plot
-        min_clust (int), Required: Minimum number of clusters to try in K-means
-        max_clust (int), Required: Maximum number of clusters to try in K-means
+        task: (tuple), Required: Random seed, whether to resample, number of clusters, initialization method, number
+            of initializations, maximum iterations, K-means engine, mini-batch size, model cache and feature hash
     Returns:
-        None
+        labels: (numpy array): Cluster label of every player
     """
-    # Generate and save Silhouette plot to model folder
-    plt.plot(range(min_clust, max_clust), silhouette_scores)
-    plt.xticks(range(min_clust, max_clust))
-    plt.xlabel('Number of Clusters')
-    plt.ylabel('Silhouette Coefficient')
+    seed, bootstrap, n_clusters, init_type, n_init, max_iter, engine, batch_size, cache, key = task
+    scaled_features = _sweep_features['X']
+    if not bootstrap:
+        return fit_kmeans(scaled_features, n_clusters, init_type, n_init, max_iter, seed, cache, key, engine, batch_size).labels
+
+    # Fit on players drawn with replacement, then label every player against the resampled centroids
+    rows = np.random.RandomState(seed).randint(0, len(scaled_features), len(scaled_features))
+    sample_key = artifact_key(key, 'bootstrap', seed) if key is not None else None
+    fit = fit_kmeans(scaled_features[rows], n_clusters, init_type, n_init, max_iter, seed, cache, sample_key, engine, batch_size)
+    labels, _ = _label_chunks(scaled_features, fit.centroids, batch_size)
+    return labels
 
-    try:
-        plt.savefig(silpath)
-    except OSError:
-        logger.warning('The filepath %s could not be found or accessed to save the Silhouette plot.',silpath)
-    else:
-        logger.info('Number of clusters vs. Silhouette scores plot saved to %s',silpath)
-    plt.close()
 
+def stability_report(reference, runs, n_clusters):
+    """
+    Measure how often each player keeps its reference cluster across other fits
+    Args:
+        reference: (numpy array), Required: Cluster label of each player in the reference fit
+        runs: (numpy array), Required: Aligned cluster labels of each comparison fit, one row per fit
+        n_clusters: (int), Required: Number of clusters
+    Returns:
+        report: (Pandas DataFrame): Players and mean and minimum percent agreement over the fits for each cluster and overall
+    """
+    agree = runs == reference[np.newaxis, :]
+    counts = np.bincount(reference, minlength=n_clusters)
+    # Share of each cluster's players that kept their cluster, one row per fit
+    per_cluster = agree.astype(np.float64).dot(np.eye(n_clusters)[reference])/np.maximum(counts, 1)
+    overall = agree.mean(axis=1)
+
+    report = pd.DataFrame({'cluster': [str(cluster) for cluster in range(n_clusters)] + ['overall'],
+                           'n_players': np.append(counts, len(reference)),
+                           'mean_agreement': 100*np.append(per_cluster.mean(axis=0), overall.mean()),
+                           'min_agreement': 100*np.append(per_cluster.min(axis=0), overall.min())})
+    return report
 
-def test_cluster_stability(df,cluster_cols,init_type,n_init,max_iter,random_state,n_clusters,random_state_comp,cluster_map,cluster_col1,cluster_col2,round_digits,savepath):
+
+def test_cluster_stability(df,cluster_cols,init_type,n_init,max_iter,random_state,n_clusters,random_state_comp,cluster_col1,cluster_col2,round_digits,savepath,
+                           n_seeds=1,bootstrap=False,n_jobs=1,report_path=None,cluster_map=None,engine='full',batch_size=1024,cache=None):
     """
-    Run K-means clustering twice with different seeds and see how many of the cluster assignments change for a
-    measure of stability of the cluster fit
+    Run K-means clustering with several other seeds and see how many of the cluster assignments change for a
+    measure of stability of the cluster fit. Clusters of each run are matched to the reference run automatically
     Args:
         df: (Pandas DataFrame), Required: Data features based on player statistics to be used in clustering
         cluster_cols (list of Strings), Required: Columns used as features in K-means
@@ -122,52 +406,65 @@ def test_cluster_stability(df,cluster_cols,init_type,n_init,max_iter,random_stat
         max_iter (int), Required: Maximum number of iterationsfor K-means in one run
         random_state (int), Required: Random seed for K-means
         n_clusters (int), Required: Number of clusters to be used in K-means
-        random_state_comp (int), Required: Random seed for K-means being used as a comparison run for stability
-        cluster_map (dict), Required: The mapping of similar cluster between the two runs
+        random_state_comp (int), Required: Random seed for the first comparison run. Later runs use the following seeds
         cluster_col1 (String), Required: Column name for the newly created cluster labels column
-        cluster_col2 (String), Required: Column name for the newly created cluster labels column for the second clustering run
+        cluster_col2 (String), Required: Column name for the newly created cluster labels column for the first comparison run
         round_digits (int), Required: Number of digits to round outputs to
-        savepath (String), Required: Path to save percent difference between the two clustering fits
+        savepath (String), Required: Path to save the overall percent similarity of the comparison runs to the reference run
+        n_seeds (int), Optional: Number of comparison runs
+        bootstrap (bool), Optional: Fit each comparison run on a bootstrap resample of the players
+        n_jobs (int), Optional: Number of processes fitting comparison runs at once. -1 uses every core
+        report_path (String), Optional: Path to save the per-cluster and overall stability report. Not saved if None
+        cluster_map (dict), Optional: Fixed mapping of comparison clusters to reference clusters, only used with one
+            comparison run. Clusters are matched automatically if None
+        engine (String), Optional: `full` for full-batch K-means or `minibatch` for mini-batch K-means
+        batch_size (int), Optional: Number of players in each mini-batch
+        cache (ModelCache), Optional: Cache of fitted artifacts reused across stages and runs. Nothing is cached if None
     Returns:
-        None
+        report: (Pandas DataFrame): Players and mean and minimum percent agreement for each cluster and overall
     """
     # Ensure df is a DataFrame
     if not isinstance(df, pd.DataFrame):
         logger.error('Provided argument `df` is not a Pandas DataFrame object')
         raise TypeError('Provided argument `df` is not a Pandas DataFrame object')
 
-    # Isolate columns to be used as features in clustering
-    features = df[cluster_cols]
     # Scale columns prior to clustering to weight all features equally
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(features)
+    scaled_features, key, _ = scale_features(df, cluster_cols, cache)
     # Fit kmeans with optimal number of clusters
-    kmeans = KMeans(init=init_type,n_clusters=n_clusters,n_init=n_init,max_iter=max_iter,random_state=random_state)
-    kmeans.fit(scaled_features)
+    fit = fit_kmeans(scaled_features,n_clusters,init_type,n_init,max_iter,random_state,cache,key,engine,batch_size)
+    reference = np.asarray(fit.labels, dtype=np.int64)
     # Append cluster assignments to the features DataFrame
-    df[cluster_col1] = kmeans.labels_
-    # Check the stability of the clusters by fitting Kmeans again with a different seed
-    kmeans_compared = KMeans(init=init_type,n_clusters=n_clusters,n_init=n_init,max_iter=max_iter,random_state=random_state_comp)
-    kmeans_compared.fit(scaled_features)
-    df[cluster_col2] = kmeans_compared.labels_
-    # Align cluster labels between the two fits
-    df[cluster_col2] = df[cluster_col2].map(cluster_map)
-
-    # Count the percentage of classification differences between the two cluster fits
-    num_diff = sum(i != j for i, j in zip(df[cluster_col1],df[cluster_col2]))
-    perc_diff = round(100*(1-num_diff/len(df)),round_digits)
-    perc_diff_df = pd.DataFrame(columns=['perc_similar'])
-    perc_diff_df.loc[0] = perc_diff
+    df[cluster_col1] = reference
+
+    # Check the stability of the clusters by fitting Kmeans again with other seeds, spreading the fits over a pool of processes
+    tasks = [(random_state_comp+i, bootstrap, n_clusters, init_type, n_init, max_iter, engine, batch_size, cache, key) for i in range(n_seeds)]
+    results, n_jobs = _map_shared(_fit_seed, tasks, scaled_features, n_jobs)
+
+    # Align cluster labels of every comparison run with the reference run
+    if cluster_map is not None and n_seeds == 1:
+        runs = pd.Series(results[0]).map(cluster_map).to_numpy()[np.newaxis, :]
+    else:
+        runs = np.vstack([align_labels(reference, np.asarray(labels, dtype=np.int64), n_clusters) for labels in results])
+    df[cluster_col2] = runs[0]
+
+    # Compare every run with the reference run at once
+    report = stability_report(reference, runs, n_clusters).round(round_digits)
+    perc_similar = report['mean_agreement'].iloc[-1]
+    perc_diff_df = pd.DataFrame({'perc_similar': [perc_similar]})
+    logger.info('Compared %i %sruns with %i processes.', n_seeds, 'bootstrap ' if bootstrap else '', n_jobs)
 
     try:
         perc_diff_df.to_csv(savepath,index=False)
+        if report_path:
+            report.to_csv(report_path,index=False)
     except OSError:
         logger.warning('The filepath %s could not be found or accessed to save the cluster stability metric.',savepath)
     else:
-        logger.info('The similarity in cluster assignments between two runs with different seeds is %s percent.',str(perc_diff))
+        logger.info('The similarity in cluster assignments between runs with different seeds is %s percent.',str(perc_similar))
+    return report
 
 
-def final_cluster_fit(df,cluster_cols,init_type,n_init,max_iter,random_state,n_clusters,label_col,label_col2,label_map,player_type_col,scatterx_col,scattery_col,palette,clust_title,clust_plot):
+def final_cluster_fit(df,cluster_cols,init_type,n_init,max_iter,random_state,n_clusters,label_col,label_col2,label_map,player_type_col,model_path=None,engine='full',batch_size=1024,cache=None):
     """
     Run K-means clustering and assign a cluster label to each player
     Args:
@@ -182,11 +479,10 @@ def final_cluster_fit(df,cluster_cols,init_type,n_init,max_iter,random_state,n_c
         label_col2 (String), Required: Column name for cluster labels of second clustering run
         label_map (dict), Required: Mapping of cluster labels to descriptive player types
         player_type_col (String), Required: Column for newly created player type labels
-        scatterx_col (String), Required: Column used as X-axis in scatterplot
-        scattery_col (String), Required: Column used as Y-axis in scatterplot
-        palette (String), Required: Color palette used in plots
-        clust_title (String), Required: Title for cluster visualization plot
-        clust_plot (String), Required: Path to save cluster visualization
+        model_path (String), Optional: Path to save the fitted scaler and centroids for assigning new players. Not saved if None
+        engine (String), Optional: `full` for full-batch K-means or `minibatch` for mini-batch K-means
+        batch_size (int), Optional: Number of players in each mini-batch
+        cache (ModelCache), Optional: Cache of fitted artifacts reused across stages and runs. Nothing is cached if None
     Returns:
         cluster_assignments: (Pandas DataFrame): Features and new column designating cluster labels for each player
     """
@@ -196,32 +492,100 @@ def final_cluster_fit(df,cluster_cols,init_type,n_init,max_iter,random_state,n_c
         logger.error('Provided argument `df` is not a Pandas DataFrame object')
         raise TypeError('Provided argument `df` is not a Pandas DataFrame object')
 
-    # Isolate columns to be used as features in clustering
-    features = df[cluster_cols]
     # Scale columns prior to clustering to weight all features equally
-    scaler = StandardScaler()
-    scaled_features = scaler.fit_transform(features)
+    scaled_features, key, scaler = scale_features(df, cluster_cols, cache)
     # Fit final kmeans with optimal number of clusters
-    kmeans = KMeans(init=init_type,n_clusters=n_clusters,n_init=n_init,max_iter=max_iter,random_state=random_state)
-    kmeans.fit(scaled_features)
+    fit = fit_kmeans(scaled_features,n_clusters,init_type,n_init,max_iter,random_state,cache,key,engine,batch_size)
     # Append cluster assignments to the features DataFrame
-    df[label_col] = kmeans.labels_
+    df[label_col] = fit.labels
     # Label the clusters with appropriate descriptive names
     df[player_type_col] = df[label_col].map(label_map)
 
-    # Generate a scatterplot that shows the separation between clusters
-    sns.scatterplot(data=df, hue=player_type_col, x=scatterx_col, y=scattery_col, palette=palette)
-    plt.title(clust_title)
-    plt.legend(loc=1)
+    # Keep the fitted model so new players can be labelled without refitting
+    if model_path:
+        save_cluster_model(model_path,scaler,fit,cluster_cols,label_map,player_type_col,random_state)
+
+    # Drop unneeded column. The second clustering run's labels are only there if the stability test ran on df first
+    cluster_assignments = df.drop([label_col,label_col2],axis=1,errors='ignore')
+    logger.info('Cluster assignments DataFrame generated.')
+    return cluster_assignments
+
+
+def save_cluster_model(model_path,scaler,fit,cluster_cols,label_map,player_type_col,random_state):
+    """
+    Save the fitted scaler and K-means centroids as a versioned JSON model artifact
+    Args:
+        model_path (String), Required: Path to save the model
+        scaler (StandardScaler), Required: Scaler fitted on the clustering features
+        fit (ClusterFit), Required: Final K-means fit
+        cluster_cols (list of Strings), Required: Columns used as features in K-means
+        label_map (dict), Required: Mapping of cluster labels to descriptive player types
+        player_type_col (String), Required: Column for player type labels
+        random_state (int), Required: Random seed of the fit
+    Returns:
+        model_version: (String): Hash of the scaler and centroids identifying this model
+    """
+    model = {'cluster_cols': list(cluster_cols),
+             'scaler_mean': np.asarray(scaler.mean_).tolist(),
+             'scaler_scale': np.asarray(scaler.scale_).tolist(),
+             'centroids': np.asarray(fit.centroids).tolist(),
+             'label_map': {str(label): player_type for label, player_type in label_map.items()},
+             'player_type_col': player_type_col}
+    model_version = hashlib.sha256(json.dumps(model, sort_keys=True).encode()).hexdigest()[:12]
+    model.update({'format_version': MODEL_FORMAT_VERSION, 'model_version': model_version,
+                  'created': datetime.datetime.utcnow().isoformat(timespec='seconds'),
+                  'sklearn_version': sklearn_version(), 'random_state': random_state,
+                  'n_players': len(fit.labels)})
 
     try:
-        plt.savefig(clust_plot)
+        with open(model_path, 'w') as f:
+            json.dump(model, f, indent=2)
     except OSError:
-        logger.warning('The filepath %s could not be found or accessed to save the clustering visualization.',clust_plot)
+        logger.warning('The filepath %s could not be found or accessed to save the cluster model.',model_path)
     else:
-        logger.info('Clustering visualizaion saved to %s',clust_plot)
+        logger.info('Cluster model version %s saved to %s',model_version,model_path)
+    return model_version
 
-    # Drop unneeded column
-    cluster_assignments = df.drop([label_col,label_col2],axis=1)
-    logger.info('Cluster assignments DataFrame generated.')
-    return cluster_assignments
+
+def load_cluster_model(model_path):
+    """
+    Load a cluster model saved by `final_cluster_fit`
+    Args:
+        model_path (String), Required: Path of the saved model
+    Returns:
+        model: (dict): Scaler parameters and centroids as numpy arrays, feature columns, label map and version
+    """
+    with open(model_path, 'r') as f:
+        model = json.load(f)
+    if model.get('format_version') != MODEL_FORMAT_VERSION:
+        logger.error('Cluster model at %s has format version %s, expected %s', model_path, model.get('format_version'), MODEL_FORMAT_VERSION)
+        raise ValueError('Cluster model at %s has an unsupported format version' % model_path)
+    for name in ['scaler_mean', 'scaler_scale', 'centroids']:
+        model[name] = np.asarray(model[name])
+    model['label_map'] = {int(label): player_type for label, player_type in model['label_map'].items()}
+    if model['sklearn_version'] != sklearn_version():
+        logger.warning('Cluster model was fitted with scikit-learn %s but %s is installed.', model['sklearn_version'], sklearn_version())
+    return model
+
+
+def assign_players(df, model):
+    """
+    Label players with the player type of their nearest saved centroid without refitting K-means
+    Args:
+        df: (Pandas DataFrame), Required: Features of the players to label, created by `featurize`
+        model: (dict), Required: Cluster model from `load_cluster_model`
+    Returns:
+        df: (Pandas DataFrame): Players with a new column holding their player type
+    """
+    # Ensure df is a DataFrame
+    if not isinstance(df, pd.DataFrame):
+        logger.error('Provided argument `df` is not a Pandas DataFrame object')
+        raise TypeError('Provided argument `df` is not a Pandas DataFrame object')
+
+    # Scale the features with the saved scaler and find the closest centroid for each player
+    scaled_features = (df[model['cluster_cols']].to_numpy(dtype=np.float64)-model['scaler_mean'])/model['scaler_scale']
+    labels, _ = _label_chunks(scaled_features, model['centroids'], 1024)
+    df = df.copy()
+    df[model['player_type_col']] = pd.Series(labels, index=df.index).map(model['label_map'])
+    logger.info('%i players labelled with cluster model version %s.', len(df), model['model_version'])
+    return df
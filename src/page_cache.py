@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PageCache:
+    """Bounded in-process cache of query results and rendered pages. Every entry belongs to one version of the
+    dataset, and the whole cache is dropped when the dataset version stamp in the database changes"""
+
+    def __init__(self, get_version, max_entries=128, version_check_seconds=5):
+        """
+        Initialize the PageCache class
+        Args:
+            get_version: (function), Required: Reads the current dataset version stamp from the database
+            max_entries: (int), Optional: Number of pages kept before the least recently used one is dropped
+            version_check_seconds: (float), Optional: Time between reads of the version stamp. Pages are served without
+                touching the database in between, so a new dataset can take this long to appear
+        Returns:
+            None
+        """
+        self.get_version = get_version
+        self.max_entries = max_entries
+        self.version_check_seconds = version_check_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """
+        Get the dataset version the cached pages belong to, reading the stamp again once the check interval has passed
+        and dropping every cached page if it changed
+        Returns:
+            version: (int): Dataset version stamp
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is not None and now-self._checked < self.version_check_seconds:
+                return self._version
+        version = self.get_version()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.info('Dataset version changed from %s to %s, dropping %i cached pages.',
+                                self._version, version, len(self._entries))
+                self._entries.clear()
+                self._version = version
+            self._checked = time.monotonic()
+            return version
+
+    def get(self, key, build):
+        """
+        Get a cached value, building and caching it on a miss
+        Args:
+            key: (tuple), Required: Cache key, such as the player type and sort column of a page
+            build: (function), Required: Runs the query and renders the page when the key is not cached
+        Returns:
+            value: Value cached under the key for the current dataset version
+        """
+        version = self.version()
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            # Do not cache a page built from data older than a version stamp read in the meantime
+            if version == self._version:
+                self._entries[key] = value
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        """
+        Get the cache counters
+        Returns:
+            stats: (dict): Hits, misses, cached pages and the dataset version they belong to
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries), 'version': self._version}
@@ -0,0 +1,164 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def _new_figure():
+    """Create a figure with its own Agg canvas so plots never touch the global pyplot state"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(111)
+
+
+def _save_figure(fig, path, description):
+    """Save a figure, logging instead of raising if the path cannot be written"""
+    try:
+        fig.savefig(path)
+    except OSError:
+        logger.warning('The filepath %s could not be found or accessed to save the %s.', path, description)
+        return False
+    return True
+
+
+def generate_SSEplot(metrics,SSEpath):
+    """
+    Plot number of clusters vs. within-cluster SSE for K-means fits
+    Args:
+        metrics: (Pandas DataFrame), Required: Number of clusters and within cluster SSE of each fit, from `optimal_clusternum`
+        SSEpath (String), Required: Filepath to save SSE plot
+    Returns:
+        None
+    """
+    # Generate and save SSE plot to model folder
+    fig, ax = _new_figure()
+    ax.plot(metrics['n_clusters'], metrics['sse'])
+    ax.set_xticks(metrics['n_clusters'])
+    ax.set_xlabel('Number of Clusters')
+    ax.set_ylabel('SSE')
+
+    if _save_figure(fig, SSEpath, 'SSE plot'):
+        logger.info('Number of clusters vs. within cluster SSE plot saved to %s',SSEpath)
+
+
+def generate_silplot(metrics,silpath):
+    """
+    Plot number of clusters vs. Silhouette score for K-means fits, with 95% confidence intervals for sampled scores
+    Args:
+        metrics: (Pandas DataFrame), Required: Number of clusters and Silhouette score of each fit, from `optimal_clusternum`
+        silpath (String), Required: Filepath to save Silhouette score plot
+    Returns:
+        None
+    """
+    # Generate and save Silhouette plot to model folder
+    fig, ax = _new_figure()
+    if (metrics['silhouette_margin'] > 0).any():
+        ax.errorbar(metrics['n_clusters'], metrics['silhouette'], yerr=metrics['silhouette_margin'], capsize=3)
+    else:
+        ax.plot(metrics['n_clusters'], metrics['silhouette'])
+    ax.set_xticks(metrics['n_clusters'])
+    ax.set_xlabel('Number of Clusters')
+    ax.set_ylabel('Silhouette Coefficient')
+
+    if _save_figure(fig, silpath, 'Silhouette plot'):
+        logger.info('Number of clusters vs. Silhouette scores plot saved to %s',silpath)
+
+
+def generate_clusterplot(df,player_type_col,scatterx_col,scattery_col,palette,clust_title,clust_plot):
+    """
+    Plot two features of every player colored by player type to show the separation between clusters
+    Args:
+        df: (Pandas DataFrame), Required: Players with their player types
+        player_type_col (String), Required: Column holding player type labels
+        scatterx_col (String), Required: Column used as X-axis in scatterplot
+        scattery_col (String), Required: Column used as Y-axis in scatterplot
+        palette (String), Required: Color palette used in plots
+        clust_title (String), Required: Title for cluster visualization plot
+        clust_plot (String), Required: Path to save cluster visualization
+    Returns:
+        None
+    """
+    import seaborn as sns
+    fig, ax = _new_figure()
+    sns.scatterplot(data=df, hue=player_type_col, x=scatterx_col, y=scattery_col, palette=palette, ax=ax)
+    ax.set_title(clust_title)
+    ax.legend(loc=1)
+
+    if _save_figure(fig, clust_plot, 'clustering visualization'):
+        logger.info('Clustering visualizaion saved to %s',clust_plot)
+
+
+class PlotRenderer:
+    """Render the clustering plots from saved metrics and labels, in a background worker process by default so the
+    compute steps do not wait on matplotlib and seaborn"""
+
+    def __init__(self, SSEpath, silpath, scatterx_col, scattery_col, palette, clust_title, clust_plot, background=True):
+        """
+        Initialize the PlotRenderer class
+        Args:
+            SSEpath (String), Required: Filepath to save SSE plot
+            silpath (String), Required: Filepath to save Silhouette score plot
+            scatterx_col (String), Required: Column used as X-axis in scatterplot
+            scattery_col (String), Required: Column used as Y-axis in scatterplot
+            palette (String), Required: Color palette used in plots
+            clust_title (String), Required: Title for cluster visualization plot
+            clust_plot (String), Required: Path to save cluster visualization
+            background (bool), Optional: Render in a worker process. Plots are rendered before returning if False
+        Returns:
+            None
+        """
+        self.SSEpath = SSEpath
+        self.silpath = silpath
+        self.scatter = {'scatterx_col': scatterx_col, 'scattery_col': scattery_col, 'palette': palette,
+                        'clust_title': clust_title, 'clust_plot': clust_plot}
+        self._executor = ProcessPoolExecutor(max_workers=1) if background else None
+        self._futures = []
+
+    def _submit(self, func, *args, **kwargs):
+        """Render one plot in the worker process, or right away without one"""
+        if self._executor is None:
+            func(*args, **kwargs)
+        else:
+            self._futures.append(self._executor.submit(func, *args, **kwargs))
+
+    def plot_metrics(self, metrics):
+        """
+        Render the SSE and Silhouette score plots
+        Args:
+            metrics: (Pandas DataFrame), Required: Metrics of each number of clusters, from `optimal_clusternum`
+        Returns:
+            None
+        """
+        self._submit(generate_SSEplot, metrics, self.SSEpath)
+        self._submit(generate_silplot, metrics, self.silpath)
+
+    def plot_clusters(self, df, player_type_col):
+        """
+        Render the scatterplot of players colored by player type
+        Args:
+            df: (Pandas DataFrame), Required: Players with their player types
+            player_type_col (String), Required: Column holding player type labels
+        Returns:
+            None
+        """
+        # Only send the plotted columns to the worker process
+        columns = [self.scatter['scatterx_col'], self.scatter['scattery_col'], player_type_col]
+        self._submit(generate_clusterplot, df[columns], player_type_col, **self.scatter)
+
+    def close(self):
+        """
+        Wait for every plot to finish rendering and stop the worker process
+        Returns:
+            None
+        """
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception:
+                logger.exception('A plot could not be rendered.')
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -1,19 +1,33 @@
+import json
 import logging
+import math
+import struct
+import time
 
 import sqlalchemy as sql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, Integer, Float, String, MetaData
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Column, Integer, Float, String, Text, MetaData, Index
 
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# Columns the app sorts a player type by. Each gets a composite index with player_type, and player_id to break ties,
+# so a page is read in order from the index instead of scanning and sorting the table
+SORT_COLUMNS = ['points', 'ppm', 'rebounds', 'rpm', 'assists', 'apm', 'blocks', 'bpm', 'steals', 'spm', 'turnovers', 'tpm',
+				'fg_pct', 'fg_pct3']
+
+
+def sort_index_name(sort_col):
+	"""Get the name of the index serving a player type sorted by the given column"""
+	return 'ix_results_player_type_%s' % sort_col
+
 
 class Results(Base):
 	"""Create a data model for the database to capture player statistics"""
 	__tablename__ = 'results'
+	__table_args__ = tuple(Index(sort_index_name(col), 'player_type', col, 'player_id') for col in SORT_COLUMNS)
 	player_id = Column(String(100), primary_key=True)
 	player_name = Column(String(100), unique=False, nullable=False)
 	year = Column(String(100), unique=False, nullable=False)
@@ -52,6 +66,128 @@ class Results(Base):
 		return '<Results %r>' % self.title
 
 
+class DatasetVersion(Base):
+	"""Create a data model for the version stamp of each dataset, bumped whenever its table is written"""
+	__tablename__ = 'dataset_version'
+	name = Column(String(100), primary_key=True)
+	version = Column(Integer, unique=False, nullable=False)
+
+
+class Leaderboard(Base):
+	"""Create a data model for the top players of one player type by one sort column, precomputed at load time"""
+	__tablename__ = 'leaderboards'
+	player_type = Column(String(100), primary_key=True)
+	sort_col = Column(String(100), primary_key=True)
+	# JSON list of the players' Results rows, largest first. The length makes MySQL use MEDIUMTEXT
+	players = Column(Text(2**24), unique=False, nullable=False)
+
+
+def build_leaderboards(records, size=100):
+	"""
+    Get the top players of every player type by every sort column from the rows of the Results table
+    Args:
+        records: (list of dict), Required: Results rows of every player
+        size: (int), Optional: Number of players in each leaderboard
+    Returns:
+        leaderboards: (list of dict): Leaderboard rows with the player type, sort column and players as JSON
+    """
+	import pandas as pd
+	frame = pd.DataFrame(records, columns=[column.name for column in Results.__table__.columns])
+	leaderboards = []
+	for sort_col in SORT_COLUMNS:
+		# One sort per column covers every player type. Ties are ordered by player_id like the app's page query
+		top = frame.sort_values([sort_col, 'player_id'], ascending=False).groupby('player_type', sort=False).head(size)
+		for player_type, players in top.groupby('player_type', sort=False):
+			leaderboards.append({'player_type': player_type, 'sort_col': sort_col, 'players': _players_json(players)})
+	return leaderboards
+
+
+def _players_json(players):
+	"""Serialize the Results rows of one leaderboard, keeping the full precision of the statistics"""
+	return players.to_json(orient='records', double_precision=15)
+
+
+def read_leaderboard(session, player_type, sort_col):
+	"""
+    Get the precomputed top players of a player type by a sort column with one primary key lookup
+    Args:
+        session: (SQLAlchemy Session), Required: Database session
+        player_type: (String), Required: Player type to show
+        sort_col: (String), Required: Results column the players are sorted by
+    Returns:
+        players: (list of dict): Results rows of the top players, largest first, or None if no leaderboard was built
+    """
+	table = Leaderboard.__table__
+	players = session.execute(sql.select([table.c.players]).where(
+		sql.and_(table.c.player_type == player_type, table.c.sort_col == sort_col))).scalar()
+	return None if players is None else json.loads(players)
+
+
+def dataset_version(session, name='results'):
+	"""
+    Get the version stamp of a dataset
+    Args:
+        session: (SQLAlchemy Session), Required: Database session
+        name: (String), Optional: Dataset name
+    Returns:
+        version: (int): Version stamp, 0 if the dataset was never written
+    """
+	table = DatasetVersion.__table__
+	return session.execute(sql.select([table.c.version]).where(table.c.name == name)).scalar() or 0
+
+
+def bump_dataset_version(session, name='results'):
+	"""
+    Increase the version stamp of a dataset in the session's transaction, so the new stamp is visible exactly when
+    the written rows are
+    Args:
+        session: (SQLAlchemy Session), Required: Database session
+        name: (String), Optional: Dataset name
+    Returns:
+        None
+    """
+	table = DatasetVersion.__table__
+	updated = session.execute(table.update().where(table.c.name == name).values(version=table.c.version+1))
+	if updated.rowcount == 0:
+		session.execute(table.insert().values(name=name, version=1))
+
+
+# Cleaned data columns feeding each Results column, with the number of digits floats are rounded to (None keeps
+# them as is) or `int` for counts
+RESULTS_COLUMNS = [
+	('player_id', 'player_id', None), ('player_name', 'name', None), ('year', 'year', None), ('position', 'position', None),
+	('height', 'height', int), ('weight', 'weight', int), ('player_type', 'player_type', None), ('team', 'team', None),
+	('conference', 'conference', None), ('games', 'games_played', int), ('games_started', 'games_started', int),
+	('fg_pct', 'field_goal_percentage', 2), ('fg_pct3', 'three_point_percentage', 2), ('ft_pct', 'free_throw_percentage', 2),
+	('points', 'points', int), ('ppm', 'ppm', 2), ('assists', 'assists', int), ('apm', 'apm', 2), ('a_perc', 'assist_percentage', 2),
+	('rebounds', 'total_rebounds', int), ('rpm', 'rpm', 2), ('r_perc', 'total_rebound_percentage', 2), ('blocks', 'blocks', int),
+	('bpm', 'bpm', 2), ('b_perc', 'block_percentage', 2), ('steals', 'steals', int), ('spm', 'spm', 2),
+	('s_perc', 'steal_percentage', 2), ('turnovers', 'turnovers', int), ('tpm', 'tpm', 2), ('t_perc', 'turnover_percentage', 2),
+	('usage', 'usage_percentage', None), ('efficiency', 'player_efficiency_rating', None)]
+
+
+def results_records(df):
+	"""
+    Convert cleaned player data with player types into rows of the Results table, rounding and casting each column
+    once the same way `add_player` is called from `populate_db`
+    Args:
+        df: (Pandas DataFrame), Required: Cleaned player data with cluster labels
+    Returns:
+        records: (list of dict): One dictionary of Results column values per player
+    """
+	columns = {}
+	for result_col, df_col, cast in RESULTS_COLUMNS:
+		col = df[df_col]
+		if cast is int:
+			col = col.astype('int64')
+		elif cast is not None:
+			col = col.astype('float64').round(cast)
+		# tolist gives plain Python values that every database driver can bind
+		columns[result_col] = col.tolist()
+	names = list(columns)
+	return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
 def create_db(engine_string: str):
 	"""
     Create a database using SQLAlchemy on AWS RDS or locally with SQLite
@@ -76,18 +212,167 @@ def create_db(engine_string: str):
 		logger.warning('If you used environment variables and if they were not exported correctly, the default database location of sqlite:///data/results.db may have been used.')
 		logger.info('Database and results table created with provided or default engine string.')
 
+def migrate_db(engine_string: str):
+	"""
+    Add the tables and Results indexes that an existing database is missing, rebuilding indexes whose columns changed.
+    Databases made by `create_db` already have them, and running the migration again changes nothing
+    Args:
+        engine_string: (String), Required: RDS connection engine string
+    Returns:
+        created: (list of Strings): Names of the indexes created
+    """
+	engine = sql.create_engine(engine_string)
+	# Add tables that are new since the database was created, such as the dataset version table
+	Base.metadata.create_all(engine)
+	existing = {index['name']: index['column_names'] for index in sql.inspect(engine).get_indexes(Results.__tablename__)}
+	created = []
+	for index in sorted(Results.__table__.indexes, key=lambda index: index.name):
+		columns = [column.name for column in index.columns]
+		if existing.get(index.name) != columns:
+			# Indexes from older versions of the table are rebuilt with the current columns
+			if index.name in existing:
+				index.drop(engine)
+			index.create(engine)
+			created.append(index.name)
+			logger.info('Created index %s.', index.name)
+	logger.info('%i missing Results indexes created.', len(created))
+	return created
+
+
+def page_query(session, player_type, sort_col, limit, after=None):
+	"""
+    Build the query the app runs for one page: players of one type sorted by a statistic, largest first. Pages after
+    the first seek past the last player of the previous page in the composite index, so every page costs the same
+    however deep it is
+    Args:
+        session: (SQLAlchemy Session), Required: Database session
+        player_type: (String), Required: Player type to show
+        sort_col: (String), Required: Results column to sort by
+        limit: (int), Required: Maximum number of players shown
+        after: (tuple), Optional: Sort column value and player_id of the last player of the previous page
+    Returns:
+        query: (SQLAlchemy Query): Query returning Results rows
+    """
+	column = Results.__table__.c[sort_col]
+	query = session.query(Results).filter(Results.player_type == player_type)
+	if after is not None:
+		value, player_id = after
+		value = _column_value(session, column, value)
+		# The first condition is a range seek on the index, the second skips the players tied with the cursor already shown
+		query = query.filter(column <= value, sql.or_(column < value, Results.player_id < player_id))
+	return query.order_by(column.desc(), Results.player_id.desc()).limit(limit)
+
+
+def _column_value(session, column, value):
+	"""Convert a cursor value to the column's type. MySQL stores Float columns in single precision, so the value is
+	rounded the same way for players tied with the cursor to compare as equal"""
+	value = column.type.python_type(value)
+	if isinstance(value, float) and session.get_bind().dialect.name == 'mysql' and column.type.precision is None:
+		value = struct.unpack('f', struct.pack('f', value))[0]
+	return value
+
+
+def explain_page_query(engine, player_type, sort_col, limit=100, after=None):
+	"""
+    Check with EXPLAIN that a page query is read from its composite index without sorting the table
+    Args:
+        engine: (SQLAlchemy Engine), Required: Engine of a SQLite or MySQL database
+        player_type: (String), Required: Player type to show
+        sort_col: (String), Required: Results column to sort by
+        limit: (int), Optional: Maximum number of players shown
+        after: (tuple), Optional: Sort column value and player_id of the last player of the previous page
+    Returns:
+        uses_index: (bool): True if the query is served from the index of the sort column
+        plan: (list of Strings): Query plan reported by the database
+    """
+	session = sessionmaker(bind=engine)()
+	try:
+		statement = page_query(session, player_type, sort_col, limit, after).statement
+	finally:
+		session.close()
+	query = str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+	index = sort_index_name(sort_col)
+
+	with engine.connect() as conn:
+		if engine.dialect.name == 'sqlite':
+			plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + query)]
+			uses_index = (any(step.startswith('SEARCH') and index in step for step in plan)
+						  and not any('TEMP B-TREE' in step for step in plan))
+		elif engine.dialect.name == 'mysql':
+			rows = [dict(row.items()) for row in conn.execute('EXPLAIN ' + query)]
+			plan = ['key=%s extra=%s' % (row.get('key'), row.get('Extra')) for row in rows]
+			uses_index = any(row.get('key') == index and 'filesort' not in (row.get('Extra') or '') for row in rows)
+		else:
+			raise ValueError('EXPLAIN checks are only supported on SQLite and MySQL, not %s' % engine.dialect.name)
+	return uses_index, plan
+
+
+def check_indexes(engine_string, player_type='Shooting Big', limit=100):
+	"""
+    Confirm with EXPLAIN that the app's first and later pages for every sort column are served from an index, logging
+    the plan of any query that is not
+    Args:
+        engine_string: (String), Required: RDS connection engine string
+        player_type: (String), Optional: Player type used in the checked queries
+        limit: (int), Optional: Maximum number of players shown on a page
+    Returns:
+        unindexed: (list of Strings): Sort columns whose query is not served from an index
+    """
+	engine = sql.create_engine(engine_string)
+	unindexed = []
+	for sort_col in SORT_COLUMNS:
+		# Check the first page and a page seeking past a cursor
+		for after in (None, (0, '')):
+			uses_index, plan = explain_page_query(engine, player_type, sort_col, limit, after)
+			if not uses_index:
+				unindexed.append(sort_col)
+				logger.warning('Query sorted by %s is not served from an index: %s', sort_col, '; '.join(plan))
+				break
+	logger.info('%i of %i sort columns are served from an index.', len(SORT_COLUMNS)-len(unindexed), len(SORT_COLUMNS))
+	return unindexed
+
+
+def pool_stats(pool):
+	"""
+    Get the counters of a connection pool
+    Args:
+        pool: (SQLAlchemy Pool), Required: Connection pool of an engine
+    Returns:
+        stats: (dict): Pool class and, for pools that keep connections, their size, idle, in use and overflow counts
+    """
+	stats = {'class': type(pool).__name__}
+	# Only queue pools (used for MySQL) count their connections. Other pools may have attributes of the same names that
+	# are not counters, such as the size setting of SingletonThreadPool
+	for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+		counter = getattr(pool, name, None)
+		if callable(counter):
+			stats[name] = counter()
+	return stats
+
+
 class ResultsManager:
 
-	def __init__(self, app=None, engine_string=None):
+	def __init__(self, app=None, engine_string=None, leaderboard_size=None):
 		"""
 		Initialize ResultsManager class in order to modify the Results table
 		Args:
     		app: Flask - Flask app
 			engine_string: str - Engine string
+			leaderboard_size: int - Number of players in each leaderboard rebuilt when the Results table is written. Defaults
+				to one more than the app's MAX_ROWS_SHOW, as the extra player tells the app the first page has a next page
 		Returns: None
 		"""
+		if leaderboard_size is None:
+			if app:
+				page_size = app.config['MAX_ROWS_SHOW']
+			else:
+				from config.flaskconfig import MAX_ROWS_SHOW as page_size
+			leaderboard_size = page_size+1
+		self.leaderboard_size = leaderboard_size
 		# If an app is input, create a database session from the app
 		if app:
+			# Only the app needs Flask-SQLAlchemy, so command line jobs skip importing it
+			from flask_sqlalchemy import SQLAlchemy
 			try:
 				self.db = SQLAlchemy(app)
 				self.session = self.db.session
@@ -100,6 +385,9 @@ class ResultsManager:
 		elif engine_string:
 			try:
 				engine = sql.create_engine(engine_string)
+				# Add tables newer than the database, such as the leaderboards the writes below rebuild. Run migrate_db
+				# to add the newer Results indexes as well
+				Base.metadata.create_all(engine)
 				Session = sessionmaker(bind=engine)
 				self.session = Session()
 			# Catch all exceptions when connecting to the database
@@ -113,6 +401,36 @@ class ResultsManager:
 			raise ValueError('Need either an engine string or a Flask app to initialize')
 
 
+	def health(self):
+		"""Check the database answers and report the state of the connection pool
+		Returns:
+			health (dict): Whether the database answered and the connection pool counters
+		"""
+		try:
+			self.session.execute(sql.select([sql.literal(1)])).scalar()
+			database = True
+		except sql.exc.SQLAlchemyError:
+			logger.exception('Database health check failed.')
+			self.session.rollback()
+			database = False
+		return {'database': database, 'pool': pool_stats(self.session.get_bind().pool)}
+
+
+	def dispose(self):
+		"""Close every pooled connection, such as those a server process opened before forking its workers
+		Returns: None
+		"""
+		self.session.get_bind().dispose()
+
+
+	def dataset_version(self):
+		"""Get the version stamp of the Results table, bumped by every load, sync and update
+		Returns:
+			version (int): Version stamp, 0 if the table was never written
+		"""
+		return dataset_version(self.session)
+
+
 	def close(self) -> None:
 		"""Closes session
 		Returns: None
@@ -179,3 +497,178 @@ class ResultsManager:
 
 		# Commit changes to database
 		session.commit()
+
+
+	def _write_leaderboards(self, records=None):
+		"""Rebuild every leaderboard in the session's transaction from the given Results rows, or from the table"""
+		session = self.session
+		if records is None:
+			table = Results.__table__
+			names = [column.name for column in table.columns]
+			records = [dict(zip(names, row)) for row in session.execute(sql.select([table.c[name] for name in names]))]
+		leaderboards = build_leaderboards(records, self.leaderboard_size)
+		session.execute(Leaderboard.__table__.delete())
+		if leaderboards:
+			session.execute(Leaderboard.__table__.insert(), leaderboards)
+
+
+	def _refresh_leaderboards(self, player_types):
+		"""Rebuild the leaderboards of the given player types in the session's transaction. Each one is read with the
+		app's page query from the index of its sort column, so the cost does not grow with the size of the table"""
+		import pandas as pd
+		session = self.session
+		table = Leaderboard.__table__
+		names = [column.name for column in Results.__table__.columns]
+		for player_type in player_types:
+			leaderboards = []
+			for sort_col in SORT_COLUMNS:
+				rows = session.execute(page_query(session, player_type, sort_col, self.leaderboard_size).statement).fetchall()
+				if rows:
+					players = pd.DataFrame([list(row) for row in rows], columns=names)
+					leaderboards.append({'player_type': player_type, 'sort_col': sort_col, 'players': _players_json(players)})
+			# A player type whose last player moved to another type keeps no leaderboards
+			session.execute(table.delete().where(table.c.player_type == player_type))
+			if leaderboards:
+				session.execute(table.insert(), leaderboards)
+
+
+	def update_players(self, df):
+		"""Insert or update the rows of the given players only, leaving every other player untouched, and rebuild the
+		leaderboards of the player types they left or joined
+		Args:
+			df (Pandas DataFrame): Cleaned player data with player types for the players to write
+		Returns:
+			num_rows (int): Number of players written
+		"""
+		session = self.session
+		try:
+			player_types = set()
+			for record in results_records(df):
+				# Look the player up by primary key so the merge below updates the row if it exists
+				player = session.query(Results).get(record['player_id'])
+				if player is not None:
+					player_types.add(player.player_type)
+				player_types.add(record['player_type'])
+				session.merge(Results(**record))
+			session.flush()
+			self._refresh_leaderboards(sorted(player_types))
+			bump_dataset_version(session)
+			session.commit()
+		except sql.exc.SQLAlchemyError:
+			session.rollback()
+			logger.error('Players could not be written to the database. No rows were changed.')
+			raise
+		return len(df)
+
+
+	def bulk_load(self, df, batch_size=1000):
+		"""Insert many players and rebuild the leaderboards in one transaction, sending players in batches of multi-row inserts
+		Args:
+			df (Pandas DataFrame): Cleaned player data with player types
+			batch_size (int): Number of players sent to the database in each insert
+		Returns:
+			num_rows (int): Number of players inserted
+		"""
+		session = self.session
+		start = time.perf_counter()
+		records = results_records(df)
+		try:
+			table_empty = session.execute(sql.select([sql.func.count()]).select_from(Results.__table__)).scalar() == 0
+			for i in range(0, len(records), batch_size):
+				# A list of rows runs as one executemany, which the database driver sends as multi-row inserts
+				session.execute(Results.__table__.insert(), records[i:i+batch_size])
+			# Loading into an empty table, the loaded players are the whole table
+			self._write_leaderboards(records if table_empty else None)
+			bump_dataset_version(session)
+			session.commit()
+		except sql.exc.SQLAlchemyError:
+			session.rollback()
+			logger.error('Players could not be loaded into the database. No rows were inserted.')
+			raise
+		elapsed = time.perf_counter()-start
+		logger.info('%i players loaded in %.2f seconds (%.0f rows per second).', len(records), elapsed, len(records)/elapsed if elapsed else 0)
+		return len(records)
+
+
+	def sync(self, df, batch_size=1000):
+		"""Make the Results table match the given players, writing only the rows that changed. New and changed players
+		are upserted with the database's native upsert, players no longer present are deleted and the leaderboards are
+		rebuilt, all in one transaction so readers see either the old table or the new one
+		Args:
+			df (Pandas DataFrame): Cleaned player data with player types for every player the table should hold
+			batch_size (int): Number of players sent to the database in each statement
+		Returns:
+			counts (dict): Number of players inserted, updated, deleted and left unchanged
+		"""
+		session = self.session
+		table = Results.__table__
+		start = time.perf_counter()
+		records = {record['player_id']: record for record in results_records(df)}
+		names = [column.name for column in table.columns]
+
+		try:
+			# Diff the new rows against the current table inside the transaction that writes the changes
+			current = {row[0]: dict(zip(names, row)) for row in session.execute(sql.select([table.c[name] for name in names]))}
+			inserts = [record for player_id, record in records.items() if player_id not in current]
+			updates = [record for player_id, record in records.items()
+					   if player_id in current and not _same_row(record, current[player_id])]
+			deletes = [player_id for player_id in current if player_id not in records]
+
+			self._upsert(inserts, updates, batch_size)
+			for i in range(0, len(deletes), batch_size):
+				session.execute(table.delete().where(table.c.player_id.in_(deletes[i:i+batch_size])))
+			# Keep the leaderboards and cached pages of the app when nothing changed
+			if inserts or updates or deletes:
+				self._write_leaderboards(list(records.values()))
+				bump_dataset_version(session)
+			session.commit()
+		except sql.exc.SQLAlchemyError:
+			session.rollback()
+			logger.error('Players could not be synced to the database. No rows were changed.')
+			raise
+
+		counts = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletes),
+				  'unchanged': len(records)-len(inserts)-len(updates)}
+		logger.info('Results table synced in %.2f seconds: %i inserted, %i updated, %i deleted, %i unchanged.',
+					time.perf_counter()-start, counts['inserted'], counts['updated'], counts['deleted'], counts['unchanged'])
+		return counts
+
+
+	def _upsert(self, inserts, updates, batch_size):
+		"""Write new and changed players with the dialect's native upsert, or separate inserts and updates elsewhere"""
+		session = self.session
+		table = Results.__table__
+		dialect = session.get_bind().dialect.name
+		if dialect == 'mysql':
+			from sqlalchemy.dialects.mysql import insert
+			statement = insert(table)
+			statement = statement.on_duplicate_key_update({column.name: statement.inserted[column.name]
+														   for column in table.columns if not column.primary_key})
+			batches = [inserts+updates]
+		elif dialect == 'sqlite':
+			statement = table.insert().prefix_with('OR REPLACE')
+			batches = [inserts+updates]
+		else:
+			statement = table.update().where(table.c.player_id == sql.bindparam('key')).values(
+				{column.name: sql.bindparam(column.name) for column in table.columns if not column.primary_key})
+			updates = [dict(record, key=record['player_id']) for record in updates]
+			for i in range(0, len(updates), batch_size):
+				session.execute(statement, updates[i:i+batch_size])
+			statement = table.insert()
+			batches = [inserts]
+
+		for rows in batches:
+			for i in range(0, len(rows), batch_size):
+				session.execute(statement, rows[i:i+batch_size])
+
+
+def _same_row(record, row):
+	"""Check if a new Results row matches the stored one, allowing for the precision floats are stored with"""
+	for name, value in record.items():
+		stored = row[name]
+		if isinstance(value, float) and isinstance(stored, float):
+			if not math.isclose(value, stored, rel_tol=1e-6, abs_tol=1e-9):
+				return False
+		elif value != stored:
+			return False
+	return True
@@ -0,0 +1,119 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Declared kind of every column in the player table, from the raw API download through the cluster labels.
+# `category` columns are low-cardinality strings, `integer` columns are counts and `float` columns are rates.
+# Integers are downcast to the smallest type holding their values and floats only when float32 keeps them exact.
+PLAYER_SCHEMA = {
+    'player_id': 'string',
+    'name': 'string',
+    'season': 'category',
+    'conference': 'category',
+    'position': 'category',
+    'team_abbreviation': 'category',
+    'year': 'category',
+    'team': 'category',
+    'player_type': 'category',
+    'assists': 'integer',
+    'blocks': 'integer',
+    'defensive_rebounds': 'integer',
+    'field_goal_attempts': 'integer',
+    'field_goals': 'integer',
+    'free_throw_attempts': 'integer',
+    'free_throws': 'integer',
+    'games_played': 'integer',
+    'games_started': 'integer',
+    'height': 'integer',
+    'minutes_played': 'integer',
+    'offensive_rebounds': 'integer',
+    'personal_fouls': 'integer',
+    'points': 'integer',
+    'points_produced': 'integer',
+    'steals': 'integer',
+    'three_point_attempts': 'integer',
+    'three_pointers': 'integer',
+    'total_rebounds': 'integer',
+    'turnovers': 'integer',
+    'two_point_attempts': 'integer',
+    'two_pointers': 'integer',
+    'weight': 'integer',
+    'assist_percentage': 'float',
+    'block_percentage': 'float',
+    'box_plus_minus': 'float',
+    'defensive_box_plus_minus': 'float',
+    'defensive_rebound_percentage': 'float',
+    'defensive_win_shares': 'float',
+    'effective_field_goal_percentage': 'float',
+    'field_goal_percentage': 'float',
+    'free_throw_attempt_rate': 'float',
+    'free_throw_percentage': 'float',
+    'offensive_box_plus_minus': 'float',
+    'offensive_rebound_percentage': 'float',
+    'offensive_win_shares': 'float',
+    'player_efficiency_rating': 'float',
+    'steal_percentage': 'float',
+    'three_point_attempt_rate': 'float',
+    'three_point_percentage': 'float',
+    'total_rebound_percentage': 'float',
+    'true_shooting_percentage': 'float',
+    'turnover_percentage': 'float',
+    'two_point_percentage': 'float',
+    'usage_percentage': 'float',
+    'win_shares': 'float',
+    'win_shares_per_40_minutes': 'float',
+    'ppm': 'float',
+    'apm': 'float',
+    'rpm': 'float',
+    'bpm': 'float',
+    'spm': 'float',
+    'tpm': 'float',
+}
+
+
+def _downcast_float(col):
+    """Use float32 if every value survives the round trip unchanged, otherwise keep the column as is"""
+    col32 = col.astype(np.float32)
+    if ((col32.astype(np.float64) == col) | col.isna()).all():
+        return col32
+    return col
+
+
+def _downcast_integer(col):
+    """Use the smallest integer type for counts. Counts with missing values stay floating point"""
+    if not pd.api.types.is_numeric_dtype(col) or not (col.dropna() % 1 == 0).all():
+        return col
+    if col.isna().any():
+        return _downcast_float(col.astype(np.float64))
+    return pd.to_numeric(col.astype(np.int64), downcast='integer')
+
+
+def apply_schema(df, stage, schema=None):
+    """
+    Cast the columns of a player DataFrame to the compact types declared in the schema and log the memory saved
+    Args:
+        df: (Pandas DataFrame), Required: Player data from any stage of the pipeline
+        stage: (String), Required: Name of the stage the data was loaded for, used in the memory report
+        schema: (dict), Optional: Column name to kind (`category`, `integer`, `float` or `string`). Defaults to PLAYER_SCHEMA
+    Returns:
+        df: (Pandas DataFrame): Data with compact column types. Columns missing from the schema are left alone
+    """
+    schema = PLAYER_SCHEMA if schema is None else schema
+    before = df.memory_usage(deep=True).sum()
+
+    for column in df.columns:
+        kind = schema.get(column)
+        if kind == 'category':
+            df[column] = df[column].astype('category')
+        elif kind == 'integer':
+            df[column] = _downcast_integer(df[column])
+        elif kind == 'float' and pd.api.types.is_float_dtype(df[column]):
+            df[column] = _downcast_float(df[column])
+
+    after = df.memory_usage(deep=True).sum()
+    logger.info('Schema applied to %s data: %.2f MB -> %.2f MB (%.0f%% saved).', stage, before/1e6, after/1e6,
+                100*(1-after/before) if before else 0)
+    return df
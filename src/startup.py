@@ -0,0 +1,67 @@
+import logging
+import re
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Line written by `python -X importtime`: self and cumulative microseconds, then the module indented by nesting depth
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def parse_importtime(lines):
+    """
+    Read the import timings written by `python -X importtime`
+    Args:
+        lines: (list of Strings), Required: Lines of standard error from the profiled process
+    Returns:
+        imports: (list of tuples): Module, nesting depth and cumulative seconds of each import, in import order
+        other: (list of Strings): Lines that are not import timings
+    """
+    imports, other = [], []
+    for line in lines:
+        match = IMPORT_LINE.match(line.rstrip('\n'))
+        if match:
+            imports.append((match.group(4), len(match.group(3))//2, int(match.group(2))/1e6))
+        elif not line.startswith('import time: self'):
+            other.append(line)
+    return imports, other
+
+
+def startup_report(imports, top=15):
+    """
+    Summarize import timings by top level module
+    Args:
+        imports: (list of tuples), Required: Module, nesting depth and cumulative seconds from `parse_importtime`
+        top: (int), Optional: Number of slowest modules to list
+    Returns:
+        report: (String): Total import time and the slowest top level imports
+    """
+    # Nested imports are already counted in the cumulative time of the import that triggered them
+    first_level = [(module, seconds) for module, depth, seconds in imports if depth == 0]
+    total = sum(seconds for _, seconds in first_level)
+    lines = ['Startup import time: %.3fs across %i modules' % (total, len(imports))]
+    for module, seconds in sorted(first_level, key=lambda item: -item[1])[:top]:
+        lines.append('  %8.3fs  %s' % (seconds, module))
+    return '\n'.join(lines)
+
+
+def profile_startup(argv, top=15):
+    """
+    Run a run.py command in a child process with import timing on, passing its output through and logging a report
+    of the time spent importing each top level module
+    Args:
+        argv: (list of Strings), Required: Command line of the command to profile, starting with the script path
+        top: (int), Optional: Number of slowest modules to list
+    Returns:
+        returncode: (int): Exit code of the command
+    """
+    start = time.perf_counter()
+    child = subprocess.run([sys.executable, '-X', 'importtime'] + argv, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter()-start
+
+    imports, other = parse_importtime(child.stderr.splitlines(True))
+    sys.stderr.write(''.join(other))
+    logger.info('%s\nCommand finished in %.3fs.', startup_report(imports, top), elapsed)
+    return child.returncode
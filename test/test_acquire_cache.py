@@ -0,0 +1,42 @@
+import pytest
+import pandas as pd
+
+from src.acquire_cache import AcquireCache, CachedPlayer
+
+def test_acquire_cache_roundtrip(tmp_path):
+    # Define a cached player and roster
+    player_df = pd.DataFrame({'points': [83, 400]}, index=[['2019-20', '2020-21']])
+    player_in = CachedPlayer('James Wiseman', player_df)
+
+    cache = AcquireCache(str(tmp_path), 2021, ttl_hours=24)
+    cache.put_teams(['memphis'])
+    cache.put_roster('memphis', ['james-wiseman-1'])
+    cache.put_player('james-wiseman-1', player_in)
+    cache.mark_completed('memphis')
+
+    # Reopen the cache as a new run would
+    cache_test = AcquireCache(str(tmp_path), 2021, ttl_hours=24)
+    player_test = cache_test.get_player('james-wiseman-1', 'memphis')
+
+    # Test that the cached payloads and manifest are the same
+    assert cache_test.get_teams() == ['memphis']
+    assert cache_test.get_roster('memphis') == ['james-wiseman-1']
+    assert cache_test.completed == {'memphis'}
+    assert player_test.name == 'James Wiseman'
+    pd.testing.assert_frame_equal(player_test.dataframe, player_df)
+
+def test_acquire_cache_refresh(tmp_path):
+    # Define a cache holding one roster
+    cache = AcquireCache(str(tmp_path), 2021)
+    cache.put_roster('memphis', ['james-wiseman-1'])
+    cache.mark_completed('memphis')
+
+    # Refreshing clears the cache and the manifest
+    cache_test = AcquireCache(str(tmp_path), 2021, refresh=True)
+    assert cache_test.get_roster('memphis') is None
+    assert cache_test.completed == set()
+
+def test_acquire_cache_resume_and_refresh(tmp_path):
+    # Verify ValueError arises when both modes are requested
+    with pytest.raises(ValueError):
+        AcquireCache(str(tmp_path), 2021, resume=True, refresh=True)
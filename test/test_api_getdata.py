@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import requests
+
+from src.api_getdata import convert_height, upload_batches
+
+def test_convert_height():
+    # Define input batches, one with a missing height and one where no height is known
+    df_in = pd.DataFrame({'height': ['6-5', np.nan, '7-0']})
+    df_in_missing = pd.DataFrame({'height': [np.nan, np.nan]})
+
+    # Test that heights are converted to inches and missing heights become 0 in both batches
+    assert list(convert_height(df_in)['height']) == [77, 0, 84]
+    assert list(convert_height(df_in_missing)['height']) == [0, 0]
+
+def test_upload_batches_keeps_file_on_error(tmp_path):
+    path = tmp_path / 'sports_ref.csv'
+    path.write_text('player_id\nold-data\n')
+
+    def batches():
+        yield pd.DataFrame({'player_id': ['james-wiseman']})
+        raise requests.exceptions.ConnectionError()
+
+    # Run test by failing after the first batch was written
+    num_rows = upload_batches(batches(), str(path))
+
+    # Test that the existing data is kept and no temporary file is left behind
+    assert num_rows == 0
+    assert path.read_text() == 'player_id\nold-data\n'
+    assert [p.name for p in tmp_path.iterdir()] == ['sports_ref.csv']
+
+    # A run that finishes replaces the data
+    assert upload_batches([pd.DataFrame({'player_id': ['james-wiseman']})], str(path)) == 1
+    assert path.read_text() == 'player_id\njames-wiseman\n'
@@ -0,0 +1,43 @@
+import importlib
+
+import pytest
+
+def test_api_players_bad_cursor(tmp_path, monkeypatch):
+    # Serve the app from an empty SQLite database, which a malformed cursor must never reach
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///%s' % (tmp_path / 'results.db'))
+    app = importlib.import_module('app')
+
+    # Run test by requesting a page after a cursor that is not a number
+    with app.app.test_request_context('/api/players/Guard/ppm?after=abc&after_id=james-wiseman'):
+        response, status = app.api_players('Guard', 'ppm')
+
+    # Test that the client gets a 400 with a JSON error instead of a server error
+    assert status == 400
+    assert response.get_json() == {'error': 'Invalid page cursor for ppm: abc'}
+
+    # Test that a well formed cursor is converted to the sort column's type
+    with app.app.test_request_context('/api/players/Guard/points?after=12&after_id=james-wiseman'):
+        assert app.page_cursor('points') == (12, 'james-wiseman')
+
+def test_first_page_next_link(tmp_path, monkeypatch):
+    monkeypatch.setenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///%s' % (tmp_path / 'results.db'))
+    app = importlib.import_module('app')
+    from src.results_db import ResultsManager, create_db
+    from test_results_db import player_rows
+
+    # Load one player more than a page with the default leaderboard size, as populate_db does
+    page_size = app.app.config['MAX_ROWS_SHOW']
+    engine_string = app.app.config['SQLALCHEMY_DATABASE_URI']
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+    rm.bulk_load(player_rows(['player-%03i' % i for i in range(page_size+1)]))
+    rm.close()
+
+    # Run test by reading the first page from its leaderboard
+    with app.app.test_request_context('/index/Shooting Big/ppm'):
+        stats, next_after = app.page_stats('Shooting Big', 'ppm')
+
+    # Test that the page is full and links to the page holding the last player
+    assert app.results_manager.leaderboard_size == page_size+1
+    assert len(stats) == page_size
+    assert next_after == (stats[-1]['ppm'], 'player-001')
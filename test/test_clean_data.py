@@ -2,7 +2,7 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.clean_featurize import clean_data
+from src.clean_featurize import clean_data, clean_data_streaming
 
 def test_clean_data():
     # Define input DataFrame
@@ -72,3 +72,48 @@ def test_clean_data_col_missing():
     # Verify ValueError arises
     with pytest.raises(ValueError):
         clean_data(df_in,season_in,season_col_in,year_col_in,max_years_in,year_mapping_in,min_minutes_in,team_col_in,na_fill_val_in,drop_columns_in)
+
+def test_clean_data_streaming(tmp_path):
+    # Define input data saved to a local path
+    df_in_values = [['james-wiseman','2019-20','memphis',60,83,40,10,2,4,np.nan,2],['james-wiseman','2020-21','memphis',400,83,400,100,20,40,np.nan,20],
+                    ['evan-mobley','2020-21','southern-cal',440,84,220,200,40,80,2,22],['nick-nigro','2020-21','new-hampshire',0,72,0,0,0,0,0,1000],
+                    ['larry-bird','1967-68','indiana-state',754,77,47,43,23,65,5,23]]
+    df_in_columns = ['player_id','season','team_abbreviation','minutes_played','height','points','total_rebounds','assists','blocks','steals','turnovers']
+    df_in = pd.DataFrame(df_in_values, columns=df_in_columns)
+    path_in = str(tmp_path / 'sports_ref.csv')
+    df_in.to_csv(path_in, index=False)
+
+    # Define other test inputs
+    args_in = ['2020-21','season','year',4,{1:'Freshman',2:'Sophomore',3:'Junior'},100,'team',0,['team_abbreviation']]
+
+    # Define true DataFrame from the in-memory cleaning function
+    df_true = clean_data(df_in,*args_in)
+
+    # Run test by calling function with chunks smaller than the input
+    df_test = clean_data_streaming(path_in,*args_in,chunksize=2)
+
+    # Test that true and test hold the same values
+    pd.testing.assert_frame_equal(df_test,df_true,check_dtype=False,check_categorical=False)
+
+def test_clean_data_past_season(tmp_path):
+    # Define input data where players kept playing after the season being cleaned
+    df_in_values = [['james-wiseman','2019-20','memphis',400,83,400,100,20,40,np.nan,20],['james-wiseman','2020-21','memphis',400,83,400,100,20,40,np.nan,20],
+                    ['james-wiseman','Career','memphis',800,83,800,200,40,80,np.nan,40],['evan-mobley','2018-19','southern-cal',440,84,220,200,40,80,2,22],
+                    ['evan-mobley','2019-20','southern-cal',440,84,220,200,40,80,2,22],['evan-mobley','2020-21','southern-cal',440,84,220,200,40,80,2,22],
+                    ['evan-mobley','Career','southern-cal',1320,84,660,600,120,240,6,66]]
+    df_in_columns = ['player_id','season','team_abbreviation','minutes_played','height','points','total_rebounds','assists','blocks','steals','turnovers']
+    df_in = pd.DataFrame(df_in_values, columns=df_in_columns)
+    path_in = str(tmp_path / 'sports_ref.csv')
+    df_in.to_csv(path_in, index=False)
+
+    # Define other test inputs
+    args_in = ['2019-20','season','year',4,{1:'Freshman',2:'Sophomore',3:'Junior'},100,'team',0,['team_abbreviation']]
+
+    # Run test by calling both cleaning functions
+    df_test = clean_data(df_in,*args_in)
+    df_stream = clean_data_streaming(path_in,*args_in,chunksize=2)
+
+    # Test that only seasons up to 2019-20 and the career row are counted, keeping Mobley who would be filtered out today
+    assert df_test['player_id'].tolist() == ['james-wiseman','evan-mobley']
+    assert df_test['year'].tolist() == ['Sophomore','Junior']
+    pd.testing.assert_frame_equal(df_stream,df_test,check_dtype=False,check_categorical=False)
@@ -0,0 +1,22 @@
+import pytest
+import pandas as pd
+
+from src.data_io import read_table, write_table
+
+@pytest.mark.parametrize('suffix', ['.csv', '.parquet', '.feather'])
+def test_read_table_projection(tmp_path, suffix):
+    # Define input DataFrame
+    df_in = pd.DataFrame([['james-wiseman','2020-21',400,'memphis'],['evan-mobley','2020-21',440,'southern-cal'],
+                          ['larry-bird','1978-79',1369,'indiana-state']],
+                         columns=['player_id','season','minutes_played','team_abbreviation'])
+    path = str(tmp_path / ('sports_ref' + suffix))
+    write_table(df_in, path)
+
+    # Define true DataFrame with only the selected columns and matching rows
+    df_true = pd.DataFrame([['james-wiseman',400],['evan-mobley',440]], columns=['player_id','minutes_played'])
+
+    # Run test by calling function
+    df_test = read_table(path, columns=lambda column: column in ('player_id','minutes_played'), filters=[('minutes_played','<',1000)])
+
+    # Test that true and test are the same
+    pd.testing.assert_frame_equal(df_test,df_true)
@@ -0,0 +1,33 @@
+import gzip
+import json
+
+import pytest
+
+from src.json_api import gzip_body, parse_columns, players_json, strong_etag
+
+def test_parse_columns():
+    allowed = ['player_id', 'player_name', 'ppm']
+
+    # Test that no projection returns every column and a projection keeps the requested order
+    assert parse_columns(None, allowed) == allowed
+    assert parse_columns('ppm, player_name', allowed) == ['ppm', 'player_name']
+    with pytest.raises(ValueError):
+        parse_columns('ppm,salary', allowed)
+
+def test_players_json_and_gzip():
+    stats = [{'player_id': 'a', 'player_name': 'Player A', 'ppm': .51}]
+
+    # Run test by serializing one column and compressing the body twice
+    body = players_json(stats, ['ppm'], next=None)
+    compressed = gzip_body(body)
+
+    # Test that only the requested column is serialized and compression is repeatable for a strong ETag
+    assert json.loads(body) == {'next': None, 'players': [{'ppm': .51}]}
+    assert gzip.decompress(compressed) == body
+    assert gzip_body(body) == compressed
+
+def test_strong_etag():
+    # Test that the tag changes with the dataset version and the encoding only
+    assert strong_etag(1, '/api/players/a/ppm?', True) == strong_etag(1, '/api/players/a/ppm?', True)
+    assert strong_etag(2, '/api/players/a/ppm?', True) != strong_etag(1, '/api/players/a/ppm?', True)
+    assert strong_etag(1, '/api/players/a/ppm?', False) != strong_etag(1, '/api/players/a/ppm?', True)
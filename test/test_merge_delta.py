@@ -0,0 +1,46 @@
+import pandas as pd
+import numpy as np
+
+from src.api_getdata import merge_delta
+
+def test_merge_delta():
+    # Define existing raw data and a newly fetched delta
+    df_in_columns = ['season','player_id','points','three_point_percentage']
+    df_in = pd.DataFrame([['2019-20','james-wiseman',50,np.nan],['2020-21','james-wiseman',83,np.nan],['2020-21','evan-mobley',400,.3]],
+                         columns=df_in_columns)
+    delta_in = pd.DataFrame([['2019-20','james-wiseman',0,np.nan],['2020-21','james-wiseman',90,np.nan],['2020-21','evan-mobley',400,.3],
+                             ['2020-21','cade-cunningham',500,.4]], columns=df_in_columns)
+
+    # Define true outputs. Past seasons of known players are left alone and unchanged rows are not logged
+    df_true = pd.DataFrame([['2019-20','james-wiseman',50,np.nan],['2020-21','james-wiseman',90,np.nan],['2020-21','evan-mobley',400,.3],
+                            ['2020-21','cade-cunningham',500,.4]], columns=df_in_columns)
+    changes_true = pd.DataFrame([['james-wiseman','2020-21','updated'],['cade-cunningham','2020-21','added']],
+                                columns=['player_id','season','change'])
+
+    # Run test by calling function
+    df_test, changes_test = merge_delta(df_in,delta_in,'2020-21','season')
+
+    # Test that true and test are the same
+    pd.testing.assert_frame_equal(df_test,df_true)
+    pd.testing.assert_frame_equal(changes_test,changes_true)
+
+def test_merge_delta_career():
+    # Define existing raw data and a delta where a known player's current season and career totals changed
+    df_in_columns = ['season','player_id','points','three_point_percentage']
+    df_in = pd.DataFrame([['2019-20','james-wiseman',50,np.nan],['2020-21','james-wiseman',83,np.nan],['Career','james-wiseman',133,np.nan]],
+                         columns=df_in_columns)
+    delta_in = pd.DataFrame([['2019-20','james-wiseman',0,np.nan],['2020-21','james-wiseman',90,np.nan],['Career','james-wiseman',140,np.nan]],
+                            columns=df_in_columns)
+
+    # Define true outputs. The career row follows the current season while past seasons are left alone
+    df_true = pd.DataFrame([['2019-20','james-wiseman',50,np.nan],['2020-21','james-wiseman',90,np.nan],['Career','james-wiseman',140,np.nan]],
+                           columns=df_in_columns)
+    changes_true = pd.DataFrame([['james-wiseman','2020-21','updated'],['james-wiseman','Career','updated']],
+                                columns=['player_id','season','change'])
+
+    # Run test by calling function
+    df_test, changes_test = merge_delta(df_in,delta_in,'2020-21','season')
+
+    # Test that true and test are the same
+    pd.testing.assert_frame_equal(df_test,df_true)
+    pd.testing.assert_frame_equal(changes_test,changes_true)
@@ -0,0 +1,65 @@
+import os
+import warnings
+
+import pytest
+import pandas as pd
+import numpy as np
+
+from src.model_cache import ModelCache, artifact_key, data_key
+from src.model_pipeline import fit_kmeans, scale_features
+
+def test_model_cache_shares_fits(tmp_path, monkeypatch):
+    # Define input DataFrame with two groups of players
+    rng = np.random.RandomState(0)
+    df_in = pd.DataFrame(np.vstack([rng.normal(center, .1, size=(10, 2)) for center in (0, 5)]), columns=['ppm','rpm'])
+
+    cache = ModelCache(str(tmp_path))
+    scaled, key, _ = scale_features(df_in, ['ppm','rpm'], cache)
+    fit_in = fit_kmeans(scaled, 2, 'k-means++', 10, 300, 3295, cache, key)
+
+    # Reopen the cache as a new run would and make any refit fail
+    cache_test = ModelCache(str(tmp_path))
+    monkeypatch.setattr('sklearn.cluster.KMeans', None)
+    scaled_test, key_test, _ = scale_features(df_in, ['ppm','rpm'], cache_test)
+    fit_test = fit_kmeans(scaled_test, 2, 'k-means++', 10, 300, 3295, cache_test, key_test)
+
+    # Test that the cached scaler and fit are reused
+    assert key_test == key
+    assert np.array_equal(scaled_test, scaled)
+    assert np.array_equal(fit_test.labels, fit_in.labels)
+    assert np.array_equal(fit_test.centroids, fit_in.centroids)
+    assert fit_test.inertia == fit_in.inertia
+
+def test_model_cache_scaler_feature_names(tmp_path):
+    # Define input DataFrame and cache its scaler
+    df_in = pd.DataFrame({'ppm': [.1, .5, .9], 'rpm': [.2, .3, .7]})
+    scale_features(df_in, ['ppm','rpm'], ModelCache(str(tmp_path)))
+
+    # Reload the scaler from the cache, failing on any warning such as sklearn's missing feature names check
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        _, _, scaler = scale_features(df_in, ['ppm','rpm'], ModelCache(str(tmp_path)))
+        scaler.transform(df_in[['ppm','rpm']])
+
+    # Test that the cached scaler knows the columns it was fitted on
+    assert list(scaler.feature_names_in_) == ['ppm','rpm']
+    assert scaler.n_features_in_ == 2
+
+def test_model_cache_keys():
+    df_in = pd.DataFrame({'ppm': [.5, 1.], 'rpm': [.25, .1]})
+
+    # Changing a value or a setting changes the key
+    assert data_key(df_in) == data_key(df_in.copy())
+    assert data_key(df_in) != data_key(df_in.assign(ppm=[.5, 1.1]))
+    assert artifact_key('abc', 'kmeans', 5, 3295) != artifact_key('abc', 'kmeans', 5, 4986)
+
+def test_model_cache_eviction(tmp_path):
+    # Define a cache with room for about one artifact
+    cache = ModelCache(str(tmp_path), max_size_mb=.0012)
+    cache.put('old', values=np.zeros(100))
+    os.utime(str(tmp_path / 'old.npz'), (0, 0))
+    cache.put('new', values=np.ones(100))
+
+    # The least recently used artifact is removed
+    assert ModelCache(str(tmp_path)).get('old') is None
+    assert np.array_equal(ModelCache(str(tmp_path)).get('new')['values'], np.ones(100))
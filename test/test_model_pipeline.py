@@ -0,0 +1,173 @@
+import pytest
+import pandas as pd
+import numpy as np
+import sqlalchemy as sql
+
+import src.model_pipeline as model_pipeline
+
+def test_optimal_clusternum_parallel(tmp_path):
+    # Define input DataFrame with three well separated groups of players
+    rng = np.random.RandomState(0)
+    df_in = pd.DataFrame(np.vstack([rng.normal(center, .1, size=(20, 2)) for center in (0, 5, 10)]), columns=['ppm','rpm'])
+    metrics_path = str(tmp_path / 'metrics.csv')
+
+    # Run test by sweeping the cluster numbers serially and with a pool of processes
+    metrics_serial = model_pipeline.optimal_clusternum(df_in,2,6,['ppm','rpm'],'k-means++',10,300,3295,n_jobs=1)
+    metrics_test = model_pipeline.optimal_clusternum(df_in,2,6,['ppm','rpm'],'k-means++',10,300,3295,metrics_path,n_jobs=2)
+
+    # Assert the parallel sweep matches the serial one in cluster number order and is saved for plotting
+    assert list(metrics_test['n_clusters']) == [2, 3, 4, 5]
+    assert np.allclose(metrics_test['sse'], metrics_serial['sse'])
+    assert np.allclose(metrics_test['silhouette'], metrics_serial['silhouette'])
+    assert metrics_test['silhouette'].idxmax() == 1
+    pd.testing.assert_frame_equal(pd.read_csv(metrics_path), metrics_test)
+
+def test_cluster_silhouette_modes():
+    # Define input features and cluster labels for two noisy groups of players
+    rng = np.random.RandomState(1)
+    features_in = np.vstack([rng.normal(center, 1, size=(300, 3)) for center in (0, 2)])
+    labels_in = np.repeat([0, 1], 300)
+
+    # Run test by calculating the score in every mode
+    exact, exact_margin = model_pipeline.cluster_silhouette(features_in, labels_in)
+    chunked, _ = model_pipeline.cluster_silhouette(features_in, labels_in, mode='chunked', working_memory=1)
+    everyone, _ = model_pipeline.cluster_silhouette(features_in, labels_in, mode='sampled', sample_size=600)
+    sampled, margin = model_pipeline.cluster_silhouette(features_in, labels_in, mode='sampled', sample_size=200, random_state=0)
+
+    # Assert bounded-memory and full-sample scores match the exact score and the sampled interval covers it
+    assert exact_margin == 0
+    assert chunked == pytest.approx(exact)
+    assert everyone == pytest.approx(exact)
+    assert 0 < margin < .05
+    assert abs(sampled-exact) <= margin
+
+def test_cluster_silhouette_bad_mode():
+    with pytest.raises(ValueError):
+        model_pipeline.cluster_silhouette(np.zeros((4, 2)), np.array([0, 0, 1, 1]), mode='approximate')
+
+def test_assign_players_matches_final_fit(tmp_path):
+    # Define input DataFrame with three well separated groups of players
+    rng = np.random.RandomState(2)
+    df_in = pd.DataFrame(np.vstack([rng.normal(center, .1, size=(20, 2)) for center in (0, 5, 10)]), columns=['ppm','rpm'])
+    label_map_in = {0: 'Guard', 1: 'Wing', 2: 'Big'}
+    model_path = str(tmp_path / 'cluster_model.json')
+
+    # Fit the clusters and save the model, then label the same players from the saved model alone
+    scaled, _, scaler = model_pipeline.scale_features(df_in, ['ppm','rpm'])
+    fit = model_pipeline.fit_kmeans(scaled, 3, 'k-means++', 10, 300, 3295)
+    model_pipeline.save_cluster_model(model_path, scaler, fit, ['ppm','rpm'], label_map_in, 'player_type', 3295)
+    df_test = model_pipeline.assign_players(df_in, model_pipeline.load_cluster_model(model_path))
+
+    # Test that every player gets the player type of their cluster in the final fit
+    assert list(df_test['player_type']) == [label_map_in[label] for label in fit.labels]
+    assert 'player_type' not in df_in.columns
+
+def test_assign_players_writes_one_player(tmp_path):
+    from src.results_db import ResultsManager, create_db, read_leaderboard
+    from test_results_db import player_rows
+
+    # Define a table of players from three well separated groups labelled by a saved cluster model
+    rng = np.random.RandomState(2)
+    features_in = np.vstack([rng.normal(center, .1, size=(20, 2)) for center in (0, 5, 10)])
+    df_in = player_rows(['player-%02i' % i for i in range(len(features_in))])
+    df_in['ppm'], df_in['rpm'] = features_in[:, 0], features_in[:, 1]
+    model_path = str(tmp_path / 'cluster_model.json')
+    scaled, _, scaler = model_pipeline.scale_features(df_in, ['ppm','rpm'])
+    fit = model_pipeline.fit_kmeans(scaled, 3, 'k-means++', 10, 300, 3295)
+    model_pipeline.save_cluster_model(model_path, scaler, fit, ['ppm','rpm'], {0: 'Guard', 1: 'Wing', 2: 'Big'}, 'player_type', 3295)
+    model = model_pipeline.load_cluster_model(model_path)
+
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    # Leaderboards longer than a group hold every player of their type
+    rm = ResultsManager(engine_string=engine_string, leaderboard_size=30)
+    rm.bulk_load(model_pipeline.assign_players(df_in, model))
+
+    # Run test by labelling one new player next to the first group, recording every statement sent to the database
+    df_new = player_rows(['new-player'])
+    df_new['ppm'], df_new['rpm'] = features_in[0]
+    player = model_pipeline.assign_players(df_new, model)
+    player_type = player['player_type'].iloc[0]
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((' '.join(statement.split()), str(parameters)))
+    sql.event.listen(rm.session.get_bind(), 'before_cursor_execute', record)
+    rm.update_players(player)
+    sql.event.remove(rm.session.get_bind(), 'before_cursor_execute', record)
+
+    # Test that the new row is the only Results row written and no query reads the whole table
+    results = [(statement, parameters) for statement, parameters in statements if ' results' in statement]
+    assert [statement.split()[0] for statement, _ in results if not statement.startswith('SELECT')] == ['INSERT']
+    assert all('WHERE' in statement for statement, _ in results if statement.startswith('SELECT'))
+    assert 'new-player' in [parameters for statement, parameters in results if statement.startswith('INSERT')][0]
+
+    # Test that only the leaderboards of the new player's type were rewritten
+    leaderboards = [parameters for statement, parameters in statements
+                    if ' leaderboards' in statement and not statement.startswith('SELECT')]
+    assert leaderboards and all(player_type in parameters for parameters in leaderboards)
+    assert all(other not in parameters for parameters in leaderboards for other in {'Guard', 'Wing', 'Big'} - {player_type})
+    assert 'new-player' in [p['player_id'] for p in read_leaderboard(rm.session, player_type, 'ppm')]
+    rm.close()
+
+def test_final_cluster_fit_without_stability_labels():
+    # Define input DataFrame that has not been through the stability test, so it has no second run's labels
+    rng = np.random.RandomState(2)
+    df_in = pd.DataFrame(np.vstack([rng.normal(center, .1, size=(20, 2)) for center in (0, 5)]), columns=['ppm','rpm'])
+
+    # Run the final fit on its own
+    df_test = model_pipeline.final_cluster_fit(df_in, ['ppm','rpm'], 'k-means++', 10, 300, 3295, 2, 'cluster', 'cluster2',
+                                               {0: 'Guard', 1: 'Big'}, 'player_type')
+
+    # Test that every player gets a player type and the label columns are dropped
+    assert set(df_test['player_type']) == {'Guard', 'Big'}
+    assert 'cluster' not in df_test.columns
+
+def test_fit_kmeans_minibatch():
+    # Define input features for three well separated groups of players
+    rng = np.random.RandomState(3)
+    features_in = np.vstack([rng.normal(center, .1, size=(200, 2)) for center in (0, 5, 10)])
+
+    # Run test by fitting both engines, labelling the mini-batch fit in small chunks
+    full = model_pipeline.fit_kmeans(features_in, 3, 'k-means++', 10, 300, 3295)
+    minibatch = model_pipeline.fit_kmeans(features_in, 3, 'k-means++', 10, 300, 3295, engine='minibatch', batch_size=64)
+
+    # Assert the engines find the same clusters, up to their numbering, and the same SSE
+    assert len(set(zip(full.labels, minibatch.labels))) == 3
+    assert minibatch.inertia == pytest.approx(full.inertia, rel=.01)
+    assert minibatch.centroids.shape == (3, 2)
+
+def test_fit_kmeans_bad_engine():
+    with pytest.raises(ValueError):
+        model_pipeline.fit_kmeans(np.zeros((4, 2)), 2, 'k-means++', 1, 10, 0, engine='spectral')
+
+def test_align_labels():
+    # Define a labelling and the same clusters under other numbers, with one player moved
+    reference_in = np.array([0, 0, 1, 1, 2, 2, 2])
+    labels_in = np.array([2, 2, 0, 0, 1, 1, 0])
+
+    # Run test by aligning the second labelling with the first
+    aligned_test = model_pipeline.align_labels(reference_in, labels_in, 3)
+
+    # Assert the clusters take the numbers of the reference clusters they overlap most
+    assert list(aligned_test) == [0, 0, 1, 1, 2, 2, 1]
+
+def test_cluster_stability_report(tmp_path):
+    # Define input DataFrame with three well separated groups of players
+    rng = np.random.RandomState(4)
+    df_in = pd.DataFrame(np.vstack([rng.normal(center, .1, size=(20, 2)) for center in (0, 5, 10)]), columns=['ppm','rpm'])
+    savepath = str(tmp_path / 'perc_similar.csv')
+
+    # Run test by comparing five seeds and five bootstrap resamples, fitting the seeds across two processes
+    report_test = model_pipeline.test_cluster_stability(df_in,['ppm','rpm'],'k-means++',10,300,3295,3,4986,'cluster','cluster2',2,savepath,
+                                                        n_seeds=5,n_jobs=2,report_path=str(tmp_path / 'report.csv'))
+    report_boot = model_pipeline.test_cluster_stability(df_in,['ppm','rpm'],'k-means++',10,300,3295,3,4986,'cluster','cluster2',2,savepath,
+                                                        n_seeds=5,bootstrap=True)
+
+    # Assert every run of well separated clusters agrees after alignment
+    assert list(report_test['cluster']) == ['0', '1', '2', 'overall']
+    assert list(report_test['n_players']) == [20, 20, 20, 60]
+    assert (report_test['min_agreement'] == 100).all()
+    assert (report_boot['mean_agreement'] == 100).all()
+    assert (df_in['cluster'] == df_in['cluster2']).all()
+    assert pd.read_csv(savepath)['perc_similar'][0] == 100
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmp_path / 'report.csv'), dtype={'cluster': str}), report_test, check_dtype=False)
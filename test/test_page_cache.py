@@ -0,0 +1,36 @@
+from src.page_cache import PageCache
+
+def test_page_cache_hits_and_version():
+    version = [1]
+    builds = []
+    def build(key):
+        builds.append(key)
+        return 'page %s v%i' % (key, version[0])
+
+    # Run test by checking the version on every request and caching two pages of at most two
+    cache = PageCache(lambda: version[0], max_entries=2, version_check_seconds=0)
+    assert cache.get('a', lambda: build('a')) == 'page a v1'
+    assert cache.get('a', lambda: build('a')) == 'page a v1'
+    cache.get('b', lambda: build('b'))
+    cache.get('c', lambda: build('c'))
+
+    # Test that the repeat view was a hit and the least recently used page was dropped
+    assert builds == ['a', 'b', 'c']
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'entries': 2, 'version': 1}
+
+    # A new dataset version drops every cached page
+    version[0] = 2
+    assert cache.get('c', lambda: build('c')) == 'page c v2'
+    assert cache.stats()['entries'] == 1
+
+def test_page_cache_version_check_interval():
+    calls = []
+    def get_version():
+        calls.append(1)
+        return 1
+
+    # Test that the version stamp is read once within the check interval
+    cache = PageCache(get_version, version_check_seconds=60)
+    for _ in range(3):
+        cache.get('a', lambda: 'page')
+    assert len(calls) == 1
@@ -0,0 +1,22 @@
+import os
+
+import pytest
+import pandas as pd
+
+from src.plots import PlotRenderer
+
+def test_plot_renderer(tmp_path):
+    # Define saved metrics and labelled players
+    metrics_in = pd.DataFrame({'n_clusters': [2, 3, 4], 'sse': [30., 20., 15.], 'silhouette': [.3, .4, .35], 'silhouette_margin': [0., 0., 0.]})
+    clusters_in = pd.DataFrame({'ppm': [.5, .2, .4, .1], 'three_point_attempt_rate': [.6, .1, .5, .2], 'player_type': ['Shooter', 'Big', 'Shooter', 'Big']})
+    paths = {'SSEpath': str(tmp_path / 'sse.png'), 'silpath': str(tmp_path / 'sil.png'), 'clust_plot': str(tmp_path / 'clusters.png')}
+
+    # Run test by rendering in a background process
+    plots = PlotRenderer(scatterx_col='ppm', scattery_col='three_point_attempt_rate', palette='deep', clust_title='title', **paths)
+    plots.plot_metrics(metrics_in)
+    plots.plot_clusters(clusters_in, 'player_type')
+    plots.close()
+
+    # Test that every plot was written
+    for path in paths.values():
+        assert os.path.getsize(path) > 0
@@ -0,0 +1,195 @@
+import pytest
+import pandas as pd
+import sqlalchemy as sql
+
+from src.results_db import (Results, ResultsManager, SORT_COLUMNS, build_leaderboards, check_indexes, create_db, migrate_db,
+                            page_query, pool_stats, read_leaderboard, results_records)
+
+def player_rows(player_ids, player_type='Shooting Big'):
+    # Build cleaned player rows with every column the Results table is filled from
+    return pd.DataFrame({'player_id': player_ids, 'name': ['Player %i' % i for i in range(len(player_ids))], 'year': 'Freshman',
+                         'position': 'Guard', 'height': 77., 'weight': 190, 'player_type': player_type, 'team': 'memphis',
+                         'conference': 'aac', 'games_played': 20, 'games_started': 10, 'field_goal_percentage': .4567,
+                         'three_point_percentage': .333, 'free_throw_percentage': .8, 'points': 300, 'ppm': .51234, 'assists': 40,
+                         'apm': .0712, 'assist_percentage': 12.346, 'total_rebounds': 90, 'rpm': .15, 'total_rebound_percentage': 8.1,
+                         'blocks': 5, 'bpm': .01, 'block_percentage': 1.2, 'steals': 20, 'spm': .034, 'steal_percentage': 2.2,
+                         'turnovers': 30, 'tpm': .05, 'turnover_percentage': 14.4, 'usage_percentage': 21.3, 'player_efficiency_rating': 15.5})
+
+def test_results_records():
+    # Run test by converting one player
+    record_test = results_records(player_rows(['james-wiseman-1']))[0]
+
+    # Test that counts are plain integers and rates are rounded to two digits
+    assert record_test['height'] == 77 and type(record_test['height']) is int
+    assert record_test['ppm'] == .51 and record_test['a_perc'] == 12.35
+    assert record_test['player_name'] == 'Player 0'
+
+def test_bulk_load_and_update(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+
+    # Run test by loading three players in batches of two, then relabelling one of them
+    assert rm.bulk_load(player_rows(['a', 'b', 'c']), batch_size=2) == 3
+    rm.update_players(player_rows(['b'], player_type='Paint Presence'))
+
+    # Test that every player was loaded and only the updated player changed
+    types = dict(rm.session.query(Results.player_id, Results.player_type).all())
+    assert types == {'a': 'Shooting Big', 'b': 'Paint Presence', 'c': 'Shooting Big'}
+
+    # Loading a player that already exists rolls back the whole load
+    with pytest.raises(sql.exc.IntegrityError):
+        rm.bulk_load(player_rows(['d', 'a']))
+    assert rm.session.query(Results).count() == 3
+    rm.close()
+
+def test_sync(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+    rm.bulk_load(player_rows(['a', 'b', 'c']))
+
+    # Run test by syncing a refresh that relabels b, drops c and adds d
+    new = pd.concat([player_rows(['a']), player_rows(['b'], player_type='Paint Presence'), player_rows(['d'])])
+    counts = rm.sync(new, batch_size=2)
+
+    # Test that only the changed rows were written and the table matches the refresh
+    assert counts == {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1}
+    types = dict(rm.session.query(Results.player_id, Results.player_type).all())
+    assert types == {'a': 'Shooting Big', 'b': 'Paint Presence', 'd': 'Shooting Big'}
+
+    # Syncing the same data again writes nothing
+    assert rm.sync(new) == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3}
+
+    # The dataset version was bumped by the load and the first sync only
+    assert rm.dataset_version() == 2
+    rm.close()
+
+def test_load_database_without_newer_tables(tmp_path):
+    # Create a database holding only the Results table, as older versions of create_db did
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    Results.__table__.create(sql.create_engine(engine_string))
+    rm = ResultsManager(engine_string=engine_string, leaderboard_size=2)
+
+    # Run test by loading and then syncing players
+    assert rm.bulk_load(player_rows(['a', 'b', 'c'])) == 3
+    assert rm.sync(player_rows(['a', 'b']))['deleted'] == 1
+
+    # Test that the missing tables were added and written
+    assert [player['player_id'] for player in read_leaderboard(rm.session, 'Shooting Big', 'ppm')] == ['b', 'a']
+    assert rm.dataset_version() == 2
+    rm.close()
+
+def test_migrate_and_check_indexes(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+
+    # Drop the indexes to stand in for a database created before they existed
+    engine = sql.create_engine(engine_string)
+    for index in Results.__table__.indexes:
+        index.drop(engine)
+    assert check_indexes(engine_string) == SORT_COLUMNS
+
+    # Run test by migrating twice, the second run finding nothing to do
+    assert len(migrate_db(engine_string)) == len(SORT_COLUMNS)
+    assert migrate_db(engine_string) == []
+
+    # Test that every sort column's query is now served from an index
+    assert check_indexes(engine_string) == []
+
+def test_build_leaderboards():
+    records = results_records(player_rows(['a', 'b', 'c']))
+    records[1]['points'], records[2]['points'], records[2]['player_type'] = 500, 900, 'Paint Presence'
+
+    # Run test by building leaderboards of two players
+    leaderboards = {(row['player_type'], row['sort_col']): row['players'] for row in build_leaderboards(records, size=2)}
+
+    # Test that there is one leaderboard per player type and sort column, sorted largest first
+    assert len(leaderboards) == 2*len(SORT_COLUMNS)
+    assert '"player_id":"b"' in leaderboards[('Shooting Big', 'points')].split('},{')[0]
+    assert '"player_id":"c"' in leaderboards[('Paint Presence', 'points')]
+
+def test_leaderboards_follow_writes(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string, leaderboard_size=2)
+    rm.bulk_load(player_rows(['a', 'b', 'c']))
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Shooting Big', 'points')] == ['c', 'b']
+
+    # Run test by relabelling c, then syncing a refresh without b
+    rm.update_players(player_rows(['c'], player_type='Paint Presence'))
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Shooting Big', 'points')] == ['b', 'a']
+    rm.sync(pd.concat([player_rows(['a']), player_rows(['c'], player_type='Paint Presence')]))
+
+    # Test that the leaderboards match the table after every write
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Shooting Big', 'points')] == ['a']
+    assert read_leaderboard(rm.session, 'Shooting Big', 'usage') is None
+    rm.close()
+
+def test_update_players_leaves_other_leaderboards(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string, leaderboard_size=2)
+    rm.bulk_load(pd.concat([player_rows(['a', 'b']), player_rows(['c'], player_type='Paint Presence'),
+                            player_rows(['d'], player_type='Stretch Forward')]))
+
+    # Run test by relabelling a, recording the leaderboard rows written
+    written = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if 'leaderboards' in statement and not statement.lstrip().startswith('SELECT'):
+            written.append(str(parameters))
+    sql.event.listen(rm.session.get_bind(), 'before_cursor_execute', record)
+    rm.update_players(player_rows(['a'], player_type='Paint Presence'))
+    sql.event.remove(rm.session.get_bind(), 'before_cursor_execute', record)
+    written = ''.join(written)
+
+    # Test that only the leaderboards of the player types a left and joined were rewritten
+    assert 'Shooting Big' in written and 'Paint Presence' in written
+    assert 'Stretch Forward' not in written
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Shooting Big', 'points')] == ['b']
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Paint Presence', 'points')] == ['c', 'a']
+    assert [p['player_id'] for p in read_leaderboard(rm.session, 'Stretch Forward', 'points')] == ['d']
+    rm.close()
+
+def test_page_query_keyset(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+    df = player_rows(['a', 'b', 'c', 'd', 'e'])
+    df['ppm'] = [.5, .7, .5, .5, .1]
+    rm.bulk_load(df)
+
+    # Run test by paging two players at a time, seeking past the last player of each page
+    pages, after = [], None
+    while True:
+        page = page_query(rm.session, 'Shooting Big', 'ppm', 2, after).all()
+        if not page:
+            break
+        pages.append([player.player_id for player in page])
+        after = (page[-1].ppm, page[-1].player_id)
+
+    # Test that players tied on the sort column are split across pages without repeats or gaps
+    assert pages == [['b', 'd'], ['c', 'a'], ['e']]
+    rm.close()
+
+def test_health_and_pool_stats(tmp_path):
+    engine_string = 'sqlite:///%s' % (tmp_path / 'results.db')
+    create_db(engine_string)
+    rm = ResultsManager(engine_string=engine_string)
+
+    # Test that the health check reaches the database
+    assert rm.health()['database'] is True
+
+    # Run test by holding one connection of a queue pool like the ones used for MySQL
+    engine = sql.create_engine(engine_string, poolclass=sql.pool.QueuePool, pool_size=2, max_overflow=1)
+    conn = engine.connect()
+    stats = pool_stats(engine.pool)
+    conn.close()
+
+    # Test that the pool counters are reported
+    assert stats['class'] == 'QueuePool' and stats['size'] == 2 and stats['checkedout'] == 1
+
+    # Test that pools without counters, such as the one used for in-memory SQLite, report only their class
+    assert pool_stats(sql.create_engine('sqlite://').pool) == {'class': 'SingletonThreadPool'}
+    rm.dispose()
+    rm.close()
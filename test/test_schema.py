@@ -0,0 +1,22 @@
+import pandas as pd
+import numpy as np
+
+from src.schema import apply_schema
+
+def test_apply_schema():
+    # Define input DataFrame as pandas would read it from a CSV
+    df_in = pd.DataFrame([['james-wiseman','2020-21','Center',83,np.nan,.417,1.5],['evan-mobley','2020-21','Forward',84,215.,.3,2.25]],
+                         columns=['player_id','season','position','height','weight','three_point_percentage','ppm'])
+
+    # Run test by calling function
+    df_test = apply_schema(df_in.copy(),'test')
+
+    # Test that the types are compact and the values are unchanged
+    assert df_test['player_id'].dtype == object
+    assert df_test['season'].dtype.name == 'category'
+    assert df_test['position'].dtype.name == 'category'
+    assert df_test['height'].dtype == np.int8
+    assert df_test['weight'].dtype == np.float32
+    assert df_test['three_point_percentage'].dtype == np.float64
+    assert df_test['ppm'].dtype == np.float32
+    pd.testing.assert_frame_equal(df_test,df_in,check_dtype=False,check_categorical=False)
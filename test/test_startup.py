@@ -0,0 +1,21 @@
+import pytest
+
+from src.startup import parse_importtime, startup_report
+
+def test_startup_report():
+    # Define standard error from a process run with `python -X importtime`
+    lines_in = ['import time: self [us] | cumulative | imported package\n',
+                'import time:       100 |        100 |   pandas.core\n',
+                'import time:       400 |        500 | pandas\n',
+                'import time:        50 |         50 | yaml\n',
+                'INFO Database created\n']
+
+    # Run test by parsing the timings and summarizing them
+    imports_test, other_test = parse_importtime(lines_in)
+    report_test = startup_report(imports_test)
+
+    # Test that nested imports are not counted twice and other output is kept
+    assert imports_test == [('pandas.core', 1, .0001), ('pandas', 0, .0005), ('yaml', 0, .00005)]
+    assert other_test == ['INFO Database created\n']
+    assert report_test.splitlines()[0] == 'Startup import time: 0.001s across 3 modules'
+    assert report_test.splitlines()[1].split() == ['0.001s', 'pandas']